@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+PANDA — Artifact store STL (content-addressed)
+===============================================
+
+Evita di ricompilare con OpenSCAD/CGAL lo stesso sorgente due volte.
+
+- chiave compilazione = sha256(forma canonica del sorgente SCAD (scad_canon),
+  preset $fn, formato export, versione OpenSCAD, override -D, contenuto dei
+  file include/use/import/surface risolti) → mesh già prodotta:
+  sorgenti diversi solo per spazi/commenti/formato numeri condividono la mesh;
+  se una dipendenza non è risolvibile (path non letterale, file assente)
+  la compilazione non passa dallo store
+- mesh salvate una sola volta per contenuto (sha256 del file STL) in
+  ~/panda/artifacts/stl/ab/abcdef….stl; sorgenti diversi che producono la
+  stessa mesh condividono lo stesso blob
+- gli STL in models/stl/ sono hardlink ai blob (copia se il filesystem non
+  supporta hardlink): un hit costa millisecondi e nessun byte in più
+- esiti di validate_scad memorizzati sui byte grezzi del sorgente (i
+  commenti dei range del customizer contano) + dipendenze
+
+I blob sono in sola lettura: un hardlink condivide l'inode, scrivere sul
+file in models/stl/ modificherebbe ogni copia. Il worker sostituisce
+sempre gli STL con os.replace.
+
+Indice SQLite in ~/panda/db/artifacts.sqlite3.
+
+Uso da CLI:
+  python3 artifact_store.py              statistiche
+  python3 artifact_store.py --gc         rimuove blob non più usati da models/stl/
+  python3 artifact_store.py --gc --min-age-days 30
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+import scad_canon
+
+# =========================
+# PATHS
+# =========================
+
+PANDA_HOME = Path.home() / "panda"
+ARTIFACTS_DIR = PANDA_HOME / "artifacts"
+BLOBS_DIR = ARTIFACTS_DIR / "stl"
+DB_DIR = PANDA_HOME / "db"
+ARTIFACTS_DB = DB_DIR / "artifacts.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS compiles (
+    key          TEXT PRIMARY KEY,
+    mesh_sha     TEXT NOT NULL,
+    compile_log  TEXT,
+    created_at   TEXT,
+    last_hit_at  TEXT,
+    hits         INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_compiles_mesh ON compiles(mesh_sha);
+CREATE TABLE IF NOT EXISTS validations (
+    key        TEXT PRIMARY KEY,
+    scad_file  TEXT,
+    result     TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS meshes (
+    sha        TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    created_at TEXT
+);
+"""
+
+# =========================
+# CONNESSIONE
+# =========================
+
+def connect(db_path=None):
+    db_path = Path(db_path or ARTIFACTS_DB)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+# =========================
+# CHIAVI E BLOB
+# =========================
+
+def _resolve(spec, base_dir):
+    """Path di include/use/import come li cerca OpenSCAD: cartella del file, poi OPENSCADPATH."""
+    dirs = [base_dir] + [Path(d) for d in os.environ.get("OPENSCADPATH", "").split(os.pathsep) if d]
+    for d in dirs:
+        candidate = (d / Path(spec).expanduser()).resolve()
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def dependency_digest(scad_path):
+    """
+    sha256 dei file da cui dipende la geometria (include/use ricorsivi,
+    import/surface), risolti rispetto alla cartella di ciascun file: "" se
+    il sorgente non ne ha, None se uno non è risolvibile (lo store va saltato).
+    """
+    h = hashlib.sha256()
+    seen, stack, found = set(), [Path(scad_path).resolve()], False
+    while stack:
+        current = stack.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        for kind, spec in scad_canon.external_refs(current.read_bytes()):
+            path = _resolve(spec, current.parent) if spec else None
+            if path is None:
+                return None
+            found = True
+            h.update(f"{kind}\0{spec}\0{file_sha256(path)}\0".encode())
+            if kind in ("include", "use"):
+                stack.append(path)
+    return h.hexdigest() if found else ""
+
+
+def compile_key(source, fn_value=None, stl_format="asciistl", openscad_version="", defines=None, dependencies=""):
+    """
+    Chiave della compilazione: sorgente canonico (bytes o str) + parametri che
+    cambiano la mesh, compresi gli override `-D nome=valore` ({nome: letterale})
+    e il digest delle dipendenze (dependency_digest).
+    """
+    h = hashlib.sha256()
+    h.update(scad_canon.canonical_hash(source).encode())
+    if dependencies:
+        h.update(f"\0deps={dependencies}".encode())
+    for part in (fn_value, stl_format, openscad_version):
+        h.update(b"\0")
+        h.update(str("" if part is None else part).encode())
+    for name, value in sorted((defines or {}).items()):
+        h.update(f"\0-D{name}={value}".encode())
+    return h.hexdigest()
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def blob_path(sha):
+    return BLOBS_DIR / sha[:2] / f"{sha}.stl"
+
+
+def _tmp_path(path):
+    """File temporaneo accanto a path, unico per processo e thread (compile e variant executor)."""
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _link_or_copy(src, dst):
+    """Hardlink atomico src → dst (copia se l'hardlink non è possibile)."""
+    dst = Path(dst)
+    tmp = _tmp_path(dst)
+    try:
+        tmp.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, tmp)
+        linked = True
+    except OSError:
+        shutil.copy2(src, tmp)
+        linked = False
+    os.replace(tmp, dst)
+    return linked
+
+# =========================
+# OPERAZIONI
+# =========================
+
+def lookup(key):
+    """Ritorna {"sha", "blob", "compile_log", "size"} se la compilazione è nota e il blob esiste."""
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT c.mesh_sha, c.compile_log, m.size FROM compiles c "
+            "JOIN meshes m ON m.sha = c.mesh_sha WHERE c.key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        blob = blob_path(row["mesh_sha"])
+        if not blob.exists():
+            with conn:
+                conn.execute("DELETE FROM compiles WHERE mesh_sha = ?", (row["mesh_sha"],))
+                conn.execute("DELETE FROM meshes WHERE sha = ?", (row["mesh_sha"],))
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE compiles SET hits = hits + 1, last_hit_at = ? WHERE key = ?",
+                (datetime.now().isoformat(), key),
+            )
+    return {"sha": row["mesh_sha"], "blob": blob, "compile_log": row["compile_log"] or "", "size": row["size"]}
+
+
+def materialize(entry, dest):
+    """Mette il blob in dest (hardlink). Ritorna True se riuscito."""
+    try:
+        _link_or_copy(entry["blob"], dest)
+        return True
+    except OSError:
+        return False
+
+
+def store(key, stl_path, compile_log=""):
+    """
+    Registra una compilazione riuscita: lo STL diventa (o si aggancia a) un
+    blob content-addressed e stl_path viene sostituito da un hardlink al blob,
+    così mesh identiche occupano spazio una sola volta. Ritorna lo sha della mesh.
+    """
+    stl_path = Path(stl_path)
+    sha = file_sha256(stl_path)
+    blob = blob_path(sha)
+    if not blob.exists():
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = _tmp_path(blob)
+        shutil.copy2(stl_path, tmp)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, blob)
+    try:
+        if not os.path.samefile(blob, stl_path):
+            _link_or_copy(blob, stl_path)
+    except OSError:
+        pass
+    now = datetime.now().isoformat()
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO meshes (sha, size, created_at) VALUES (?, ?, ?)",
+            (sha, blob.stat().st_size, now),
+        )
+        conn.execute(
+            "INSERT INTO compiles (key, mesh_sha, compile_log, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET mesh_sha = excluded.mesh_sha, compile_log = excluded.compile_log",
+            (key, sha, compile_log, now),
+        )
+    return sha
+
+
+def validation_key(source, openscad_version="", dependencies=""):
+    """
+    Chiave di validate_scad sui byte grezzi: --check-parameter-ranges legge
+    i commenti del customizer (`w = 5; // [0:10]`), che la forma canonica
+    scarta. Più il digest delle dipendenze (dependency_digest).
+    """
+    if isinstance(source, str):
+        source = source.encode()
+    h = hashlib.sha256(b"validate\0" + source)
+    h.update(f"\0{openscad_version}\0deps={dependencies}".encode())
+    return h.hexdigest()
+
+
+def lookup_validation(key):
+    """Esito validate_scad già calcolato per un sorgente equivalente: (result, scad_file) o None."""
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT result, scad_file FROM validations WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row["result"]), row["scad_file"]
+
+
+def store_validation(key, scad_file, result):
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO validations (key, scad_file, result, created_at) VALUES (?, ?, ?, ?)",
+            (key, str(scad_file), json.dumps(result), datetime.now().isoformat()),
+        )
+
+
+def stats():
+    with closing(connect()) as conn:
+        compiles = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM compiles").fetchone()
+        meshes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM meshes").fetchone()
+    return {
+        "compiles": compiles[0],
+        "hits": compiles[1],
+        "meshes": meshes[0],
+        "size_kb": round(meshes[1] / 1024, 1),
+    }
+
+
+def gc(min_age_days=0):
+    """
+    Rimuove i blob che nessun file in models/stl/ usa più (link count 1)
+    e le compilazioni che puntano ad essi. Con copie al posto di hardlink il
+    link count è sempre 1: usare min_age_days per tenere i blob recenti.
+    """
+    removed, freed = 0, 0
+    cutoff = time.time() - min_age_days * 86400
+    with closing(connect()) as conn:
+        for row in conn.execute("SELECT sha FROM meshes").fetchall():
+            blob = blob_path(row["sha"])
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                st = None
+            if st is not None and (st.st_nlink > 1 or st.st_mtime > cutoff):
+                continue
+            if st is not None:
+                blob.unlink()
+                freed += st.st_size
+            removed += 1
+            with conn:
+                conn.execute("DELETE FROM compiles WHERE mesh_sha = ?", (row["sha"],))
+                conn.execute("DELETE FROM meshes WHERE sha = ?", (row["sha"],))
+    return {"removed": removed, "freed_kb": round(freed / 1024, 1)}
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — artifact store STL")
+    parser.add_argument("--gc", action="store_true", help="Rimuove i blob non più usati da models/stl/")
+    parser.add_argument("--min-age-days", type=float, default=0, help="Con --gc: tieni i blob più recenti")
+    args = parser.parse_args()
+
+    if args.gc:
+        res = gc(args.min_age_days)
+        print(f"GC: {res['removed']} blob rimossi, {res['freed_kb']} KB liberati")
+    st = stats()
+    print(f"Compilazioni note: {st['compiles']}  (hit totali: {st['hits']})")
+    print(f"Mesh uniche     : {st['meshes']}  ({st['size_kb']} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from flask import Flask, jsonify, request, render_template, send_file, abort
 import json
 import shutil
 import subprocess
+import sys
 import time
 from datetime import datetime, date
 from pathlib import Path
@@ -12,6 +13,13 @@ try:
 except ImportError:
     _HAS_PSUTIL = False
 
+# Moduli condivisi con il worker (root del progetto)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import model_index
+import results_store
+import stl_io
+import task_queue
+
 app = Flask(__name__)
 
 PANDA_HOME = Path.home() / "panda"
@@ -47,19 +55,11 @@ def _load_status():
 
 
 def _get_result_for_stl(stl_filename):
-    """Cerca il result JSON che ha generato un determinato STL."""
-    if not RESULTS_DIR.exists():
+    """Cerca il result che ha generato un determinato STL (indice stl_file)."""
+    try:
+        return results_store.for_stl(stl_filename)
+    except Exception:
         return None
-    stl_name = Path(stl_filename).name
-    for f in sorted(RESULTS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
-        try:
-            data = json.loads(f.read_text())
-            stl_file = data.get("stl_file", "")
-            if stl_file and Path(stl_file).name == stl_name:
-                return data
-        except Exception:
-            continue
-    return None
 
 
 def _safe_name(filename):
@@ -93,22 +93,20 @@ def api_status():
 
 @app.route('/api/tasks/pending')
 def api_tasks_pending():
+    # Task aggiunti o rimossi a mano (anche a worker fermo): l'indice si
+    # riallinea solo se l'mtime di tasks/ è cambiato dall'ultima sync
+    task_queue.sync_if_changed(TASKS_DIR)
     tasks = []
-    for f in sorted(TASKS_DIR.glob('*.json')):
-        if f.name.startswith('_'):
-            continue
-        try:
-            data = json.loads(f.read_text())
-            tasks.append({
-                'filename': f.name,
-                'id': data.get('id', ''),
-                'type': data.get('type', ''),
-                'priority': data.get('priority', 10),
-                'prompt': data.get('prompt', '')[:80],
-            })
-        except:
-            pass
-    tasks.sort(key=lambda x: x['priority'])
+    for row in task_queue.pending(include_running=True):
+        task = row['task']
+        tasks.append({
+            'filename': row['filename'],
+            'id': task.get('id', row['task_id']),
+            'type': task.get('type', row['type']),
+            'priority': row['priority'],
+            'prompt': str(task.get('prompt', ''))[:80],
+            'state': row['state'],
+        })
     return jsonify(tasks)
 
 
@@ -129,19 +127,10 @@ def api_tasks_done():
 
 @app.route('/api/results')
 def api_results():
-    results = []
-    if RESULTS_DIR.exists():
-        files = sorted(RESULTS_DIR.glob('*.json'), key=lambda x: x.stat().st_mtime, reverse=True)[:30]
-        for f in files:
-            try:
-                data = json.loads(f.read_text())
-                results.append({
-                    'filename': f.name,
-                    'task_id': data.get('task_id', ''),
-                    'success': data.get('success', False),
-                })
-            except:
-                pass
+    results = [
+        {'filename': r['filename'], 'task_id': r['task_id'], 'success': r['success']}
+        for r in results_store.summaries(30)
+    ]
     return jsonify(results)
 
 
@@ -178,6 +167,7 @@ def api_tasks_add():
     if data.get('filepath'):
         task['filepath'] = data['filepath']
     filepath.write_text(json.dumps(task, indent=2))
+    task_queue.enqueue(filename, task, tasks_dir=TASKS_DIR)
     return jsonify({'success': True, 'filename': filename})
 
 
@@ -186,6 +176,7 @@ def api_tasks_delete(filename):
     filepath = TASKS_DIR / _safe_name(filename)
     if filepath.exists():
         filepath.unlink()
+    task_queue.remove(filepath.name)
     return jsonify({'success': True})
 
 
@@ -199,6 +190,7 @@ def api_tasks_import():
         filename = f"task_{int(time.time())}_{task_id}.json"
         filepath = TASKS_DIR / filename
         filepath.write_text(json.dumps(t, indent=2))
+        task_queue.enqueue(filename, t, tasks_dir=TASKS_DIR)
         filenames.append(filename)
         time.sleep(0.01)
     return jsonify({'success': True, 'imported': len(filenames), 'filenames': filenames})
@@ -281,15 +273,29 @@ def api_models_info(filename):
 def api_models_dimensions(filename):
     """
     Ritorna le dimensioni del bounding box del modello.
-    Prima controlla il result JSON (campo 'dimensions' salvato dal worker),
-    poi fa fallback al parsing diretto del file STL ASCII.
+    Prima usa il sidecar .meta.json scritto dal worker dopo la compilazione
+    (con volume, area, triangoli e manifold), poi il result JSON (campo
+    'dimensions'), infine legge direttamente il file STL (binario via mmap o ASCII).
     """
     safe_name = _safe_name(filename)
     stl_path = MODELS_STL_DIR / safe_name
     if not stl_path.exists():
         abort(404)
 
-    # 1. Prova dai dati già salvati nel result JSON
+    # 1. Metriche precalcolate nel sidecar (scartato se lo STL è cambiato)
+    meta = stl_io.read_meta(stl_path)
+    if meta and meta.get('dimensions'):
+        return jsonify({
+            'filename': safe_name,
+            'dimensions_mm': meta['dimensions'],
+            'volume_mm3': meta['volume_mm3'],
+            'area_mm2': meta['area_mm2'],
+            'triangles': meta['triangles'],
+            'is_manifold': meta['manifold']['is_manifold'],
+            'source': 'meta',
+        })
+
+    # 2. Prova dai dati già salvati nel result JSON
     result_data = _get_result_for_stl(safe_name)
     if result_data and result_data.get('dimensions'):
         dims = result_data['dimensions']
@@ -299,28 +305,12 @@ def api_models_dimensions(filename):
             'source': 'cached',
         })
 
-    # 2. Fallback: parsa l'STL ASCII per estrarre min/max vertex
+    # 3. Fallback: legge l'STL in streaming (memoria costante) per min/max vertex
     try:
-        content = stl_path.read_text(errors='replace')
-        xs, ys, zs = [], [], []
-        for line in content.splitlines():
-            line = line.strip()
-            if line.startswith('vertex '):
-                parts = line.split()
-                if len(parts) == 4:
-                    xs.append(float(parts[1]))
-                    ys.append(float(parts[2]))
-                    zs.append(float(parts[3]))
-        if not xs:
+        dims = stl_io.dimensions(stl_io.bounding_box(stl_path))
+        if not dims:
             return jsonify({'filename': safe_name, 'dimensions_mm': None,
-                            'error': 'Nessun vertex trovato (STL vuoto o formato binario)'}), 200
-        dims = {
-            'x': round(max(xs) - min(xs), 3),
-            'y': round(max(ys) - min(ys), 3),
-            'z': round(max(zs) - min(zs), 3),
-            'min': {'x': round(min(xs), 3), 'y': round(min(ys), 3), 'z': round(min(zs), 3)},
-            'max': {'x': round(max(xs), 3), 'y': round(max(ys), 3), 'z': round(max(zs), 3)},
-        }
+                            'error': 'Nessun vertex trovato (STL vuoto)'}), 200
         return jsonify({'filename': safe_name, 'dimensions_mm': dims, 'source': 'parsed'})
     except Exception as e:
         return jsonify({'filename': safe_name, 'dimensions_mm': None, 'error': str(e)}), 500
@@ -333,6 +323,14 @@ def api_models_delete(filename):
     if not stl_path.exists():
         return jsonify({'success': False, 'error': 'File non trovato'})
     stl_path.unlink()
+    try:
+        stl_io.meta_path(stl_path).unlink()
+    except OSError:
+        pass
+    try:
+        model_index.remove(safe_name)
+    except Exception:
+        pass
     scad_path = MODELS_SCAD_DIR / (stl_path.stem + '.scad')
     scad_deleted = False
     if scad_path.exists():
@@ -341,12 +339,54 @@ def api_models_delete(filename):
     return jsonify({'success': True, 'scad_deleted': scad_deleted})
 
 
+def _similar_models(description, data):
+    """Modelli già generati per richieste simili (indice model_index)."""
+    threshold = float(data.get('threshold') or _load_config().get('similarity_threshold', 0.9))
+    try:
+        return model_index.lookup(
+            description,
+            category=(data.get('object_category') or '').strip(),
+            object_type=data.get('object_type', ''),
+            parameters=data.get('parameters') or {},
+            threshold=threshold,
+        )
+    except Exception:
+        return []
+
+
+@app.route('/api/models/similar', methods=['GET', 'POST'])
+def api_models_similar():
+    """
+    Modelli simili. Per richiesta: description (+ object_category,
+    object_type, parameters, threshold). Per forma: stl=<filename>.
+    """
+    data = request.get_json(silent=True) or request.args.to_dict()
+    if isinstance(data.get('parameters'), str):
+        try:
+            data['parameters'] = json.loads(data['parameters'])
+        except ValueError:
+            data['parameters'] = {}
+    if data.get('stl'):
+        stl_path = MODELS_STL_DIR / _safe_name(data['stl'])
+        if not stl_path.exists():
+            abort(404)
+        return jsonify(model_index.similar_to_stl(stl_path, threshold=float(data.get('threshold') or 0.85)))
+    description = (data.get('description') or '').strip()
+    if not description:
+        return jsonify({'success': False, 'error': 'description o stl richiesti'}), 400
+    return jsonify(_similar_models(description, data))
+
+
 @app.route('/api/generate', methods=['POST'])
 def api_generate():
     data = request.get_json() or {}
     description = data.get('description', '').strip()
     if not description:
         return jsonify({'success': False, 'error': 'description richiesta'}), 400
+    similar = _similar_models(description, data)
+    if similar and data.get('skip_if_similar'):
+        # Il client ha chiesto di non rigenerare se esiste già un modello simile
+        return jsonify({'success': True, 'task_id': None, 'reused': similar[0], 'similar': similar})
     task_id = f"gen3d_{int(time.time())}"
     filename = f"task_{int(time.time())}_{task_id}.json"
     task = {
@@ -362,7 +402,8 @@ def api_generate():
         task['object_category'] = data['object_category'].strip()
     TASKS_DIR.mkdir(exist_ok=True)
     (TASKS_DIR / filename).write_text(json.dumps(task, indent=2))
-    return jsonify({'success': True, 'task_id': task_id, 'filename': filename})
+    task_queue.enqueue(filename, task, tasks_dir=TASKS_DIR)
+    return jsonify({'success': True, 'task_id': task_id, 'filename': filename, 'similar': similar})
 
 
 # =========================
@@ -415,23 +456,13 @@ def api_system():
     data['models_today'] = models_today
     data['models_total'] = len(list(MODELS_STL_DIR.glob('*.stl'))) if MODELS_STL_DIR.exists() else 0
 
-    # ── Tempo medio di generazione (dai results JSON) ─────────────────────
-    durations = []
-    if RESULTS_DIR.exists():
-        for rfile in RESULTS_DIR.glob('*.json'):
-            try:
-                d = json.loads(rfile.read_text())
-                timing = d.get('timing', {})
-                total = timing.get('total_s')
-                if total and total > 0:
-                    durations.append(total)
-            except Exception:
-                continue
-    if durations:
-        data['avg_generation_s'] = round(sum(durations) / len(durations), 1)
-        data['min_generation_s'] = round(min(durations), 1)
-        data['max_generation_s'] = round(max(durations), 1)
-        data['generation_samples'] = len(durations)
+    # ── Tempo medio di generazione (dall'archivio results) ───────────────
+    stats = results_store.duration_stats()
+    if stats['count']:
+        data['avg_generation_s'] = round(stats['avg_s'], 1)
+        data['min_generation_s'] = round(stats['min_s'], 1)
+        data['max_generation_s'] = round(stats['max_s'], 1)
+        data['generation_samples'] = stats['count']
     else:
         data['avg_generation_s'] = None
         data['generation_samples'] = 0
@@ -447,6 +478,25 @@ def api_system():
         }
     else:
         data['cache'] = {'entries': 0, 'size_kb': 0}
+    # Contatori hit/miss/eviction scritti dal worker
+    cache_stats_file = PANDA_HOME / 'status' / 'cache_stats.json'
+    if cache_stats_file.exists():
+        try:
+            data['cache']['stats'] = json.loads(cache_stats_file.read_text())
+        except Exception:
+            pass
+    semantic_stats_file = PANDA_HOME / 'status' / 'semantic_cache_stats.json'
+    if semantic_stats_file.exists():
+        try:
+            data['cache']['semantic'] = json.loads(semantic_stats_file.read_text())
+        except Exception:
+            pass
+    response_stats_file = PANDA_HOME / 'status' / 'response_cache_stats.json'
+    if response_stats_file.exists():
+        try:
+            data['cache']['responses'] = json.loads(response_stats_file.read_text())
+        except Exception:
+            pass
 
     data['timestamp'] = datetime.now().isoformat()
     return jsonify(data)
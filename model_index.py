@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+"""
+PANDA — Indice di similarità dei modelli
+=========================================
+
+Indice SQLite (~/panda/db/models.sqlite3) sugli STL in models/stl/ per
+trovare modelli già esistenti "uguali" prima di chiamare l'LLM:
+
+- geometria: bounding box (anche con assi ordinati, indipendente
+  dall'orientamento), volume, area, numero triangoli e un descrittore di
+  forma compatto (istogramma a 16 classi delle distanze dal baricentro,
+  pesato per area, normalizzato: invariante a rotazione e scala)
+- testo: descrizione, categoria, object_type e parametri del task che ha
+  generato il modello, con un indice invertito dei termini
+
+Le ricerche non scorrono mai tutta la libreria: i candidati arrivano
+dagli indici (termini in comune, intervalli sulle dimensioni) e solo
+quelli vengono confrontati in Python, quindi restano veloci anche con
+decine di migliaia di STL. refresh() ricalcola solo i file nuovi o
+cambiati (size + mtime).
+
+Uso da CLI:
+  python3 model_index.py --refresh                      indicizza models/stl/
+  python3 model_index.py --like "porta spezie da parete 5 slot"
+  python3 model_index.py --stl models/stl/x.stl         modelli di forma simile
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import struct
+import unicodedata
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+import stl_io
+
+# =========================
+# PATHS
+# =========================
+
+PANDA_HOME = Path.home() / "panda"
+MODELS_STL_DIR = PANDA_HOME / "models" / "stl"
+DB_DIR = PANDA_HOME / "db"
+INDEX_DB = DB_DIR / "models.sqlite3"
+
+DESCRIPTOR_BINS = 16
+CANDIDATES = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    stl_file    TEXT UNIQUE NOT NULL,
+    size        INTEGER,
+    mtime       REAL,
+    triangles   INTEGER,
+    volume      REAL,
+    area        REAL,
+    bbox_x      REAL,
+    bbox_y      REAL,
+    bbox_z      REAL,
+    dim_a       REAL,
+    dim_b       REAL,
+    dim_c       REAL,
+    descriptor  TEXT,
+    description TEXT,
+    category    TEXT,
+    object_type TEXT,
+    parameters  TEXT,
+    scad_file   TEXT,
+    task_id     TEXT,
+    n_terms     INTEGER NOT NULL DEFAULT 0,
+    indexed_at  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_models_dims ON models(dim_a, dim_b, dim_c);
+CREATE TABLE IF NOT EXISTS terms (
+    term     TEXT NOT NULL,
+    model_id INTEGER NOT NULL,
+    PRIMARY KEY (term, model_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_terms_model ON terms(model_id);
+"""
+
+# Parole troppo comuni nelle descrizioni per distinguere un oggetto dall'altro
+_STOPWORDS = {
+    "a", "ad", "al", "alla", "con", "da", "dal", "de", "del", "della", "di", "e", "ed",
+    "gli", "i", "il", "in", "la", "le", "lo", "mm", "nel", "o", "per", "su", "tra", "un",
+    "una", "uno", "and", "for", "of", "the", "to", "with", "x",
+}
+
+# =========================
+# CONNESSIONE
+# =========================
+
+def connect(db_path=None):
+    db_path = Path(db_path or INDEX_DB)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+# =========================
+# GEOMETRIA
+# =========================
+
+def _iter_triangles(path):
+    """Triangoli ((x,y,z) ×3) di uno STL ASCII o binario, letti in streaming."""
+    return stl_io.iter_triangles(path)
+
+
+def _sub(a, b):
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+
+def _shape_python(path, metrics=True):
+    """
+    Due passate in streaming: la prima accumula area e baricentro (più
+    triangoli, min/max e volume se metrics), la seconda l'istogramma delle
+    distanze dal baricentro. None se il file non contiene triangoli.
+    """
+    count, volume, area = 0, 0.0, 0.0
+    lo = [math.inf] * 3
+    hi = [-math.inf] * 3
+    cx = cy = cz = sq = 0.0
+    for v0, v1, v2 in _iter_triangles(path):
+        count += 1
+        c = _cross(_sub(v1, v0), _sub(v2, v0))
+        a = 0.5 * math.sqrt(c[0] * c[0] + c[1] * c[1] + c[2] * c[2])
+        area += a
+        cx += a * (v0[0] + v1[0] + v2[0]) / 3
+        cy += a * (v0[1] + v1[1] + v2[1]) / 3
+        cz += a * (v0[2] + v1[2] + v2[2]) / 3
+        sq += a * sum(((v0[i] + v1[i] + v2[i]) / 3) ** 2 for i in range(3))
+        if not metrics:
+            continue
+        for v in (v0, v1, v2):
+            for i in range(3):
+                if v[i] < lo[i]:
+                    lo[i] = v[i]
+                if v[i] > hi[i]:
+                    hi[i] = v[i]
+        volume += (v0[0] * (v1[1] * v2[2] - v1[2] * v2[1])
+                   + v1[0] * (v2[1] * v0[2] - v2[2] * v0[1])
+                   + v2[0] * (v0[1] * v1[2] - v0[2] * v1[1])) / 6.0
+    if not count:
+        return None
+    if area > 0:
+        cx, cy, cz = cx / area, cy / area, cz / area
+        sq /= area
+    # Distanza quadratica media dal baricentro: scala della forma
+    rms = math.sqrt(max(sq - (cx * cx + cy * cy + cz * cz), 0.0)) or 1.0
+
+    # Seconda passata: istogramma delle distanze dal baricentro (pesato per
+    # area) su [0, 2·rms], oltre → ultima classe
+    hist = [0.0] * DESCRIPTOR_BINS
+    for v0, v1, v2 in _iter_triangles(path):
+        c = _cross(_sub(v1, v0), _sub(v2, v0))
+        a = 0.5 * math.sqrt(c[0] * c[0] + c[1] * c[1] + c[2] * c[2])
+        px = (v0[0] + v1[0] + v2[0]) / 3 - cx
+        py = (v0[1] + v1[1] + v2[1]) / 3 - cy
+        pz = (v0[2] + v1[2] + v2[2]) / 3 - cz
+        d = math.sqrt(px * px + py * py + pz * pz)
+        hist[min(DESCRIPTOR_BINS - 1, int(d / (2 * rms) * DESCRIPTOR_BINS))] += a
+    return {"triangles": count, "volume": abs(volume), "area": area, "min": lo, "max": hi, "hist": hist}
+
+
+def _shape_numpy(path, metrics=True):
+    """_shape_python vettorizzato: stesse due passate, a blocchi (stl_io.iter_chunks)."""
+    count, volume, area = 0, 0.0, 0.0
+    lo = hi = None
+    weighted = np.zeros(3)
+    sq = 0.0
+    for chunk in stl_io.iter_chunks(path):
+        if not len(chunk):
+            continue
+        v = chunk.astype(np.float64, copy=False)
+        a = 0.5 * np.linalg.norm(np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0]), axis=1)
+        centers = v.mean(axis=1)
+        count += len(v)
+        area += float(a.sum())
+        weighted += a @ centers
+        sq += float(a @ np.einsum("ij,ij->i", centers, centers))
+        if metrics:
+            volume += float(np.einsum("ij,ij->", v[:, 0], np.cross(v[:, 1], v[:, 2]))) / 6.0
+            c_lo, c_hi = v.min(axis=(0, 1)), v.max(axis=(0, 1))
+            lo = c_lo if lo is None else np.minimum(lo, c_lo)
+            hi = c_hi if hi is None else np.maximum(hi, c_hi)
+    if not count:
+        return None
+    center = weighted / area if area > 0 else weighted
+    if area > 0:
+        sq /= area
+    rms = math.sqrt(max(sq - float(center @ center), 0.0)) or 1.0
+
+    hist = np.zeros(DESCRIPTOR_BINS)
+    for chunk in stl_io.iter_chunks(path):
+        if not len(chunk):
+            continue
+        v = chunk.astype(np.float64, copy=False)
+        a = 0.5 * np.linalg.norm(np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0]), axis=1)
+        d = np.linalg.norm(v.mean(axis=1) - center, axis=1)
+        bins = np.minimum(DESCRIPTOR_BINS - 1, (d / (2 * rms) * DESCRIPTOR_BINS).astype(np.int64))
+        hist += np.bincount(bins, weights=a, minlength=DESCRIPTOR_BINS)
+    return {
+        "triangles": count, "volume": abs(volume), "area": area,
+        "min": None if lo is None else lo.tolist(), "max": None if hi is None else hi.tolist(),
+        "hist": hist.tolist(),
+    }
+
+
+def geometry(path):
+    """
+    Metriche e descrittore di forma di uno STL. Triangoli, volume, area e
+    bounding box vengono dal sidecar .meta.json scritto dal worker dopo la
+    compilazione (se aggiornato); le due passate in streaming (memoria
+    costante, NumPy se disponibile) servono solo per il descrittore.
+    None se il file non contiene triangoli.
+    """
+    meta = stl_io.read_meta(path)
+    if meta is not None and not meta["triangles"]:
+        return None
+    shape = (_shape_numpy if _HAS_NUMPY else _shape_python)(path, metrics=meta is None)
+    if shape is None:
+        return None
+    if meta is not None:
+        shape.update(triangles=meta["triangles"], volume=meta["volume_mm3"], area=meta["area_mm2"],
+                     min=meta["min"], max=meta["max"])
+    total = sum(shape["hist"]) or 1.0
+
+    bbox = [round(shape["max"][i] - shape["min"][i], 3) for i in range(3)]
+    return {
+        "triangles": shape["triangles"],
+        "volume": round(shape["volume"], 3),
+        "area": round(shape["area"], 3),
+        "bbox": bbox,
+        "dims": sorted(bbox, reverse=True),
+        "descriptor": [round(h / total, 4) for h in shape["hist"]],
+    }
+
+# =========================
+# TESTO E PARAMETRI
+# =========================
+
+def terms(text):
+    """Termini normalizzati della descrizione (minuscole, senza accenti, numeri senza unità)."""
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode().lower()
+    text = re.sub(r"(\d)(mm|cm|°)\b", r"\1 ", text)
+    out = set()
+    for token in re.findall(r"[a-z]+|\d+(?:[.,]\d+)?", text):
+        token = token.replace(",", ".")
+        if token in _STOPWORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        out.add(token)
+    return out
+
+
+def _numbers(text):
+    """Misure citate nella descrizione ("cubo 20mm" → {"20"})."""
+    return {t for t in terms(text) if t[0].isdigit()}
+
+
+def _canonical_params(parameters):
+    out = {}
+    for key, value in (parameters or {}).items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        out[str(key).strip().lower()] = value
+    return out
+
+
+def same_request(description, parameters, match, category="", object_type=""):
+    """
+    True se il match ha esattamente gli stessi parametri, le stesse misure
+    nella descrizione e la stessa categoria/object_type: solo allora il
+    modello può sostituire la generazione (jar_d 55 contro 58 ha score ~0.99
+    ma è un altro oggetto; in lookup un object_type diverso pesa solo ×0.9).
+    """
+    return ((category or "") == (match.get("category") or "")
+            and (object_type or "") == (match.get("object_type") or "")
+            and _canonical_params(parameters) == _canonical_params(match["parameters"])
+            and _numbers(description) == _numbers(match["description"]))
+
+
+def _ratio(a, b):
+    """Somiglianza 0..1 tra due grandezze positive."""
+    a, b = abs(a or 0), abs(b or 0)
+    if a == b:
+        return 1.0
+    return min(a, b) / max(a, b)
+
+
+def _params_similarity(a, b):
+    a, b = a or {}, b or {}
+    keys = set(a) | set(b)
+    if not keys:
+        return None
+    score = 0.0
+    for key in keys & set(b) & set(a):
+        va, vb = a[key], b[key]
+        if isinstance(va, (int, float)) and isinstance(vb, (int, float)) and not isinstance(va, bool):
+            score += _ratio(va, vb)
+        else:
+            score += 1.0 if va == vb else 0.0
+    return score / len(keys)
+
+
+def _shape_similarity(d1, d2):
+    return 1.0 - sum(abs(x - y) for x, y in zip(d1, d2)) / 2
+
+# =========================
+# SCRITTURA
+# =========================
+
+def add(stl_path, description="", category="", object_type="", parameters=None,
+        scad_file=None, task_id=None, geom=None, conn=None):
+    """Indicizza (o aggiorna) uno STL con i metadati del task che l'ha generato."""
+    stl_path = Path(stl_path)
+    st = stl_path.stat()
+    geom = geom or geometry(stl_path)
+    if geom is None:
+        return None
+    words = terms(description)
+    row = (
+        st.st_size, st.st_mtime, geom["triangles"], geom["volume"], geom["area"],
+        *geom["bbox"], *geom["dims"], json.dumps(geom["descriptor"]),
+        description or "", category or "", object_type or "",
+        json.dumps(parameters or {}, ensure_ascii=False),
+        str(scad_file) if scad_file else None, task_id, len(words), datetime.now().isoformat(),
+    )
+    own = conn is None
+    conn = conn or connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO models (stl_file, size, mtime, triangles, volume, area, bbox_x, bbox_y, bbox_z, "
+                "dim_a, dim_b, dim_c, descriptor, description, category, object_type, parameters, "
+                "scad_file, task_id, n_terms, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(stl_file) DO UPDATE SET size=excluded.size, mtime=excluded.mtime, "
+                "triangles=excluded.triangles, volume=excluded.volume, area=excluded.area, "
+                "bbox_x=excluded.bbox_x, bbox_y=excluded.bbox_y, bbox_z=excluded.bbox_z, "
+                "dim_a=excluded.dim_a, dim_b=excluded.dim_b, dim_c=excluded.dim_c, "
+                "descriptor=excluded.descriptor, description=excluded.description, "
+                "category=excluded.category, object_type=excluded.object_type, "
+                "parameters=excluded.parameters, scad_file=excluded.scad_file, "
+                "task_id=excluded.task_id, n_terms=excluded.n_terms, indexed_at=excluded.indexed_at",
+                (stl_path.name, *row),
+            )
+            model_id = conn.execute("SELECT id FROM models WHERE stl_file = ?", (stl_path.name,)).fetchone()[0]
+            conn.execute("DELETE FROM terms WHERE model_id = ?", (model_id,))
+            conn.executemany("INSERT INTO terms (term, model_id) VALUES (?, ?)", [(w, model_id) for w in words])
+    finally:
+        if own:
+            conn.close()
+    return model_id
+
+
+def remove(stl_filename, conn=None):
+    own = conn is None
+    conn = conn or connect()
+    try:
+        with conn:
+            row = conn.execute("SELECT id FROM models WHERE stl_file = ?", (Path(stl_filename).name,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM terms WHERE model_id = ?", (row[0],))
+                conn.execute("DELETE FROM models WHERE id = ?", (row[0],))
+    finally:
+        if own:
+            conn.close()
+
+
+def refresh(models_dir=None, metadata=None):
+    """
+    Allinea l'indice a models/stl/: indicizza i file nuovi o cambiati
+    (size/mtime), rimuove quelli spariti. metadata(stl_name) → dict con
+    description/category/object_type/parameters/scad_file/task_id (es. dal
+    results_store) per gli STL non ancora indicizzati.
+    """
+    models_dir = Path(models_dir or MODELS_STL_DIR)
+    added = updated = removed = 0
+    with closing(connect()) as conn:
+        known = {r["stl_file"]: (r["size"], r["mtime"], r["description"])
+                 for r in conn.execute("SELECT stl_file, size, mtime, description FROM models")}
+        seen = set()
+        if models_dir.exists():
+            with os.scandir(models_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".stl") or not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    st = entry.stat()
+                    old = known.get(entry.name)
+                    if old and old[0] == st.st_size and old[1] == st.st_mtime:
+                        continue
+                    meta = (metadata(entry.name) if metadata and not old else None) or {}
+                    if old and not meta:
+                        row = conn.execute(
+                            "SELECT description, category, object_type, parameters, scad_file, task_id "
+                            "FROM models WHERE stl_file = ?", (entry.name,),
+                        ).fetchone()
+                        meta = dict(row)
+                        meta["parameters"] = json.loads(meta["parameters"] or "{}")
+                    try:
+                        add(entry.path, conn=conn, **meta)
+                    except (OSError, struct.error):
+                        continue
+                    if old:
+                        updated += 1
+                    else:
+                        added += 1
+        for name in set(known) - seen:
+            remove(name, conn=conn)
+            removed += 1
+    return {"added": added, "updated": updated, "removed": removed, "total": len(seen)}
+
+# =========================
+# RICERCA
+# =========================
+
+def _match(row, score, **extra):
+    return {
+        "stl_file": row["stl_file"],
+        "score": round(score, 3),
+        "description": row["description"],
+        "category": row["category"],
+        "object_type": row["object_type"],
+        "task_id": row["task_id"],
+        "scad_file": row["scad_file"],
+        "parameters": json.loads(row["parameters"] or "{}"),
+        "bbox": [row["bbox_x"], row["bbox_y"], row["bbox_z"]],
+        "volume": row["volume"],
+        **extra,
+    }
+
+
+def lookup(description, category="", object_type="", parameters=None, threshold=0.75, limit=5):
+    """
+    Modelli già generati per una richiesta simile (prima di chiamare l'LLM).
+    Punteggio: somiglianza dei termini (Jaccard) e, se presenti, dei
+    parametri numerici; categoria/object_type diversi penalizzano.
+    Ritorna al più `limit` match con score >= threshold, migliori prima.
+    """
+    words = terms(description)
+    if not words:
+        return []
+    marks = ",".join("?" * len(words))
+    with closing(connect()) as conn:
+        shared = conn.execute(
+            f"SELECT model_id, COUNT(*) AS n FROM terms WHERE term IN ({marks}) "
+            f"GROUP BY model_id ORDER BY n DESC LIMIT {CANDIDATES}",
+            tuple(words),
+        ).fetchall()
+        if not shared:
+            return []
+        counts = {r["model_id"]: r["n"] for r in shared}
+        rows = conn.execute(
+            f"SELECT * FROM models WHERE id IN ({','.join('?' * len(counts))})", tuple(counts),
+        ).fetchall()
+
+    matches = []
+    for row in rows:
+        n = counts[row["id"]]
+        text = n / (len(words) + row["n_terms"] - n)
+        params = _params_similarity(parameters, json.loads(row["parameters"] or "{}"))
+        score = text if params is None else 0.6 * text + 0.4 * params
+        if category and row["category"] and category != row["category"]:
+            score *= 0.8
+        if object_type and row["object_type"] and object_type != row["object_type"]:
+            score *= 0.9
+        if score >= threshold:
+            matches.append(_match(row, score, text_score=round(text, 3)))
+    matches.sort(key=lambda m: m["score"], reverse=True)
+    return matches[:limit]
+
+
+def similar_to_stl(stl_path, threshold=0.85, limit=5, tolerance=0.2):
+    """
+    Modelli di forma e misura simili a uno STL: candidati dall'indice sulle
+    dimensioni ordinate (±tolerance), poi punteggio su dimensioni, volume e
+    descrittore di forma.
+    """
+    stl_path = Path(stl_path)
+    geom = geometry(stl_path)
+    if geom is None:
+        return []
+    a, b, c = geom["dims"]
+    lo, hi = 1 - tolerance, 1 + tolerance
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT * FROM models WHERE dim_a BETWEEN ? AND ? AND dim_b BETWEEN ? AND ? "
+            "AND dim_c BETWEEN ? AND ? AND stl_file != ?",
+            (a * lo, a * hi, b * lo, b * hi, c * lo, c * hi, stl_path.name),
+        ).fetchall()
+    matches = []
+    for row in rows:
+        dims = (_ratio(a, row["dim_a"]) + _ratio(b, row["dim_b"]) + _ratio(c, row["dim_c"])) / 3
+        shape = _shape_similarity(geom["descriptor"], json.loads(row["descriptor"]))
+        score = 0.4 * dims + 0.2 * _ratio(geom["volume"], row["volume"]) + 0.4 * shape
+        if score >= threshold:
+            matches.append(_match(row, score, shape_score=round(shape, 3)))
+    matches.sort(key=lambda m: m["score"], reverse=True)
+    return matches[:limit]
+
+
+def stats():
+    with closing(connect()) as conn:
+        n = conn.execute("SELECT COUNT(*) FROM models").fetchone()[0]
+        t = conn.execute("SELECT COUNT(DISTINCT term) FROM terms").fetchone()[0]
+    return {"models": n, "terms": t}
+
+# =========================
+# CLI
+# =========================
+
+def _results_metadata(stl_name):
+    """Metadati del task che ha generato lo STL, dall'archivio risultati."""
+    try:
+        import results_store
+        res = results_store.for_stl(stl_name)
+    except Exception:
+        return None
+    if not res:
+        return None
+    return {
+        "description": res.get("description", ""),
+        # come _index_model: categoria risolta, quella richiesta nei result vecchi
+        "category": res.get("category") or res.get("object_category", ""),
+        "object_type": res.get("object_type", ""),
+        "parameters": res.get("parameters") or {},
+        "scad_file": res.get("scad_file"),
+        "task_id": res.get("task_id"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — indice di similarità modelli")
+    parser.add_argument("--refresh", action="store_true", help="Indicizza i file nuovi/cambiati in models/stl/")
+    parser.add_argument("--like", metavar="DESCRIZIONE", help="Modelli generati per richieste simili")
+    parser.add_argument("--category", default="", help="Con --like: categoria (gears, enclosures, ...)")
+    parser.add_argument("--stl", help="Modelli di forma simile a questo STL")
+    parser.add_argument("--threshold", type=float, default=None, help="Punteggio minimo (0..1)")
+    parser.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.refresh:
+        res = refresh(metadata=_results_metadata)
+        print(f"Indice: +{res['added']} ~{res['updated']} -{res['removed']} (totale {res['total']})")
+    if args.like:
+        found = lookup(args.like, args.category, threshold=args.threshold or 0.5, limit=args.limit)
+    elif args.stl:
+        found = similar_to_stl(args.stl, threshold=args.threshold or 0.8, limit=args.limit)
+    else:
+        st = stats()
+        print(f"Modelli indicizzati: {st['models']}  (termini distinti: {st['terms']})")
+        return
+    for m in found:
+        print(f"{m['score']:.3f}  {m['stl_file']:<40} {m['description'][:60]}")
+    if not found:
+        print("Nessun modello simile")
+
+
+if __name__ == "__main__":
+    main()
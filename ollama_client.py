@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+PANDA — Client HTTP condiviso per Ollama
+=========================================
+
+Un'unica Session requests per URL Ollama (connessioni keep-alive riusate
+tra un task e l'altro), timeout di connessione e di lettura separati,
+retry con jitter sui reset di connessione e un solo thread "ticker" per i
+messaggi di avanzamento delle chiamate lunghe.
+
+Usato da worker.py, scripts/test_openscad_prompts.py e scripts/check_system.py.
+
+Config (panda.json):
+  ollama_connect_timeout  secondi per aprire la connessione (default 5)
+  ollama_read_timeout     secondi max di silenzio dal server (default 600;
+                          con lo streaming è l'attesa tra due chunk)
+  ollama_retries          ritentativi su connessione rifiutata/resettata (default 2)
+  ollama_pool_size        connessioni keep-alive per URL (default 4)
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 600
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_SIZE = 4
+RETRY_BACKOFF = 0.5
+
+# Errori per cui la richiesta non è arrivata (o la connessione riusata era
+# già chiusa dal server): si può ripetere senza effetti collaterali.
+_RETRYABLE = (requests.exceptions.ConnectionError,)
+
+# =========================
+# CLIENT
+# =========================
+
+class OllamaClient:
+    def __init__(self, base_url, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, retries=DEFAULT_RETRIES,
+                 pool_size=DEFAULT_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, read_timeout=None, **kwargs):
+        """
+        Richiesta con retry + jitter sui soli errori di connessione.
+        read_timeout sovrascrive quello di default per questa chiamata.
+        """
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.retries + 1):
+            try:
+                return self.session.request(method, url, timeout=timeout, **kwargs)
+            except _RETRYABLE:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, RETRY_BACKOFF))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def tags(self, **kwargs):
+        """Nomi dei modelli installati (/api/tags)."""
+        r = self.get("/api/tags", **kwargs)
+        r.raise_for_status()
+        return [m.get("name", "") for m in r.json().get("models", [])]
+
+
+def is_timeout(exc):
+    """True per timeout di connessione o di lettura (anche a metà stream)."""
+    if isinstance(exc, requests.exceptions.Timeout):
+        return True
+    # Durante iter_lines() requests rilancia il ReadTimeout come ConnectionError
+    return isinstance(exc, requests.exceptions.ConnectionError) and any(
+        isinstance(arg, ReadTimeoutError) for arg in exc.args
+    )
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def client_for(config):
+    """Client condiviso per l'URL e i timeout della config (creato al primo uso)."""
+    key = (
+        config.get("ollama_url", "http://localhost:11434"),
+        float(config.get("ollama_connect_timeout", DEFAULT_CONNECT_TIMEOUT)),
+        float(config.get("ollama_read_timeout", DEFAULT_READ_TIMEOUT)),
+        int(config.get("ollama_retries", DEFAULT_RETRIES)),
+        int(config.get("ollama_pool_size", DEFAULT_POOL_SIZE)),
+    )
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = _CLIENTS[key] = OllamaClient(*key)
+        return client
+
+# =========================
+# TICKER AVANZAMENTO
+# =========================
+
+_TICK_EVERY = 30
+_active = {}
+_active_lock = threading.Lock()
+_ticker_thread = None
+
+
+def _ticker_loop():
+    while True:
+        time.sleep(1)
+        now = time.time()
+        with _active_lock:
+            due = [entry for entry in _active.values() if now >= entry["next"]]
+            for entry in due:
+                entry["next"] += _TICK_EVERY
+        for entry in due:
+            try:
+                entry["report"](now - entry["start"])
+            except Exception:
+                pass
+
+
+@contextmanager
+def progress(report):
+    """
+    Registra una chiamata lunga: ogni 30s il ticker condiviso chiama
+    report(secondi_trascorsi). Un solo thread per tutto il processo.
+    """
+    global _ticker_thread
+    start = time.time()
+    with _active_lock:
+        if _ticker_thread is None:
+            _ticker_thread = threading.Thread(target=_ticker_loop, name="ollama-ticker", daemon=True)
+            _ticker_thread.start()
+        token = object()
+        _active[token] = {"start": start, "next": start + _TICK_EVERY, "report": report}
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active.pop(token, None)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+PANDA — Archivio risultati (SQLite)
+====================================
+
+Sostituisce il vecchio "un file JSON per result" in ~/panda/results/.
+Ogni result viene scritto in una transazione da process_task; dashboard e
+script (model_stats, export_models, check_system) interrogano l'archivio
+tramite indici invece di globbare e parsare tutta la directory.
+
+Indici: task_id, type, success, stl_file (nome file STL), finished_at.
+Il JSON completo del result è conservato in `payload`.
+
+Migrazione: alla prima apertura l'archivio importa una sola volta i JSON
+già presenti in results/ (i file restano dove sono).
+
+Uso da CLI:
+  python3 results_store.py                         ultimi 20 result
+  python3 results_store.py --migrate               (re)importa i JSON in results/
+  python3 results_store.py --export ~/export_res   esporta in un JSON per result
+  python3 results_store.py --export out --since 2026-02-01 --type generate_3d
+"""
+
+import argparse
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+# =========================
+# PATHS
+# =========================
+
+PANDA_HOME = Path.home() / "panda"
+RESULTS_DIR = PANDA_HOME / "results"
+DB_DIR = PANDA_HOME / "db"
+RESULTS_DB = DB_DIR / "results.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    name          TEXT UNIQUE,
+    task_id       TEXT,
+    type          TEXT,
+    success       INTEGER NOT NULL DEFAULT 0,
+    stl_file      TEXT,
+    started_at    TEXT,
+    finished_at   TEXT,
+    total_s       REAL,
+    description   TEXT,
+    quality       TEXT,
+    object_type   TEXT,
+    error_message TEXT,
+    payload       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_task_id  ON results(task_id);
+CREATE INDEX IF NOT EXISTS idx_results_type     ON results(type, finished_at);
+CREATE INDEX IF NOT EXISTS idx_results_success  ON results(success);
+CREATE INDEX IF NOT EXISTS idx_results_stl_file ON results(stl_file, finished_at);
+CREATE INDEX IF NOT EXISTS idx_results_finished ON results(finished_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# =========================
+# CONNESSIONE
+# =========================
+
+def connect(db_path=None, results_dir=None):
+    """Apre l'archivio; alla prima apertura importa i JSON esistenti in results/."""
+    db_path = Path(db_path or RESULTS_DB)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone() is None:
+        _migrate(conn, Path(results_dir or RESULTS_DIR))
+    return conn
+
+
+def _columns(name, data, mtime=None):
+    """Estrae le colonne indicizzate da un result dict."""
+    task = data.get("task", {}) if isinstance(data.get("task"), dict) else {}
+    stl = data.get("stl_file") or None
+    timing = data.get("timing") if isinstance(data.get("timing"), dict) else {}
+    finished = data.get("finished_at") or (
+        datetime.fromtimestamp(mtime).isoformat() if mtime else datetime.now().isoformat()
+    )
+    total_s = timing.get("total_s")
+    return (
+        name,
+        str(data.get("task_id", "")),
+        str(data.get("type", task.get("type", ""))),
+        1 if data.get("success") else 0,
+        Path(stl).name if stl else None,
+        data.get("started_at"),
+        finished,
+        float(total_s) if isinstance(total_s, (int, float)) else None,
+        data.get("description", task.get("description", "")),
+        data.get("quality", task.get("quality", "")),
+        data.get("object_type", task.get("object_type", "")),
+        str(data.get("error_message") or data.get("error") or "") or None,
+        json.dumps(data, ensure_ascii=False),
+    )
+
+
+_INSERT = (
+    "INSERT {verb} INTO results (name, task_id, type, success, stl_file, started_at, finished_at, "
+    "total_s, description, quality, object_type, error_message, payload) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# =========================
+# SCRITTURA
+# =========================
+
+def save(result, name=None):
+    """Salva un result in una transazione. Ritorna il nome logico ({task_id}_{ts}.json)."""
+    name = name or f"{result.get('task_id', '')}_{int(datetime.now().timestamp())}.json"
+    with closing(connect()) as conn, conn:
+        conn.execute(_INSERT.format(verb="OR REPLACE"), _columns(name, result))
+    return name
+
+
+def _migrate(conn, results_dir):
+    imported = 0
+    if results_dir.exists():
+        with conn:
+            for f in results_dir.glob("*.json"):
+                try:
+                    data = json.loads(f.read_text(encoding="utf-8"))
+                except Exception:
+                    continue
+                if not isinstance(data, dict):
+                    continue
+                cur = conn.execute(_INSERT.format(verb="OR IGNORE"), _columns(f.name, data, f.stat().st_mtime))
+                imported += cur.rowcount
+    with conn:
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('json_migrated', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (datetime.now().isoformat(),),
+        )
+    return imported
+
+
+def migrate_json_dir(results_dir=None):
+    """Importa (di nuovo) i JSON di results/ già non presenti. Ritorna il numero importato."""
+    with closing(connect()) as conn:
+        return _migrate(conn, Path(results_dir or RESULTS_DIR))
+
+# =========================
+# LETTURA
+# =========================
+
+def _row_to_dict(row):
+    data = json.loads(row["payload"])
+    data.setdefault("finished_at", row["finished_at"])
+    data["_name"] = row["name"]
+    return data
+
+
+def latest(limit=30, task_type=None, success=None, with_stl=False):
+    """Ultimi result (più recenti prima) come dict completi."""
+    where, params = [], []
+    if task_type is not None:
+        where.append("type = ?")
+        params.append(task_type)
+    if success is not None:
+        where.append("success = ?")
+        params.append(1 if success else 0)
+    if with_stl:
+        where.append("stl_file IS NOT NULL")
+    sql = "SELECT name, finished_at, payload FROM results"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY finished_at DESC, id DESC LIMIT ?"
+    params.append(int(limit))
+    with closing(connect()) as conn:
+        return [_row_to_dict(r) for r in conn.execute(sql, params)]
+
+
+def summaries(limit=30):
+    """Ultimi result in forma compatta (senza parsare il payload)."""
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT name, task_id, type, success, finished_at FROM results "
+            "ORDER BY finished_at DESC, id DESC LIMIT ?",
+            (int(limit),),
+        ).fetchall()
+    return [
+        {"filename": r["name"], "task_id": r["task_id"], "type": r["type"],
+         "success": bool(r["success"]), "finished_at": r["finished_at"]}
+        for r in rows
+    ]
+
+
+def for_stl(stl_filename):
+    """Result più recente che ha generato un determinato STL (lookup su indice)."""
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT name, finished_at, payload FROM results WHERE stl_file = ? "
+            "ORDER BY finished_at DESC, id DESC LIMIT 1",
+            (Path(stl_filename).name,),
+        ).fetchone()
+    return _row_to_dict(row) if row else None
+
+
+def for_task(task_id):
+    """Tutti i result di un task (più recenti prima)."""
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT name, finished_at, payload FROM results WHERE task_id = ? "
+            "ORDER BY finished_at DESC, id DESC",
+            (task_id,),
+        ).fetchall()
+    return [_row_to_dict(r) for r in rows]
+
+
+def duration_stats():
+    """Statistiche su timing.total_s (solo valori > 0), calcolate in SQL."""
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS n, AVG(total_s) AS avg_s, MIN(total_s) AS min_s, MAX(total_s) AS max_s "
+            "FROM results WHERE total_s > 0"
+        ).fetchone()
+    return {"count": row["n"], "avg_s": row["avg_s"], "min_s": row["min_s"], "max_s": row["max_s"]}
+
+
+def generate_3d_rows():
+    """
+    Colonne indicizzate dei result generate_3d (o con stl_file), senza payload:
+    usate da model_stats per le statistiche sull'intero storico.
+    """
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT name, task_id, success, stl_file, started_at, finished_at, total_s, "
+            "description, quality, object_type, error_message, "
+            "json_extract(payload, '$.file_size_kb') AS file_size_kb "
+            "FROM results WHERE type = 'generate_3d' OR stl_file IS NOT NULL"
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def count():
+    with closing(connect()) as conn:
+        return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+# =========================
+# EXPORT JSON
+# =========================
+
+def export_json(out_dir, since=None, task_type=None):
+    """Esporta i result come un file JSON ciascuno (formato storico di results/)."""
+    out_dir = Path(out_dir).expanduser()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    where, params = [], []
+    if since:
+        where.append("finished_at >= ?")
+        params.append(since)
+    if task_type:
+        where.append("type = ?")
+        params.append(task_type)
+    sql = "SELECT name, payload FROM results"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    n = 0
+    with closing(connect()) as conn:
+        for r in conn.execute(sql, params):
+            (out_dir / r["name"]).write_text(
+                json.dumps(json.loads(r["payload"]), indent=2, ensure_ascii=False), encoding="utf-8"
+            )
+            n += 1
+    return n
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — archivio risultati")
+    parser.add_argument("--migrate", action="store_true", help="Importa i JSON di results/ non ancora presenti")
+    parser.add_argument("--export", metavar="DIR", help="Esporta i result in DIR (un JSON per result)")
+    parser.add_argument("--since", metavar="YYYY-MM-DD", help="Con --export: solo result finiti da questa data")
+    parser.add_argument("--type", dest="task_type", help="Con --export: solo questo tipo di task")
+    parser.add_argument("--limit", type=int, default=20, help="Result da elencare (default: 20)")
+    args = parser.parse_args()
+
+    if args.migrate:
+        print(f"Importati: {migrate_json_dir()} result")
+    if args.export:
+        n = export_json(args.export, since=args.since, task_type=args.task_type)
+        print(f"Esportati: {n} result in {Path(args.export).expanduser()}")
+        return
+
+    print(f"Result in archivio: {count()}")
+    for r in summaries(args.limit):
+        icon = "✅" if r["success"] else "❌"
+        print(f"  {icon} {(r['finished_at'] or '')[:19]}  {r['type']:<14} {r['filename']}")
+
+
+if __name__ == "__main__":
+    main()
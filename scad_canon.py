@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+PANDA — Forma canonica dei sorgenti OpenSCAD
+=============================================
+
+L'LLM produce spesso lo stesso oggetto con differenze solo cosmetiche:
+spazi, commenti, ordine delle variabili, `10` vs `10.0`. Questo modulo
+tokenizza il sorgente e ne dà una forma normalizzata + hash stabile, usati
+per le chiavi dell'artifact store e della cache di validate_scad, e
+individua le variabili top-level sovrascrivibili con `-D` (riuso parametrico).
+
+Normalizzazioni (tutte senza effetto sulla geometria):
+- commenti // e /* */ e spazi rimossi
+- numeri in forma canonica (10.0 → 10, .5 → 0.5, 1e1 → 10)
+- blocchi consecutivi di assegnazioni top-level a soli letterali
+  (`w = 10; h = 20;`) ordinati per nome: non dipendono da altre variabili,
+  quindi l'ordine non cambia il risultato
+
+Uso da CLI:
+  python3 scad_canon.py file.scad          stampa forma canonica e hash
+  python3 scad_canon.py a.scad b.scad      confronta due file
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sys
+from pathlib import Path
+
+# =========================
+# TOKENIZER
+# =========================
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+)
+  | (?P<line_comment>//[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<ident>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<op><=|>=|==|!=|&&|\|\||[-+*/%^<>=!?:;,.()\[\]{}#])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_INCLUDE_RE = re.compile(r"\s*<[^>\n]*>")
+
+_LITERAL_WORDS = {"true", "false", "undef"}
+_LITERAL_OPS = {"[", "]", ",", "-", ":"}
+
+
+class ScadSyntaxError(ValueError):
+    pass
+
+
+def _canonical_number(text):
+    value = float(text)
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def tokenize(source):
+    """Lista di token (tipo, valore) senza spazi né commenti."""
+    tokens = []
+    pos = 0
+    n = len(source)
+    while pos < n:
+        m = _TOKEN_RE.match(source, pos)
+        if not m:
+            raise ScadSyntaxError(f"carattere inatteso {source[pos]!r} alla posizione {pos}")
+        kind = m.lastgroup
+        value = m.group(kind)
+        pos = m.end()
+        if kind in ("ws", "line_comment", "block_comment"):
+            continue
+        if kind == "number":
+            value = _canonical_number(value)
+        elif kind == "ident" and value in ("include", "use"):
+            # include <path> / use <path>: il path è un unico token
+            inc = _INCLUDE_RE.match(source, pos)
+            if inc:
+                tokens.append(("ident", value))
+                tokens.append(("path", inc.group(0).strip()))
+                pos = inc.end()
+                continue
+        tokens.append((kind, value))
+    return tokens
+
+# =========================
+# STATEMENT TOP-LEVEL
+# =========================
+
+def _split_top_level(tokens):
+    """Divide i token in statement top-level (fine su `;` o `}` a profondità 0)."""
+    statements, current, depth = [], [], 0
+    for i, tok in enumerate(tokens):
+        current.append(tok)
+        value = tok[1]
+        if tok[0] == "op":
+            if value in "([{":
+                depth += 1
+            elif value in ")]}":
+                depth -= 1
+        if depth == 0 and tok[0] == "path":
+            # include <...> / use <...> non terminano con ;
+            statements.append(current)
+            current = []
+            continue
+        if depth == 0 and tok[0] == "op" and value in (";", "}"):
+            nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+            if value == "}" and nxt == "else":
+                continue
+            statements.append(current)
+            current = []
+    if current:
+        statements.append(current)
+    return statements
+
+
+def _literal_assignment(stmt):
+    """Nome della variabile se stmt è `nome = <solo letterali>;`, altrimenti None."""
+    if len(stmt) < 4 or stmt[0][0] != "ident" or stmt[1] != ("op", "=") or stmt[-1] != ("op", ";"):
+        return None
+    for kind, value in stmt[2:-1]:
+        if kind in ("number", "string"):
+            continue
+        if kind == "ident" and value in _LITERAL_WORDS:
+            continue
+        if kind == "op" and value in _LITERAL_OPS:
+            continue
+        return None
+    return stmt[0][1]
+
+
+def _sort_literal_runs(statements):
+    out, run = [], []
+
+    def flush():
+        names = [_literal_assignment(s) for s in run]
+        if len(set(names)) == len(names):
+            run.sort(key=_literal_assignment)
+        out.extend(run)
+        run.clear()
+
+    for stmt in statements:
+        if _literal_assignment(stmt):
+            run.append(stmt)
+        else:
+            flush()
+            out.append(stmt)
+    flush()
+    return out
+
+# =========================
+# API
+# =========================
+
+def canonical_tokens(source):
+    return [tok for stmt in _sort_literal_runs(_split_top_level(tokenize(source))) for tok in stmt]
+
+
+def canonicalize(source):
+    """
+    Forma canonica (ancora OpenSCAD valido): token separati da uno spazio,
+    a capo dopo ogni `;`, `{`, `}` e include/use.
+    """
+    lines, line = [], []
+    for kind, value in canonical_tokens(source):
+        line.append(value)
+        if value in (";", "{", "}") or kind == "path":
+            lines.append(" ".join(line))
+            line = []
+    if line:
+        lines.append(" ".join(line))
+    return "\n".join(lines) + "\n"
+
+
+def canonical_hash(source):
+    """
+    sha256 della forma canonica. Se il sorgente non è tokenizzabile
+    (stringa/commento non chiuso, caratteri estranei) si ripiega sull'hash
+    dei byte grezzi: stesso risultato solo per file identici.
+    """
+    if isinstance(source, bytes):
+        source = source.decode("utf-8", errors="replace")
+    try:
+        material = "canon1\n" + canonicalize(source)
+    except ScadSyntaxError:
+        material = "raw\n" + source
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def equivalent(a, b):
+    """True se i due sorgenti differiscono solo cosmeticamente."""
+    return canonical_hash(a) == canonical_hash(b)
+
+
+def literal_assignments(source):
+    """
+    Variabili top-level assegnate a soli letterali: {nome: valore canonico}
+    (es. {"jar_d": "55", "size": "[10,20]"}), cioè quelle sovrascrivibili
+    con `openscad -D nome=valore` senza toccare il resto del file.
+    """
+    out = {}
+    for stmt in _split_top_level(tokenize(source)):
+        name = _literal_assignment(stmt)
+        if name:
+            out[name] = "".join(value for _, value in stmt[2:-1])
+    return out
+
+
+_FILE_CALLS = ("import", "surface")
+
+
+def external_refs(source):
+    """
+    File esterni da cui dipende la geometria: [(tipo, path)] con tipo in
+    include/use/import/surface, nell'ordine del sorgente. path è None se non
+    è un letterale (es. import(nome_variabile)) e quindi non risolvibile.
+    Sorgente non tokenizzabile: [("unknown", None)] se cita una di queste parole.
+    """
+    if isinstance(source, bytes):
+        source = source.decode("utf-8", errors="replace")
+    try:
+        tokens = tokenize(source)
+    except ScadSyntaxError:
+        return [("unknown", None)] if re.search(r"\b(include|use|import|surface)\b", source) else []
+    refs = []
+    for i, (kind, value) in enumerate(tokens):
+        if kind == "path":
+            refs.append((tokens[i - 1][1], value[1:-1].strip()))
+        elif kind == "ident" and value in _FILE_CALLS and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+            # Primo argomento stringa (posizionale o file=...) fino alla parentesi di chiusura
+            path, depth = None, 0
+            for kind2, value2 in tokens[i + 1:]:
+                depth += {"(": 1, ")": -1}.get(value2, 0)
+                if depth == 0:
+                    break
+                if kind2 == "string":
+                    path = json.loads(value2)
+                    break
+                if kind2 == "ident" and value2 != "file":
+                    break
+            refs.append((value, path))
+    return refs
+
+
+def literal(value):
+    """Valore Python → letterale OpenSCAD nella stessa forma di literal_assignments()."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "undef"
+    if isinstance(value, (int, float)):
+        text = _canonical_number(repr(abs(value)))
+        return f"-{text}" if value < 0 else text
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(literal(v) for v in value) + "]"
+    return json.dumps(str(value))
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — forma canonica OpenSCAD")
+    parser.add_argument("files", nargs="+", help="File .scad")
+    args = parser.parse_args()
+
+    sources = [Path(f).read_text(errors="replace") for f in args.files]
+    if len(sources) == 1:
+        try:
+            sys.stdout.write(canonicalize(sources[0]))
+        except ScadSyntaxError as e:
+            print(f"[WARN] {e}", file=sys.stderr)
+        print(f"# sha256: {canonical_hash(sources[0])}")
+        return
+    hashes = [canonical_hash(s) for s in sources]
+    for f, h in zip(args.files, hashes):
+        print(f"{h[:16]}  {f}")
+    print("equivalenti" if len(set(hashes)) == 1 else "diversi")
+    sys.exit(0 if len(set(hashes)) == 1 else 1)
+
+
+if __name__ == "__main__":
+    main()
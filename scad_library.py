@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+"""
+PANDA — Libreria di generatori OpenSCAD parametrici
+=====================================================
+
+Per le categorie più frequenti (e più lente da far scrivere all'LLM)
+il codice SCAD è generato in modo deterministico da template scritti a mano:
+
+  gears       ingranaggio cilindrico a denti dritti, profilo evolvente
+  threads     vite a testa esagonale (ISO 4017) e dado esagonale (ISO 4032)
+  enclosures  scatola con angoli arrotondati, scomparti e coperchio opzionali
+  brackets    staffa ad L con nervature e fori viti
+
+Un generatore si applica solo se la categoria coincide (stesse categorie
+di prompts/objects/) e se il task fornisce i parametri obbligatori; i nomi
+dei parametri sono cercati tra alias comuni (es. `teeth`, `denti`, `z`).
+Altrimenti il worker ripiega sull'LLM. Se la categoria è dedotta dalle
+keyword (non da object_category) la descrizione non deve chiedere più di
+quanto il generatore modella (extra_words): "scatola con cerniera e slot
+USB" va all'LLM, non alla scatola generica.
+
+Il codice prodotto segue la struttura richiesta all'LLM: variabili
+parametriche in cima (sovrascrivibili con -D), modulo main_object(),
+ultima riga main_object();
+
+Uso da CLI:
+  python3 scad_library.py                                  elenca i generatori
+  python3 scad_library.py gears '{"teeth": 20, "module": 2}'
+  python3 scad_library.py threads '{"length": 30}' --description "Vite M6"
+  python3 scad_library.py --check [--openscad PATH]        compila i casi di prova
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import stl_io
+from scad_canon import literal
+
+REQUIRED = object()
+
+# Filetti metrici ISO: d nominale, passo, chiave, altezza dado, altezza testa vite
+ISO_METRIC = {
+    3:  {"d": 3,  "pitch": 0.5,  "key": 5.5,  "nut_h": 2.4, "head_h": 2.0},
+    4:  {"d": 4,  "pitch": 0.7,  "key": 7.0,  "nut_h": 3.2, "head_h": 2.8},
+    5:  {"d": 5,  "pitch": 0.8,  "key": 8.0,  "nut_h": 4.0, "head_h": 3.5},
+    6:  {"d": 6,  "pitch": 1.0,  "key": 10.0, "nut_h": 5.0, "head_h": 4.0},
+    8:  {"d": 8,  "pitch": 1.25, "key": 13.0, "nut_h": 6.5, "head_h": 5.3},
+    10: {"d": 10, "pitch": 1.5,  "key": 17.0, "nut_h": 8.0, "head_h": 6.4},
+}
+
+_METRIC_RE = re.compile(r"\bm\s?(\d{1,2})(?![\d.])", re.IGNORECASE)
+_NUT_RE = re.compile(r"\b(dado|dadi|nut|nuts)\b", re.IGNORECASE)
+_BOLT_RE = re.compile(r"\b(vite|viti|bullone|bolt|screw)\b", re.IGNORECASE)
+_L_SHAPE_RE = re.compile(
+    r"\b(ad|a|forma di|tipo)\s+l\b|\bl[- ]?(bracket|shape|shaped)\b|\bangolare\b|\bsquadr", re.IGNORECASE,
+)
+_LID_RE = re.compile(r"\b(coperchio|lid)\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+# =========================
+# PARAMETRI
+# =========================
+
+def _lookup(parameters, aliases):
+    lowered = {str(k).strip().lower(): v for k, v in parameters.items()}
+    for alias in aliases:
+        if alias in lowered:
+            return lowered[alias]
+    return None
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(re.sub(r"\s*mm$", "", str(value).strip().lower()))
+    except ValueError:
+        return None
+
+
+def _resolve(spec, parameters):
+    """Valori delle variabili del generatore; None se manca un parametro obbligatorio."""
+    values = {}
+    for name, aliases, default in spec:
+        raw = _lookup(parameters, aliases)
+        value = _number(raw) if raw is not None else None
+        if value is None:
+            if default is REQUIRED:
+                return None
+            value = default
+        values[name] = value
+    return values
+
+
+def _metric_size(description, parameters):
+    """Riga ISO_METRIC da parametri (size/thread "M6", diametro) o dalla descrizione."""
+    raw = _lookup(parameters, ("size", "thread", "filetto", "metric"))
+    for text in (str(raw or ""), description):
+        m = _METRIC_RE.search(text)
+        if m and int(m.group(1)) in ISO_METRIC:
+            return ISO_METRIC[int(m.group(1))]
+    d = _number(_lookup(parameters, ("diameter", "d_nom", "diametro", "nominal_d")) or "")
+    if d is not None and float(d).is_integer() and int(d) in ISO_METRIC:
+        return ISO_METRIC[int(d)]
+    return None
+
+
+# =========================
+# COPERTURA DELLA DESCRIZIONE
+# =========================
+
+# Parole neutre: articoli, preposizioni, verbi di richiesta, unità e nomi di misure
+_COMMON_WORDS = set("""
+un uno una il lo la i gli le l di da del dello della dei degli delle con per e ed in a ad al allo alla
+ai agli alle su sul sulla tra fra x mm cm
+a an the of with for and to by in on
+crea creare genera generare fai fare disegna progetta modella voglio vorrei serve mi stampa stampare
+create make generate design model print printable need want please
+oggetto modello pezzo semplice standard classico classica stampabile 3d
+object model part simple basic
+dimensioni misura misure larghezza profondità profondita altezza spessore diametro lunghezza raggio lato
+size dimensions width depth height thickness diameter length radius
+""".split())
+
+# Per categoria: parole che descrivono ciò che il generatore modella davvero
+_COVERED_WORDS = {
+    "gears": set("""
+        ingranaggio ingranaggi ruota dentata dentato dente denti cilindrico cilindrica dritti diritti
+        modulo foro centrale albero evolvente angolo pressione gioco
+        gear gears spur wheel tooth teeth module bore hole shaft involute pressure angle clearance straight m
+    """.split()),
+    "threads": set("""
+        vite viti bullone bulloni dado dadi testa esagonale esagonali metrica metrico metriche metrici
+        filettata filettato filettate filettati filetto passo gambo iso smusso tolleranza m
+        bolt bolts screw screws nut nuts hex hexagonal head metric threaded thread pitch shank chamfer tolerance
+    """.split()),
+    "enclosures": set("""
+        scatola scatole scatolina contenitore contenitori box organizer organizzatore portaoggetti
+        scomparti scomparto divisori divisorio coperchio pressione incastro angoli arrotondati arrotondata
+        parete pareti fondo interno interna esterno esterna righe colonne
+        compartments compartment dividers divider lid snap rounded corners corner walls wall bottom rows columns
+    """.split()),
+    "brackets": set("""
+        staffa staffe supporto angolare angolo squadretta squadra forma ad l nervature nervatura rinforzo
+        rinforzi fori foro viti vite muro parete fissaggio mensola
+        bracket brackets angle shaped shape ribs rib gusset holes hole screw screws mounting wall
+    """.split()),
+}
+
+
+def extra_words(category, description):
+    """
+    Parole della descrizione che il generatore della categoria non modella
+    (ordinate). Vuoto: la descrizione non chiede nulla oltre al generatore.
+    """
+    covered = _COVERED_WORDS.get(category, set())
+    words = {w.lower() for w in _WORD_RE.findall(description or "")}
+    return sorted(w for w in words if w not in _COMMON_WORDS and w not in covered)
+
+
+def _header(title, values, fn_value):
+    lines = [f"// {title}", "// Generato da scad_library.py (template parametrico)", ""]
+    lines += [f"{name} = {literal(value)};" for name, value in values.items()]
+    lines.append(f"$fn = {literal(fn_value or 64)};")
+    return "\n".join(lines) + "\n"
+
+# =========================
+# GENERATORI
+# =========================
+
+_GEAR_PARAMS = [
+    ("teeth", ("teeth", "denti", "num_denti", "n_teeth", "z"), REQUIRED),
+    ("modul", ("module", "modul", "modulo", "m"), REQUIRED),
+    ("thickness", ("thickness", "spessore", "width", "face_width", "height", "h"), 10),
+    ("hole_d", ("hole_d", "bore", "bore_d", "foro", "foro_centrale", "shaft_d"), 5),
+    ("pressure_angle", ("pressure_angle", "pressione", "angolo_pressione"), 20),
+    ("clearance", ("clearance", "gioco"), 0.1),
+]
+
+_GEAR_BODY = """
+pitch_r = teeth * modul / 2;
+base_r = pitch_r * cos(pressure_angle);
+outer_r = pitch_r + modul - clearance;
+root_r = pitch_r - 1.25 * modul;
+start_r = max(base_r, root_r);
+half_angle = 90 / teeth;
+flank_steps = 8;
+
+// Angolo polare (gradi) del profilo evolvente al raggio r
+function inv_angle(r) = let(a = acos(base_r / r)) tan(a) * 180 / PI - a;
+inv_pitch = inv_angle(pitch_r);
+
+function flank_point(i, side) =
+    let(r = start_r + (outer_r - start_r) * i / flank_steps,
+        a = side * max(0.5, half_angle - (inv_angle(r) - inv_pitch)))
+    [r * cos(a), r * sin(a)];
+
+module tooth_2d() {
+    polygon(concat(
+        [[0, 0]],
+        [for (i = [0:flank_steps]) flank_point(i, -1)],
+        [for (i = [flank_steps:-1:0]) flank_point(i, 1)]
+    ));
+}
+
+module gear_2d() {
+    union() {
+        circle(r = root_r);
+        for (i = [0:teeth - 1])
+            rotate(i * 360 / teeth) tooth_2d();
+    }
+}
+
+module main_object() {
+    difference() {
+        linear_extrude(height = thickness, center = true) gear_2d();
+        if (hole_d > 0)
+            cylinder(d = hole_d + 0.2, h = thickness + 2, center = true);
+    }
+}
+
+main_object();
+"""
+
+
+def gear(description, parameters, fn_value=None):
+    values = _resolve(_GEAR_PARAMS, parameters)
+    if values is None or values["teeth"] < 6 or values["modul"] <= 0:
+        return None
+    values["teeth"] = int(values["teeth"])
+    return _header("Ingranaggio cilindrico a denti dritti, profilo evolvente", values, fn_value) + _GEAR_BODY
+
+
+# Filetto: cerchio eccentrico estruso con twist → elica a profilo arrotondato,
+# sempre manifold (nessun polygon autointersecante)
+_THREAD_MODULE = """
+// Elica di filetto: raggio tra d/2 e d/2 - depth, una spira per passo
+module thread_helix(d, pitch, length, depth) {
+    linear_extrude(height = length, twist = -360 * length / pitch, slices = ceil(length / pitch * 16))
+        translate([depth / 2, 0]) circle(d = d - depth, $fn = 32);
+}
+"""
+
+_BOLT_PARAMS = [
+    ("length", ("length", "lunghezza", "shaft_length", "gambo", "l"), REQUIRED),
+    ("d_nom", ("diameter", "d_nom", "diametro", "nominal_d"), None),
+    ("pitch", ("thread_pitch", "pitch", "passo"), None),
+    ("head_h", ("head_h", "head_height", "altezza_testa", "k"), None),
+    ("key", ("head_key_size", "key_size", "chiave", "key"), None),
+    ("tolerance", ("tolerance", "tolleranza"), 0.3),
+    ("chamfer", ("chamfer", "smusso"), 0.5),
+]
+
+_BOLT_BODY = _THREAD_MODULE + """
+depth = 0.6134 * pitch;
+d_eff = d_nom - tolerance;
+
+module main_object() {
+    union() {
+        // Testa esagonale con smusso sugli spigoli superiori
+        intersection() {
+            cylinder(d = key / cos(30), h = head_h, $fn = 6);
+            cylinder(h = head_h, r1 = key / cos(30) / 2 + head_h, r2 = key / 2 + chamfer);
+        }
+        // Gambo filettato con punta smussata
+        translate([0, 0, head_h])
+            intersection() {
+                thread_helix(d_eff, pitch, length, depth);
+                cylinder(h = length, r1 = d_eff / 2 + length, r2 = d_eff / 2 - depth);
+            }
+    }
+}
+
+main_object();
+"""
+
+_NUT_PARAMS = [
+    ("d_nom", ("diameter", "d_nom", "diametro", "nominal_d"), None),
+    ("pitch", ("thread_pitch", "pitch", "passo"), None),
+    ("key", ("key_size", "head_key_size", "chiave", "key"), None),
+    ("nut_h", ("height", "nut_h", "altezza", "h"), None),
+    ("tolerance", ("tolerance", "tolleranza"), 0.3),
+]
+
+_NUT_BODY = _THREAD_MODULE + """
+depth = 0.5413 * pitch;
+d_eff = d_nom + tolerance;
+
+module main_object() {
+    difference() {
+        cylinder(d = key / cos(30), h = nut_h, $fn = 6);
+        translate([0, 0, -0.5]) thread_helix(d_eff, pitch, nut_h + 1, depth);
+    }
+}
+
+main_object();
+"""
+
+
+def thread(description, parameters, fn_value=None):
+    """Vite o dado metrico: misura da `size`/"M6" nella descrizione o dal diametro."""
+    iso = _metric_size(description, parameters)
+    if iso is None:
+        return None
+    if _NUT_RE.search(description) and not _BOLT_RE.search(description):
+        values, title, body = _resolve(_NUT_PARAMS, parameters), f"Dado esagonale M{iso['d']} (ISO 4032)", _NUT_BODY
+        defaults = {"key": iso["key"], "nut_h": iso["nut_h"]}
+    elif _BOLT_RE.search(description):
+        values, title, body = _resolve(_BOLT_PARAMS, parameters), f"Vite a testa esagonale M{iso['d']} (ISO 4017)", _BOLT_BODY
+        defaults = {"key": iso["key"], "head_h": iso["head_h"]}
+    else:
+        return None
+    if values is None:
+        return None
+    defaults.update({"d_nom": iso["d"], "pitch": iso["pitch"]})
+    for name, value in defaults.items():
+        if values.get(name) is None:
+            values[name] = value
+    return _header(title, values, fn_value) + body
+
+
+_BOX_PARAMS = [
+    ("outer_w", ("outer_w", "total_w", "width", "larghezza", "w"), REQUIRED),
+    ("outer_d", ("outer_d", "total_d", "depth", "profondita", "profondità", "d"), REQUIRED),
+    ("outer_h", ("outer_h", "total_h", "height", "altezza", "h"), REQUIRED),
+    ("wall", ("wall", "wall_outer", "parete", "spessore"), 2),
+    ("bottom", ("bottom", "floor", "fondo"), None),
+    ("corner_r", ("corner_r", "raggio_angoli", "radius"), 2),
+    ("cells_x", ("compartments_x", "cells_x", "scomparti_x", "cols"), 1),
+    ("cells_y", ("compartments_y", "cells_y", "scomparti_y", "rows"), 1),
+    ("wall_inner", ("wall_inner", "divider", "parete_interna"), None),
+    ("lid", ("lid", "coperchio"), 0),
+    ("lid_h", ("lid_h", "lid_height", "altezza_coperchio"), 8),
+    ("gap", ("gap", "snap_gap", "tolerance", "tolleranza"), 0.2),
+]
+
+_BOX_BODY = """
+inner_w = outer_w - 2 * wall;
+inner_d = outer_d - 2 * wall;
+lip_t = 1.5;
+
+module rounded_box(w, d, h, r) {
+    rr = max(r, 0.01);
+    hull()
+        for (x = [rr, w - rr], y = [rr, d - rr])
+            translate([x, y, 0]) cylinder(r = rr, h = h);
+}
+
+module shell() {
+    difference() {
+        rounded_box(outer_w, outer_d, outer_h, corner_r);
+        translate([wall, wall, bottom]) rounded_box(inner_w, inner_d, outer_h, corner_r - wall);
+    }
+}
+
+module dividers() {
+    if (cells_x > 1)
+        for (i = [1:cells_x - 1])
+            translate([wall + i * inner_w / cells_x - wall_inner / 2, wall, 0])
+                cube([wall_inner, inner_d, outer_h]);
+    if (cells_y > 1)
+        for (j = [1:cells_y - 1])
+            translate([wall, wall + j * inner_d / cells_y - wall_inner / 2, 0])
+                cube([inner_w, wall_inner, outer_h]);
+}
+
+// Coperchio a pressione: piastra + bordo interno che entra nella scatola con gioco gap
+module lid_part() {
+    rounded_box(outer_w, outer_d, wall, corner_r);
+    translate([wall + gap, wall + gap, wall])
+        difference() {
+            rounded_box(inner_w - 2 * gap, inner_d - 2 * gap, lid_h - wall, corner_r - wall - gap);
+            translate([lip_t, lip_t, -1])
+                rounded_box(inner_w - 2 * gap - 2 * lip_t, inner_d - 2 * gap - 2 * lip_t, lid_h, corner_r - wall - gap - lip_t);
+        }
+}
+
+module main_object() {
+    union() {
+        shell();
+        dividers();
+    }
+    if (lid > 0)
+        translate([outer_w + 10, 0, 0]) lid_part();
+}
+
+main_object();
+"""
+
+
+def enclosure(description, parameters, fn_value=None):
+    values = _resolve(_BOX_PARAMS, parameters)
+    if values is None:
+        return None
+    if values["bottom"] is None:
+        values["bottom"] = values["wall"]
+    if values["wall_inner"] is None:
+        values["wall_inner"] = values["wall"]
+    if _lookup(parameters, ("lid", "coperchio")) is None and _LID_RE.search(description):
+        values["lid"] = 1
+    values["cells_x"], values["cells_y"] = int(values["cells_x"]), int(values["cells_y"])
+    if min(values["outer_w"], values["outer_d"]) <= 2 * values["wall"] or values["outer_h"] <= values["bottom"]:
+        return None
+    return _header("Scatola con angoli arrotondati", values, fn_value) + _BOX_BODY
+
+
+_L_BRACKET_PARAMS = [
+    ("width", ("width", "larghezza", "bracket_w", "w"), REQUIRED),
+    ("vert_h", ("vert_h", "height", "altezza", "h", "mount_h"), REQUIRED),
+    ("horiz_d", ("horiz_d", "depth", "profondita", "profondità", "d", "arm_length", "length"), REQUIRED),
+    ("thick", ("thick", "thickness", "spessore", "wall"), 4),
+    ("hole_d", ("hole_d", "screw_hole_d", "screw_d", "foro"), 5),
+    ("ribs", ("ribs", "nervature"), 2),
+    ("rib_thick", ("rib_thick", "spessore_nervature"), 3),
+]
+
+_L_BRACKET_BODY = """
+hole_y = width >= 40 ? [width / 4, 3 * width / 4] : [width / 2];
+rib_y = ribs > 1 ? [for (i = [0:ribs - 1]) rib_thick / 2 + i * (width - rib_thick) / (ribs - 1)] : [width / 2];
+
+module rib(base, height, t) {
+    rotate([90, 0, 0]) linear_extrude(height = t, center = true)
+        polygon([[0, 0], [base, 0], [0, height]]);
+}
+
+module main_object() {
+    difference() {
+        union() {
+            cube([horiz_d, width, thick]);     // piatto orizzontale
+            cube([thick, width, vert_h]);      // piatto verticale (parete)
+            if (ribs > 0)
+                for (y = rib_y)
+                    translate([thick, y, thick])
+                        rib((horiz_d - thick) * 0.65, (vert_h - thick) * 0.65, rib_thick);
+        }
+        // Fori viti: verticali nel piatto orizzontale, orizzontali nella parete
+        for (y = hole_y) {
+            translate([thick + (horiz_d - thick) * 0.6, y, -1])
+                cylinder(d = hole_d, h = thick + 2);
+            translate([-1, y, thick + (vert_h - thick) * 0.6])
+                rotate([0, 90, 0]) cylinder(d = hole_d, h = thick + 2);
+        }
+    }
+}
+
+main_object();
+"""
+
+
+def l_bracket(description, parameters, fn_value=None):
+    """Solo staffe esplicitamente ad L: "staffa", "supporto" da soli sono troppo generici."""
+    if not _L_SHAPE_RE.search(description):
+        return None
+    values = _resolve(_L_BRACKET_PARAMS, parameters)
+    if values is None or min(values["vert_h"], values["horiz_d"]) <= values["thick"]:
+        return None
+    values["ribs"] = int(values["ribs"])
+    return _header("Staffa ad L con nervature", values, fn_value) + _L_BRACKET_BODY
+
+
+# Categoria (come prompts/objects/{categoria}.txt) → generatori in ordine di prova
+GENERATORS = {
+    "gears": [("involute_gear", gear)],
+    "threads": [("metric_fastener", thread)],
+    "enclosures": [("box", enclosure)],
+    "brackets": [("l_bracket", l_bracket)],
+}
+
+# =========================
+# API
+# =========================
+
+def generate(category, description, parameters, fn_value=None):
+    """
+    Codice SCAD deterministico per la categoria, se un generatore si applica
+    con i parametri del task. Ritorna (nome generatore, codice) o None.
+    """
+    for name, func in GENERATORS.get(category, []):
+        code = func(description or "", parameters or {}, fn_value)
+        if code:
+            return name, code
+    return None
+
+# =========================
+# VERIFICA
+# =========================
+
+# Casi di prova per --check: (categoria, descrizione, parametri)
+SAMPLES = [
+    ("gears", "Ingranaggio", {"teeth": 20, "module": 2}),
+    ("gears", "Ingranaggio piccolo", {"teeth": 8, "module": 1.5, "bore": 0}),
+    ("threads", "Vite M6", {"length": 20}),
+    ("threads", "Vite M3", {"length": 8}),
+    ("threads", "Dado M8", {}),
+    ("enclosures", "Scatola", {"width": 60, "depth": 40, "height": 30}),
+    ("enclosures", "Scatola con coperchio", {"width": 80, "depth": 50, "height": 30,
+                                             "compartments_x": 3, "compartments_y": 2}),
+    ("brackets", "Staffa ad L", {"width": 40, "height": 50, "depth": 40}),
+    ("brackets", "Staffa ad L", {"width": 20, "height": 30, "depth": 30, "ribs": 1}),
+]
+
+
+def check(openscad="openscad", fn_value=32, timeout=600):
+    """
+    Compila i SAMPLES con OpenSCAD e verifica la mesh con stl_io: compilazione
+    riuscita, triangoli presenti, mesh manifold. Ritorna [(categoria,
+    descrizione, generatore, errore o None), ...].
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="scad_library_") as tmp:
+        for i, (category, description, parameters) in enumerate(SAMPLES):
+            name, code = generate(category, description, parameters, fn_value)
+            scad_path, stl_path = Path(tmp) / f"{i}.scad", Path(tmp) / f"{i}.stl"
+            scad_path.write_text(code)
+            error = None
+            try:
+                proc = subprocess.run([openscad, "-o", str(stl_path), str(scad_path)],
+                                      capture_output=True, text=True, timeout=timeout)
+                if proc.returncode != 0 or not stl_path.exists():
+                    error = (proc.stderr.strip().splitlines() or ["compilazione fallita"])[-1]
+                else:
+                    metrics = stl_io.mesh_metrics(stl_path)
+                    if not metrics["triangles"]:
+                        error = "mesh vuota"
+                    elif not metrics["manifold"]["is_manifold"]:
+                        error = f"mesh non manifold ({metrics['manifold']})"
+            except (OSError, subprocess.TimeoutExpired) as e:
+                error = str(e)
+            results.append((category, description, name, error))
+    return results
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — generatori OpenSCAD parametrici")
+    parser.add_argument("category", nargs="?", help=f"Categoria: {', '.join(GENERATORS)}")
+    parser.add_argument("parameters", nargs="?", default="{}", help="Parametri JSON")
+    parser.add_argument("--description", default="", help="Descrizione (per viti/dadi, staffe ad L)")
+    parser.add_argument("--fn", type=int, default=64, help="$fn (default 64)")
+    parser.add_argument("--check", action="store_true", help="Compila i casi di prova con OpenSCAD e verifica le mesh")
+    parser.add_argument("--openscad", default="openscad", help="Eseguibile OpenSCAD per --check")
+    args = parser.parse_args()
+
+    if args.check:
+        failed = 0
+        for category, description, name, error in check(args.openscad):
+            failed += error is not None
+            print(f"{'✅' if error is None else '❌'} {category:<12} {name:<16} {description}"
+                  + (f" — {error}" if error else ""))
+        sys.exit(1 if failed else 0)
+
+    if not args.category:
+        for category, gens in GENERATORS.items():
+            print(f"{category:<12} {', '.join(name for name, _ in gens)}")
+        return
+    out = generate(args.category, args.description, json.loads(args.parameters), args.fn)
+    if out is None:
+        print("Nessun generatore applicabile (parametri obbligatori mancanti?)", file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(out[1])
+
+
+if __name__ == "__main__":
+    main()
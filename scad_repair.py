@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+PANDA — Riparazioni deterministiche degli errori OpenSCAD
+==========================================================
+
+Molti errori di compilazione del codice generato sono sempre gli stessi:
+variabile o modulo scritto male, `include <...>` di una libreria che non
+c'è, `main_object()` definito ma mai chiamato, ``` markdown rimasto nel
+codice, parentesi graffe non chiuse. Prima di rimandare codice + errore
+all'LLM (minuti) il worker prova queste correzioni e ricompila (secondi).
+
+- firma dell'errore: righe ERROR/WARNING del compile_log con path, numeri
+  di riga e nomi tra apici sostituiti da segnaposto, così lo stesso tipo
+  di errore su file diversi ha la stessa firma
+- regole: funzioni (codice, log) → codice corretto o None
+- apprendimento: per ogni firma si contano successi/fallimenti di ogni
+  correzione (l'ordine dei tentativi segue lo storico) e dalle correzioni
+  riuscite dell'LLM si ricavano patch a livello di riga (poche righe
+  sostituite/rimosse) riapplicate quando la stessa firma si ripresenta
+
+Database SQLite in ~/panda/db/repairs.sqlite3.
+
+Uso da CLI:
+  python3 scad_repair.py                          statistiche per firma
+  python3 scad_repair.py file.scad log.txt        correzioni candidate
+"""
+
+import argparse
+import difflib
+import hashlib
+import json
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+import scad_canon
+
+# =========================
+# PATHS
+# =========================
+
+PANDA_HOME = Path.home() / "panda"
+DB_DIR = PANDA_HOME / "db"
+REPAIRS_DB = DB_DIR / "repairs.sqlite3"
+
+# Patch apprese: oltre queste dimensioni la correzione dell'LLM è una
+# riscrittura, non un errore ricorrente
+MAX_PATCH_HUNKS = 3
+MAX_PATCH_LINES = 6
+MAX_PATCHES_PER_SIGNATURE = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    sig         TEXT PRIMARY KEY,
+    sample      TEXT,
+    seen        INTEGER NOT NULL DEFAULT 0,
+    rule_fixes  INTEGER NOT NULL DEFAULT 0,
+    llm_fixes   INTEGER NOT NULL DEFAULT 0,
+    unresolved  INTEGER NOT NULL DEFAULT 0,
+    last_seen   TEXT
+);
+CREATE TABLE IF NOT EXISTS fixes (
+    sig         TEXT NOT NULL,
+    fix         TEXT NOT NULL,
+    patch       TEXT,
+    successes   INTEGER NOT NULL DEFAULT 0,
+    failures    INTEGER NOT NULL DEFAULT 0,
+    created_at  TEXT,
+    PRIMARY KEY (sig, fix)
+);
+"""
+
+# =========================
+# CONNESSIONE
+# =========================
+
+def connect(db_path=None):
+    db_path = Path(db_path or REPAIRS_DB)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+# =========================
+# FIRMA ERRORE
+# =========================
+
+_MESSAGE_RE = re.compile(r"ERROR|WARNING|top level", re.IGNORECASE)
+_FILE_RE = re.compile(r""",?\s*in file\s+("[^"]*"|'[^']*'|\S+?)(?=,|\s|$)""")
+_QUOTED_RE = re.compile(r"(?<!\w)'[^']*'|\"[^\"]*\"")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def signature(compile_log):
+    """
+    (firma, messaggi normalizzati) del compile_log, oppure None se non ci
+    sono messaggi di OpenSCAD (timeout, binario mancante): niente da riparare.
+    """
+    lines = set()
+    for line in (compile_log or "").splitlines():
+        if not _MESSAGE_RE.search(line):
+            continue
+        line = _FILE_RE.sub("", line)
+        line = _QUOTED_RE.sub("'<x>'", line)
+        line = _NUMBER_RE.sub("N", line)
+        lines.add(re.sub(r"\s+", " ", line).strip().rstrip("."))
+    if not lines:
+        return None
+    sample = "\n".join(sorted(lines))
+    return hashlib.sha1(sample.encode()).hexdigest()[:16], sample
+
+# =========================
+# REGOLE
+# =========================
+
+_IDENT = r"[A-Za-z_$][A-Za-z0-9_$]*"
+_UNKNOWN_RE = re.compile(rf"unknown (variable|module|function) ['\"]({_IDENT})['\"]", re.IGNORECASE)
+_MISSING_INCLUDE_RE = re.compile(r"Can't open (?:include file|library|input file) ['\"]([^'\"]+)['\"]", re.IGNORECASE)
+_EMPTY_TOP_RE = re.compile(r"top level object is empty|no top.level geometry", re.IGNORECASE)
+_PARSER_LINE_RE = re.compile(r"Parser error.*?line (\d+)", re.IGNORECASE)
+_MODULE_DEF_RE = re.compile(rf"^\s*module\s+({_IDENT})\s*\(([^)]*)\)", re.MULTILINE)
+_FUNCTION_DEF_RE = re.compile(rf"^\s*function\s+({_IDENT})\s*\(", re.MULTILINE)
+_ASSIGN_RE = re.compile(rf"^\s*({_IDENT})\s*=(?!=)", re.MULTILINE)
+
+
+def _rename(code, old, new):
+    return re.sub(rf"(?<![\w$]){re.escape(old)}(?![\w$])", new, code)
+
+
+def fix_markdown_fence(code, compile_log):
+    """Righe ``` rimaste nel codice (blocchi markdown)."""
+    lines = code.splitlines()
+    kept = [line for line in lines if not line.lstrip().startswith("```")]
+    if len(kept) == len(lines):
+        return None
+    return "\n".join(kept) + "\n"
+
+
+def fix_missing_include(code, compile_log):
+    """include/use di file che OpenSCAD non trova: la riga viene rimossa."""
+    missing = {Path(name).name for name in _MISSING_INCLUDE_RE.findall(compile_log)}
+    if not missing:
+        return None
+    out, changed = [], False
+    for line in code.splitlines():
+        m = re.match(r"\s*(?:include|use)\s*<([^>]+)>\s*;?\s*$", line)
+        if m and Path(m.group(1).strip()).name in missing:
+            changed = True
+            continue
+        out.append(line)
+    return "\n".join(out) + "\n" if changed else None
+
+
+def fix_unknown_identifier(code, compile_log):
+    """
+    Variabile/modulo/funzione sconosciuta con un nome definito quasi uguale
+    (maiuscole, refuso): si usa il nome definito.
+    """
+    defined = {
+        "variable": set(_ASSIGN_RE.findall(code)),
+        "module": {name for name, _ in _MODULE_DEF_RE.findall(code)},
+        "function": set(_FUNCTION_DEF_RE.findall(code)),
+    }
+    fixed = code
+    for kind, name in _UNKNOWN_RE.findall(compile_log):
+        names = defined[kind.lower()] - {name}
+        same_case = [n for n in names if n.lower() == name.lower()]
+        match = same_case or difflib.get_close_matches(name, names, n=1, cutoff=0.8)
+        if match:
+            fixed = _rename(fixed, name, match[0])
+    return fixed if fixed != code else None
+
+
+def _callable_without_args(params):
+    """True se tutti i parametri del modulo hanno un valore di default."""
+    return all("=" in p for p in params.split(",") if p.strip())
+
+
+def fix_missing_main_call(code, compile_log):
+    """
+    Nessuna geometria top-level: il modulo principale è definito ma mai
+    chiamato. Si chiama main_object() o l'unico modulo non usato altrove.
+    """
+    if not _EMPTY_TOP_RE.search(compile_log):
+        return None
+    modules = {name: params for name, params in _MODULE_DEF_RE.findall(code)}
+    # Moduli che compaiono solo nella propria definizione
+    unused = [
+        name for name in modules
+        if len(re.findall(rf"(?<![\w$]){re.escape(name)}\s*\(", code)) == 1
+    ]
+    if "main_object" in unused:
+        target = "main_object"
+    elif len(unused) == 1:
+        target = unused[0]
+    else:
+        return None
+    if not _callable_without_args(modules[target]):
+        return None
+    return code.rstrip() + f"\n\n{target}();\n"
+
+
+def fix_unbalanced_braces(code, compile_log):
+    """Parser error con graffe aperte e mai chiuse: si chiudono in fondo."""
+    if not _PARSER_LINE_RE.search(compile_log):
+        return None
+    try:
+        tokens = scad_canon.tokenize(code)
+    except scad_canon.ScadSyntaxError:
+        return None
+    count = {v: 0 for v in "()[]{}"}
+    for kind, value in tokens:
+        if kind == "op" and value in count:
+            count[value] += 1
+    missing = count["{"] - count["}"]
+    if missing <= 0 or count["("] != count[")"] or count["["] != count["]"]:
+        return None
+    return code.rstrip() + "\n" + "}\n" * missing
+
+
+def fix_missing_semicolon(code, compile_log):
+    """
+    Parser error alla riga N dopo un'assegnazione senza `;` (`w = 10` a
+    capo): si aggiunge il punto e virgola alla riga precedente.
+    """
+    m = _PARSER_LINE_RE.search(compile_log)
+    if not m:
+        return None
+    lines = code.splitlines()
+    n = int(m.group(1)) - 1
+    for i in range(min(n, len(lines)) - 1, -1, -1):
+        text = lines[i].split("//")[0].rstrip()
+        if not text:
+            continue
+        if re.match(rf"\s*{_IDENT}\s*=(?!=)", text) and not text.endswith((";", "{", "}", ",", "(", "[", "=")):
+            lines[i] = text + ";"
+            return "\n".join(lines) + "\n"
+        return None
+    return None
+
+
+# Ordine di default (prima le più specifiche); lo storico per firma lo riordina
+RULES = {
+    "markdown_fence": fix_markdown_fence,
+    "missing_include": fix_missing_include,
+    "unknown_identifier": fix_unknown_identifier,
+    "missing_main_call": fix_missing_main_call,
+    "unbalanced_braces": fix_unbalanced_braces,
+    "missing_semicolon": fix_missing_semicolon,
+}
+
+# =========================
+# PATCH APPRESE
+# =========================
+
+def _line_patches(before, after):
+    """
+    Differenze riga per riga (senza indentazione e righe vuote) tra codice
+    fallito e codice corretto dall'LLM: [{"old": [...], "new": [...]}] o
+    None se la correzione è troppo estesa per essere ricorrente.
+    """
+    a = [line.strip() for line in before.splitlines() if line.strip()]
+    b = [line.strip() for line in after.splitlines() if line.strip()]
+    patches, changed = [], 0
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if op == "equal":
+            continue
+        old, new = a[i1:i2], b[j1:j2]
+        changed += max(len(old), len(new))
+        if not old:
+            # Inserimento: ancorato alla riga precedente (o seguente, in testa)
+            if i1 > 0:
+                old, new = [a[i1 - 1]], [a[i1 - 1]] + new
+            elif a:
+                old, new = [a[0]], new + [a[0]]
+            else:
+                return None
+        patches.append({"old": old, "new": new})
+    if not patches or len(patches) > MAX_PATCH_HUNKS or changed > MAX_PATCH_LINES:
+        return None
+    return patches
+
+
+def apply_patches(code, patches):
+    """Applica le patch se tutte le righe "old" sono presenti (consecutive); altrimenti None."""
+    lines = code.splitlines()
+    for patch in patches:
+        content = [(i, line.strip()) for i, line in enumerate(lines) if line.strip()]
+        texts = [t for _, t in content]
+        old = patch["old"]
+        start = next((k for k in range(len(texts) - len(old) + 1) if texts[k:k + len(old)] == old), None)
+        if start is None:
+            return None
+        first, last = content[start][0], content[start + len(old) - 1][0]
+        indent = re.match(r"\s*", lines[first]).group(0)
+        lines[first:last + 1] = [indent + line for line in patch["new"]]
+    return "\n".join(lines) + "\n"
+
+# =========================
+# API
+# =========================
+
+def candidates(code, compile_log, limit=3):
+    """
+    Correzioni da provare, nell'ordine: (firma, [(nome, codice), ...]).
+    Prima le patch/regole che hanno già risolto questa firma, poi le regole
+    applicabili (tutte insieme se più d'una, poi singolarmente). Scartati i
+    candidati equivalenti al codice originale o tra loro.
+    """
+    sig = signature(compile_log)
+    if sig is None:
+        return None, []
+    sig = sig[0]
+
+    with closing(connect()) as conn:
+        history = conn.execute(
+            "SELECT fix, patch, successes, failures FROM fixes WHERE sig = ? "
+            "ORDER BY successes - failures DESC, successes DESC",
+            (sig,),
+        ).fetchall()
+
+    rule_codes = {}
+    for name, rule in RULES.items():
+        fixed = rule(code, compile_log)
+        if fixed:
+            rule_codes[name] = fixed
+
+    ordered = []
+    for row in history:
+        if row["successes"] <= row["failures"]:
+            continue
+        kind, _, name = row["fix"].partition(":")
+        if kind == "rule" and name in rule_codes:
+            ordered.append((row["fix"], rule_codes[name]))
+        elif kind == "patch":
+            fixed = apply_patches(code, json.loads(row["patch"]))
+            if fixed:
+                ordered.append((row["fix"], fixed))
+    if len(rule_codes) > 1:
+        combined = code
+        for rule in RULES.values():
+            combined = rule(combined, compile_log) or combined
+        ordered.append(("rule:" + "+".join(rule_codes), combined))
+    ordered.extend((f"rule:{name}", fixed) for name, fixed in rule_codes.items())
+
+    out, seen = [], {scad_canon.canonical_hash(code)}
+    for name, fixed in ordered:
+        h = scad_canon.canonical_hash(fixed)
+        if h in seen:
+            continue
+        seen.add(h)
+        out.append((name, fixed))
+        if len(out) >= limit:
+            break
+    return sig, out
+
+
+def observe(compile_log):
+    """Registra un errore di compilazione; ritorna la firma (o None)."""
+    sig = signature(compile_log)
+    if sig is None:
+        return None
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO signatures (sig, sample, seen, last_seen) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(sig) DO UPDATE SET seen = seen + 1, last_seen = excluded.last_seen",
+            (sig[0], sig[1], datetime.now().isoformat()),
+        )
+    return sig[0]
+
+
+def record(sig, fix, success, patch=None):
+    """Esito di una correzione (fix = "rule:nome", "patch:hash" o "llm") per la firma."""
+    if not sig:
+        return
+    column = "successes" if success else "failures"
+    now = datetime.now().isoformat()
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            f"INSERT INTO fixes (sig, fix, patch, {column}, created_at) VALUES (?, ?, ?, 1, ?) "
+            f"ON CONFLICT(sig, fix) DO UPDATE SET {column} = {column} + 1",
+            (sig, fix, json.dumps(patch) if patch else None, now),
+        )
+        if success:
+            counter = "llm_fixes" if fix == "llm" else "rule_fixes"
+            conn.execute(f"UPDATE signatures SET {counter} = {counter} + 1 WHERE sig = ?", (sig,))
+
+
+def learn(sig, before, after):
+    """
+    Correzione riuscita dell'LLM: la registra e, se è una modifica di poche
+    righe, la salva come patch riapplicabile alla stessa firma.
+    """
+    if not sig:
+        return None
+    record(sig, "llm", True)
+    patches = _line_patches(before, after)
+    if not patches:
+        return None
+    name = "patch:" + hashlib.sha1(json.dumps(patches, sort_keys=True).encode()).hexdigest()[:12]
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO fixes (sig, fix, patch, successes, created_at) VALUES (?, ?, ?, 1, ?)",
+            (sig, name, json.dumps(patches), datetime.now().isoformat()),
+        )
+        # Tiene solo le patch più utili per firma
+        conn.execute(
+            "DELETE FROM fixes WHERE sig = ? AND fix LIKE 'patch:%' AND fix NOT IN ("
+            "SELECT fix FROM fixes WHERE sig = ? AND fix LIKE 'patch:%' "
+            "ORDER BY successes - failures DESC, created_at DESC LIMIT ?)",
+            (sig, sig, MAX_PATCHES_PER_SIGNATURE),
+        )
+    return name
+
+
+def unresolved(sig):
+    if not sig:
+        return
+    with closing(connect()) as conn, conn:
+        conn.execute("UPDATE signatures SET unresolved = unresolved + 1 WHERE sig = ?", (sig,))
+
+
+def stats(limit=10):
+    with closing(connect()) as conn:
+        totals = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(seen), 0), COALESCE(SUM(rule_fixes), 0), "
+            "COALESCE(SUM(llm_fixes), 0), COALESCE(SUM(unresolved), 0) FROM signatures"
+        ).fetchone()
+        top = conn.execute(
+            "SELECT sig, sample, seen, rule_fixes, llm_fixes, unresolved FROM signatures "
+            "ORDER BY seen DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        patches = conn.execute("SELECT COUNT(*) FROM fixes WHERE fix LIKE 'patch:%'").fetchone()[0]
+    return {
+        "signatures": totals[0],
+        "errors": totals[1],
+        "rule_fixes": totals[2],
+        "llm_fixes": totals[3],
+        "unresolved": totals[4],
+        "patches": patches,
+        "top": [dict(row) for row in top],
+    }
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — riparazioni errori OpenSCAD")
+    parser.add_argument("scad", nargs="?", help="File .scad che non compila")
+    parser.add_argument("log", nargs="?", help="compile_log di OpenSCAD (file di testo)")
+    args = parser.parse_args()
+
+    if args.scad and args.log:
+        code = Path(args.scad).read_text(errors="replace")
+        sig, found = candidates(code, Path(args.log).read_text(errors="replace"), limit=10)
+        print(f"Firma: {sig or '-'}")
+        for name, fixed in found:
+            print(f"--- {name}")
+            print("".join(difflib.unified_diff(
+                code.splitlines(True), fixed.splitlines(True), "originale", name, n=1,
+            )))
+        if not found:
+            print("Nessuna correzione applicabile")
+        return
+
+    st = stats()
+    print(f"Firme: {st['signatures']}  errori: {st['errors']}  patch apprese: {st['patches']}")
+    print(f"Risolti da regole/patch: {st['rule_fixes']}  dall'LLM: {st['llm_fixes']}  irrisolti: {st['unresolved']}")
+    for row in st["top"]:
+        print(f"{row['sig']}  ×{row['seen']:<4} regole {row['rule_fixes']:<3} llm {row['llm_fixes']:<3} "
+              f"{row['sample'].splitlines()[0][:70]}")
+
+
+if __name__ == "__main__":
+    main()
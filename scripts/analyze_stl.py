@@ -11,45 +11,62 @@ Analizza un file STL e produce un report con:
 
 Supporta sia STL ASCII che binario.
 
+Con NumPy (consigliato) i triangoli sono un array (N,3,3) float32 e
+bounding box, volume, area e verifica manifold sono vettorizzati: un
+modello da 500k triangoli si analizza in pochi secondi. Senza NumPy si
+usa l'implementazione in puro Python (stesso report, più lenta).
+
 Uso:
   python3 analyze_stl.py modello.stl
   python3 analyze_stl.py modello.stl --infill 30
   python3 analyze_stl.py modello.stl --json
   python3 analyze_stl.py ~/panda/models/stl/*.stl   (analisi multipla)
+  python3 analyze_stl.py ~/panda/models/stl/*.stl --jobs 0 --changed-only --ndjson
+                                                    (tutti i core, solo file cambiati,
+                                                     un JSON per riga appena pronto)
+
+Se accanto allo STL c'è un sidecar .meta.json aggiornato (scritto dal worker
+dopo la compilazione) il report usa quelle metriche senza riparsare la mesh;
+--recompute lo ignora.
+
+Con --changed-only i file con stessa dimensione e mtime dell'ultima analisi
+(manifest in ~/panda/status/analyze_stl_manifest.json) vengono saltati;
+cambiando versione dell'analizzatore si rianalizza tutto.
 """
 
 import argparse
 import json
+import os
 import struct
 import sys
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+# Moduli condivisi con il worker (root del progetto)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import stl_io
+
+PANDA_HOME = Path.home() / "panda"
+MANIFEST_FILE = PANDA_HOME / "status" / "analyze_stl_manifest.json"
+
+# Da incrementare quando cambia il report: invalida il manifest di --changed-only
+ANALYZER_VERSION = 2
+
+# Record binario STL: normale, 3 vertici, attributo (50 byte)
+_STL_RECORD = [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")] if _HAS_NUMPY else None
+
 
 # ---------------------------------------------------------------------------
 # STL parsing
 # ---------------------------------------------------------------------------
 
-def _parse_ascii_stl(content: str) -> list[tuple]:
-    """Parsa STL ASCII. Ritorna lista di triangoli [(v0,v1,v2), ...]."""
-    triangles = []
-    current_verts = []
-    for line in content.splitlines():
-        line = line.strip()
-        if line.startswith("vertex "):
-            parts = line.split()
-            if len(parts) == 4:
-                try:
-                    current_verts.append((float(parts[1]), float(parts[2]), float(parts[3])))
-                except ValueError:
-                    pass
-        elif line.startswith("endfacet") or line.startswith("endloop"):
-            if len(current_verts) == 3:
-                triangles.append(tuple(current_verts))
-                current_verts = []
-    return triangles
-
-
 def _parse_binary_stl(data: bytes) -> list[tuple]:
     """
     Parsa STL binario.
@@ -76,26 +93,49 @@ def _parse_binary_stl(data: bytes) -> list[tuple]:
     return triangles
 
 
+def _binary_array(data: bytes):
+    """STL binario → array (N,3,3) float32 letto direttamente dal buffer."""
+    if len(data) < 84:
+        return np.empty((0, 3, 3), np.float32)
+    n_triangles = struct.unpack_from("<I", data, 80)[0]
+    if 84 + n_triangles * 50 > len(data) + 1024:
+        return np.empty((0, 3, 3), np.float32)
+    n = min(n_triangles, (len(data) - 84) // 50)
+    records = np.frombuffer(data, dtype=np.dtype(_STL_RECORD), count=n, offset=84)
+    return np.ascontiguousarray(records["vertices"])
+
+
 def load_stl(path: Path) -> tuple[list, str]:
     """
     Carica un file STL (ASCII o binario).
-    Ritorna (triangoli, formato) dove formato è "ascii" o "binary".
+    Ritorna (triangoli, formato) dove formato è "ascii" o "binary";
+    con NumPy i triangoli sono un array (N,3,3) float32 (per i binari una
+    vista sulla mmap del file, senza copia; gli ASCII letti a blocchi).
     """
-    data = path.read_bytes()
-
-    # Rileva ASCII: inizia con "solid" e contiene "vertex"
-    try:
-        header = data[:256].decode("ascii", errors="replace")
-        if header.lstrip().startswith("solid") and b"vertex" in data:
-            content = data.decode("ascii", errors="replace")
-            tris = _parse_ascii_stl(content)
-            if tris:
+    if stl_io.binary_triangle_count(path) is not None:
+        if _HAS_NUMPY:
+            with stl_io.BinarySTL(path) as stl:
+                return stl.vertices(), "binary"
+        return list(stl_io.iter_binary(path)), "binary"
+
+    # Rileva ASCII: inizia con "solid" e contiene triangoli "vertex"
+    with open(path, "rb") as f:
+        header = f.read(256).decode("ascii", errors="replace")
+    if header.lstrip().startswith("solid"):
+        try:
+            if _HAS_NUMPY:
+                chunks = [c.astype(np.float32) for c in stl_io.iter_ascii_chunks(path)]
+                tris = np.concatenate(chunks) if chunks else []
+            else:
+                tris = list(stl_io.iter_ascii(path))
+            if len(tris):
                 return tris, "ascii"
-    except Exception:
-        pass
+        except Exception:
+            pass
 
-    # Binario (anche se il file inizia con "solid" — alcuni file binari lo fanno)
-    tris = _parse_binary_stl(data)
+    # Binario con dimensione non esatta (padding, file troncati)
+    data = path.read_bytes()
+    tris = _binary_array(data) if _HAS_NUMPY else _parse_binary_stl(data)
     return tris, "binary"
 
 
@@ -103,10 +143,28 @@ def load_stl(path: Path) -> tuple[list, str]:
 # Geometria
 # ---------------------------------------------------------------------------
 
+def _is_array(triangles) -> bool:
+    return _HAS_NUMPY and isinstance(triangles, np.ndarray)
+
+
+def _bounding_box_dict(lo, hi) -> dict:
+    return {
+        "min_x": round(lo[0], 4), "max_x": round(hi[0], 4),
+        "min_y": round(lo[1], 4), "max_y": round(hi[1], 4),
+        "min_z": round(lo[2], 4), "max_z": round(hi[2], 4),
+        "size_x": round(hi[0] - lo[0], 4),
+        "size_y": round(hi[1] - lo[1], 4),
+        "size_z": round(hi[2] - lo[2], 4),
+    }
+
+
 def compute_bounding_box(triangles: list) -> dict | None:
     """Calcola bounding box da tutti i vertici."""
-    if not triangles:
+    if not len(triangles):
         return None
+    if _is_array(triangles):
+        flat = triangles.reshape(-1, 3)
+        return _bounding_box_dict(flat.min(axis=0).astype(float), flat.max(axis=0).astype(float))
     xs, ys, zs = [], [], []
     for tri in triangles:
         for v in tri:
@@ -133,6 +191,9 @@ def check_manifold(triangles: list) -> dict:
 
     Usa arrotondamento a 6 decimali per gestire errori floating-point.
     """
+    if _is_array(triangles):
+        return _check_manifold_array(triangles)
+
     edge_count: dict[tuple, int] = defaultdict(int)
 
     for tri in triangles:
@@ -160,12 +221,20 @@ def check_manifold(triangles: list) -> dict:
     }
 
 
+def _check_manifold_array(triangles) -> dict:
+    """check_manifold vettorizzato (stl_io.manifold_counts: vertici quantizzati, edge come chiavi intere)."""
+    return stl_io.manifold_counts(triangles)
+
+
 def compute_volume(triangles: list) -> float:
     """
     Calcola il volume del mesh usando il teorema della divergenza
     (somma dei volumi dei tetraedri firmati origine-triangolo).
     Funziona correttamente solo per mesh chiusi (manifold).
     """
+    if _is_array(triangles):
+        v = triangles.astype(np.float64)
+        return abs(float(np.einsum("ij,ij->", v[:, 0], np.cross(v[:, 1], v[:, 2]))) / 6.0)
     vol = 0.0
     for tri in triangles:
         v0, v1, v2 = tri
@@ -178,6 +247,20 @@ def compute_volume(triangles: list) -> float:
     return abs(vol)
 
 
+def compute_area(triangles: list) -> float:
+    """Area della superficie: somma di |(v1 - v0) × (v2 - v0)| / 2."""
+    if _is_array(triangles):
+        v = triangles.astype(np.float64)
+        return float(np.linalg.norm(np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0]), axis=1).sum()) / 2.0
+    area = 0.0
+    for v0, v1, v2 in triangles:
+        ax, ay, az = v1[0] - v0[0], v1[1] - v0[1], v1[2] - v0[2]
+        bx, by, bz = v2[0] - v0[0], v2[1] - v0[1], v2[2] - v0[2]
+        cx, cy, cz = ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx
+        area += (cx * cx + cy * cy + cz * cz) ** 0.5 / 2.0
+    return area
+
+
 def estimate_print_time(volume_mm3: float, infill_pct: int = 20) -> dict:
     """
     Stima approssimativa del tempo di stampa FDM.
@@ -212,15 +295,41 @@ def estimate_print_time(volume_mm3: float, infill_pct: int = 20) -> dict:
 # Report
 # ---------------------------------------------------------------------------
 
-def analyze_file(stl_path: Path, infill_pct: int) -> dict:
-    """Esegue tutti i check su un file STL e ritorna un dict con tutti i risultati."""
+def _report_from_meta(stl_path: Path, meta: dict, infill_pct: int) -> dict:
+    """Report dalle metriche del sidecar .meta.json scritto dal worker (nessun parsing della mesh)."""
+    has_tris = meta["triangles"] > 0
+    return {
+        "file":          str(stl_path),
+        "format":        meta["format"],
+        "size_bytes":    meta["size_bytes"],
+        "size_kb":       round(meta["size_bytes"] / 1024, 2),
+        "triangles":     meta["triangles"],
+        "bounding_box":  _bounding_box_dict(meta["min"], meta["max"]) if has_tris else None,
+        "manifold":      meta["manifold"] if has_tris else None,
+        "volume_mm3":    round(meta["volume_mm3"], 2),
+        "area_mm2":      round(meta["area_mm2"], 2),
+        "print_estimate": estimate_print_time(meta["volume_mm3"], infill_pct) if has_tris else None,
+    }
+
+
+def analyze_file(stl_path: Path, infill_pct: int, use_meta: bool = True) -> dict:
+    """
+    Esegue tutti i check su un file STL e ritorna un dict con tutti i risultati.
+    use_meta: se il sidecar .meta.json è aggiornato si usano le sue metriche.
+    """
+    meta = stl_io.read_meta(stl_path) if use_meta else None
+    if meta:
+        return _report_from_meta(stl_path, meta, infill_pct)
+
     stat = stl_path.stat()
     triangles, fmt = load_stl(stl_path)
 
+    has_tris     = len(triangles) > 0
     bb           = compute_bounding_box(triangles)
-    manifold     = check_manifold(triangles) if triangles else None
-    volume_mm3   = compute_volume(triangles) if triangles else 0.0
-    print_est    = estimate_print_time(volume_mm3, infill_pct) if triangles else None
+    manifold     = check_manifold(triangles) if has_tris else None
+    volume_mm3   = compute_volume(triangles) if has_tris else 0.0
+    area_mm2     = compute_area(triangles) if has_tris else 0.0
+    print_est    = estimate_print_time(volume_mm3, infill_pct) if has_tris else None
 
     return {
         "file":          str(stl_path),
@@ -231,6 +340,7 @@ def analyze_file(stl_path: Path, infill_pct: int) -> dict:
         "bounding_box":  bb,
         "manifold":      manifold,
         "volume_mm3":    round(volume_mm3, 2),
+        "area_mm2":      round(area_mm2, 2),
         "print_estimate": print_est,
     }
 
@@ -282,6 +392,8 @@ def print_report(result: dict, verbose: bool = True):
     if pe:
         print(f"\n  {sep}")
         print(f"  Volume mesh: {result['volume_mm3']:,.1f} mm³  ({pe['volume_cm3']:.2f} cm³)")
+        if "area_mm2" in result:
+            print(f"  Superficie:  {result['area_mm2']:,.1f} mm²")
         print(f"\n  Stima stampa (infill {pe['infill_pct']}%, PLA, 50 mm/s):")
         print(f"    Tempo stimato:  {pe['estimated_human']}  (~{pe['estimated_minutes']:.0f} min)")
         print(f"    {pe['note']}")
@@ -289,6 +401,57 @@ def print_report(result: dict, verbose: bool = True):
     print(f"{'═'*58}")
 
 
+# ---------------------------------------------------------------------------
+# Analisi multipla
+# ---------------------------------------------------------------------------
+
+def _analyze_safe(stl_file: str, infill_pct: int, use_meta: bool = True) -> tuple[dict | None, str | None]:
+    """analyze_file per il process pool: (risultato, None) oppure (None, errore)."""
+    try:
+        return analyze_file(Path(stl_file), infill_pct, use_meta), None
+    except Exception as e:
+        return None, str(e)
+
+
+def iter_analyses(paths: list, infill_pct: int, jobs: int = 1, use_meta: bool = True):
+    """
+    Analizza più file e ritorna (path, risultato, errore) in ordine di
+    completamento. jobs > 1: process pool (un processo per core, ogni
+    file analizzato per intero in un processo).
+    """
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield (path, *_analyze_safe(str(path), infill_pct, use_meta))
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_analyze_safe, str(path), infill_pct, use_meta): path for path in paths}
+        for future in as_completed(futures):
+            yield (futures[future], *future.result())
+
+
+def _file_key(stl_path: Path) -> dict:
+    st = stl_path.stat()
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def load_manifest(path: Path = MANIFEST_FILE) -> dict:
+    """{file: {"size", "mtime", "is_manifold"}} dell'ultima analisi, vuoto se la versione è diversa."""
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != ANALYZER_VERSION:
+        return {}
+    return data.get("files", {})
+
+
+def save_manifest(files: dict, path: Path = MANIFEST_FILE):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"version": ANALYZER_VERSION, "files": files}, indent=1))
+    os.replace(tmp, path)
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
@@ -305,10 +468,23 @@ def main():
                         help="Percentuale infill per la stima di stampa (default: 20)")
     parser.add_argument("--json", action="store_true",
                         help="Output JSON (per uso programmatico)")
+    parser.add_argument("--ndjson", action="store_true",
+                        help="Un oggetto JSON per riga, stampato appena l'analisi finisce")
+    parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                        help="Processi in parallelo (0 = tutti i core; default: 1)")
+    parser.add_argument("--changed-only", action="store_true",
+                        help="Salta i file con dimensione e mtime uguali all'ultima analisi")
+    parser.add_argument("--recompute", action="store_true",
+                        help="Ignora i sidecar .meta.json del worker e riparsa le mesh")
+    parser.add_argument("--manifest", type=Path, default=MANIFEST_FILE,
+                        help=f"Manifest per --changed-only (default: {MANIFEST_FILE})")
     args = parser.parse_args()
 
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
     results = []
     exit_code = 0
+    manifest = load_manifest(args.manifest) if args.changed_only else {}
+    paths, skipped = [], 0
 
     for stl_arg in args.stl_files:
         stl_path = Path(stl_arg).expanduser()
@@ -320,29 +496,53 @@ def main():
         if not stl_path.suffix.lower() == ".stl":
             print(f"[WARN] Estensione non .stl: {stl_path.name}", file=sys.stderr)
 
-        try:
-            result = analyze_file(stl_path, args.infill)
-        except Exception as e:
-            print(f"[ERRORE] Analisi fallita per {stl_path.name}: {e}", file=sys.stderr)
-            exit_code = 1
+        previous = manifest.get(str(stl_path.resolve())) if args.changed_only else None
+        key = _file_key(stl_path)
+        if previous and (previous.get("size"), previous.get("mtime")) == (key["size"], key["mtime"]):
+            skipped += 1
+            if previous.get("is_manifold") is False:
+                exit_code = max(exit_code, 1)
             continue
+        paths.append(stl_path)
 
-        results.append(result)
-
-        # Segnala mesh non-manifold come warning (exit code 1 ma continua)
-        m = result.get("manifold", {})
-        if m and not m.get("is_manifold"):
-            exit_code = max(exit_code, 1)
+    if skipped:
+        print(f"[INFO] {skipped} file invariati dall'ultima analisi — saltati", file=sys.stderr)
 
-    if not results:
-        sys.exit(exit_code)
-
-    if args.json:
+    try:
+        for stl_path, result, error in iter_analyses(paths, args.infill, jobs, not args.recompute):
+            if error is not None:
+                print(f"[ERRORE] Analisi fallita per {stl_path.name}: {error}", file=sys.stderr)
+                exit_code = 1
+                continue
+
+            # Segnala mesh non-manifold come warning (exit code 1 ma continua)
+            m = result.get("manifold", {})
+            if args.changed_only:
+                manifest[str(stl_path.resolve())] = {
+                    **_file_key(stl_path),
+                    "is_manifold": m.get("is_manifold") if m else None,
+                }
+            if m and not m.get("is_manifold"):
+                exit_code = max(exit_code, 1)
+
+            # Output in streaming: niente accumulo dei risultati
+            if args.ndjson:
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+            elif args.json:
+                results.append(result)
+            else:
+                print_report(result)
+                sys.stdout.flush()
+    finally:
+        if args.changed_only:
+            save_manifest(manifest, args.manifest)
+
+    if args.json and results:
+        # Ordine degli argomenti, indipendente dal completamento
+        order = {str(p): i for i, p in enumerate(paths)}
+        results.sort(key=lambda r: order.get(r["file"], 0))
         out = results[0] if len(results) == 1 else results
         print(json.dumps(out, indent=2, ensure_ascii=False))
-    else:
-        for result in results:
-            print_report(result)
 
     sys.exit(exit_code)
 
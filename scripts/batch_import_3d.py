@@ -102,7 +102,7 @@ def load_all_tasks(source_dir: Path, single_file: Path | None = None) -> list[di
 # Validation
 # ---------------------------------------------------------------------------
 
-VALID_TYPES = {"generate_3d", "compile_scad", "validate_scad", "bash", "python", "file", "prompt"}
+VALID_TYPES = {"generate_3d", "compile_scad", "validate_scad", "generate_variants", "bash", "python", "file", "prompt"}
 VALID_QUALITY = {"fast", "medium", "high"}
 VALID_OBJ_TYPE = {"simple", "mechanical", "decorative"}
 
@@ -125,6 +125,11 @@ def validate_task(task: dict, idx: int) -> list[str]:
         ot = task.get("object_type", "simple")
         if ot not in VALID_OBJ_TYPE:
             issues.append(f"object_type '{ot}' non valido (validi: {VALID_OBJ_TYPE})")
+    if task.get("type") == "generate_variants":
+        if not task.get("scad_file") and not task.get("source_task"):
+            issues.append("'scad_file' o 'source_task' mancante per task generate_variants")
+        if not task.get("variants") and not task.get("grid"):
+            issues.append("'variants' o 'grid' mancante per task generate_variants")
     return issues
 
 
@@ -28,6 +28,12 @@ try:
 except ImportError:
     HAS_REQUESTS = False
 
+# Moduli condivisi con il worker (root del progetto)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import results_store
+if HAS_REQUESTS:
+    import ollama_client
+
 # ---------------------------------------------------------------------------
 # Paths & Config
 # ---------------------------------------------------------------------------
@@ -133,11 +139,7 @@ def check_ollama(cfg: dict) -> list[CheckResult]:
         return results
 
     try:
-        r = requests.get(f"{url}/api/tags", timeout=6)
-        r.raise_for_status()
-        data = r.json()
-        models = data.get("models", [])
-        model_names = [m.get("name", "") for m in models]
+        model_names = ollama_client.client_for(cfg).tags(read_timeout=6)
         results.append(CheckResult("Ollama server", "OK", f"raggiungibile su {url}"))
     except requests.exceptions.ConnectionError:
         results.append(CheckResult("Ollama server", "FAIL",
@@ -299,25 +301,18 @@ def check_systemd_service(name: str) -> CheckResult:
 
 def check_last_task() -> CheckResult:
     """Trova l'ultimo task generate_3d eseguito e il suo esito."""
-    if not RESULTS_DIR.exists():
-        return CheckResult("Ultimo task", "INFO", "nessun result trovato")
-
-    result_files = sorted(RESULTS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
-    if not result_files:
+    try:
+        recent = results_store.latest(limit=1)
+    except Exception as e:
+        return CheckResult("Ultimo task", "WARN", f"archivio result non leggibile: {e}")
+    if not recent:
         return CheckResult("Ultimo task", "INFO", "nessun result trovato")
 
-    # Cerca l'ultimo generate_3d
-    for rfile in result_files[:30]:
-        try:
-            data = json.loads(rfile.read_text())
-        except Exception:
-            continue
-
-        task_type = data.get("type", data.get("task", {}).get("type", ""))
-        if task_type != "generate_3d" and "stl_file" not in data:
-            continue
-
-        task_id  = data.get("task_id", rfile.stem)
+    # Cerca l'ultimo generate_3d (indice type / stl_file)
+    last3d = results_store.latest(limit=1, task_type="generate_3d") or \
+        results_store.latest(limit=1, with_stl=True)
+    for data in last3d:
+        task_id  = data.get("task_id", data.get("_name", ""))
         success  = data.get("success", False)
         finished = data.get("finished_at", "")
         stl      = data.get("stl_file", "")
@@ -342,19 +337,16 @@ def check_last_task() -> CheckResult:
         if success:
             return CheckResult("Ultimo task 3D", "OK", detail)
         else:
-            err = data.get("error_message", data.get("error", ""))[:60]
+            err = (data.get("error_message") or data.get("error") or "")[:60]
             return CheckResult("Ultimo task 3D", "WARN",
                                detail + (f"\n       Errore: {err}" if err else ""))
 
     # Nessun generate_3d, mostra l'ultimo qualsiasi
-    try:
-        data = json.loads(result_files[0].read_text())
-        tid  = data.get("task_id", result_files[0].stem)
-        suc  = "✓" if data.get("success") else "✗"
-        return CheckResult("Ultimo task (gen.)", "INFO",
-                           f"nessun generate_3d recente — ultimo: [{tid}] {suc}")
-    except Exception:
-        return CheckResult("Ultimo task", "INFO", "nessun generate_3d recente")
+    data = recent[0]
+    tid  = data.get("task_id", data.get("_name", ""))
+    suc  = "✓" if data.get("success") else "✗"
+    return CheckResult("Ultimo task (gen.)", "INFO",
+                       f"nessun generate_3d recente — ultimo: [{tid}] {suc}")
 
 
 def check_stl_count() -> CheckResult:
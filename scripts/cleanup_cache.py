@@ -5,7 +5,8 @@ cleanup_cache.py — Pulizia file vecchi PANDA 3D
 Elimina file temporanei e vecchi per liberare spazio su disco.
 
 Regole di pulizia:
-  ~/panda/cache/       → file più vecchi di 7 giorni
+  ~/panda/cache/       → file non usati da 7 giorni (il worker aggiorna l'mtime a ogni hit)
+  ~/panda/cache/responses/ → risposte LLM (bash/python/file/prompt) non usate da 7 giorni
   ~/panda/scripts/     → temp_*.py più vecchi di 1 giorno
   ~/panda/results/     → JSON più vecchi di 30 giorni
   ~/panda/logs/        → .log più vecchi di 30 giorni
@@ -33,6 +34,12 @@ RULES = [
         "pattern": "*.scad",
         "max_age_days": 7,
     },
+    {
+        "label":   "Risposte LLM in cache",
+        "dir":     PANDA_HOME / "cache" / "responses",
+        "pattern": "*.json",
+        "max_age_days": 7,
+    },
     {
         "label":   "Script temporanei",
         "dir":     PANDA_HOME / "scripts",
@@ -21,6 +21,10 @@ import zipfile
 from datetime import datetime, date
 from pathlib import Path
 
+# Moduli condivisi con il worker (root del progetto)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import results_store
+
 # ---------------------------------------------------------------------------
 # Paths
 # ---------------------------------------------------------------------------
@@ -51,21 +55,18 @@ def find_scad_for_stl(stl_path: Path) -> Path | None:
 
 
 def get_result_meta(stl_name: str) -> dict:
-    """Cerca nei results/ il task_id e la descrizione associati a questo STL."""
-    stem = Path(stl_name).stem
-    for rfile in RESULTS_DIR.glob("*.json"):
-        try:
-            data = json.loads(rfile.read_text(encoding="utf-8"))
-            stl = data.get("stl_file", "")
-            if stl and Path(stl).stem == stem:
-                return {
-                    "task_id":     data.get("task_id", ""),
-                    "description": data.get("description", ""),
-                    "generated":   data.get("finished_at", ""),
-                }
-        except Exception:
-            continue
-    return {}
+    """Cerca nell'archivio result il task_id e la descrizione associati a questo STL."""
+    try:
+        data = results_store.for_stl(Path(stl_name).stem + ".stl")
+    except Exception:
+        return {}
+    if not data:
+        return {}
+    return {
+        "task_id":     data.get("task_id", ""),
+        "description": data.get("description", ""),
+        "generated":   data.get("finished_at", ""),
+    }
 
 
 def write_manifest(stl_files: list[Path], include_scad: bool) -> str:
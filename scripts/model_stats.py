@@ -3,7 +3,7 @@
 PANDA 3D — Statistiche Modelli Generati
 ==========================================
 
-Analizza STL e result JSON per produrre statistiche complete:
+Analizza STL e archivio result (results_store) per produrre statistiche complete:
 - Numero totale modelli STL
 - Dimensione totale (MB)
 - Tasso di successo (STL generati vs task generate_3d tentati)
@@ -24,6 +24,10 @@ from collections import defaultdict
 from datetime import datetime, timedelta
 from pathlib import Path
 
+# Moduli condivisi con il worker (root del progetto)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import results_store
+
 # ---------------------------------------------------------------------------
 # Paths
 # ---------------------------------------------------------------------------
@@ -94,53 +98,36 @@ def collect_stl_info() -> list[dict]:
     return models
 
 
-def collect_results() -> tuple[list[dict], list[dict]]:
+def collect_results() -> tuple[list[dict], int]:
     """
-    Analizza i file in results/ e ritorna:
-      (generate_3d_results, all_results)
+    Interroga l'archivio results (results_store) e ritorna:
+      (generate_3d_results, numero_totale_result)
     """
-    all_results = []
     gen3d = []
 
-    if not RESULTS_DIR.exists():
-        return gen3d, all_results
-
-    for rfile in RESULTS_DIR.glob("*.json"):
-        try:
-            data = json.loads(rfile.read_text(encoding="utf-8"))
-        except Exception:
-            continue
+    for data in results_store.generate_3d_rows():
+        # Calcola durata
+        started  = parse_iso(data.get("started_at"))
+        finished = parse_iso(data.get("finished_at"))
+        duration = None
+        if started and finished:
+            duration = (finished - started).total_seconds()
+
+        gen3d.append({
+            "task_id":     data.get("task_id", ""),
+            "success":     bool(data.get("success")),
+            "stl_file":    data.get("stl_file"),
+            "file_size_kb": data.get("file_size_kb") or 0,
+            "description": data.get("description") or "",
+            "quality":     data.get("quality") or "",
+            "object_type": data.get("object_type") or "",
+            "error":       data.get("error_message") or "",
+            "duration_s":  duration,
+            "finished_at": finished,
+            "result_file": data.get("name"),
+        })
 
-        all_results.append(data)
-
-        # Identifica task generate_3d: campo type oppure stl_file presente
-        task_type = data.get("type", data.get("task", {}).get("type", ""))
-        if task_type == "generate_3d" or "stl_file" in data:
-            # Calcola durata
-            started  = parse_iso(data.get("started_at"))
-            finished = parse_iso(data.get("finished_at"))
-            duration = None
-            if started and finished:
-                duration = (finished - started).total_seconds()
-
-            gen3d.append({
-                "task_id":     data.get("task_id", ""),
-                "success":     data.get("success", False),
-                "stl_file":    data.get("stl_file"),
-                "file_size_kb": data.get("file_size_kb", 0),
-                "description": data.get("description",
-                               data.get("task", {}).get("description", "")),
-                "quality":     data.get("quality",
-                               data.get("task", {}).get("quality", "")),
-                "object_type": data.get("object_type",
-                               data.get("task", {}).get("object_type", "")),
-                "error":       data.get("error_message", ""),
-                "duration_s":  duration,
-                "finished_at": finished,
-                "result_file": rfile.name,
-            })
-
-    return gen3d, all_results
+    return gen3d, results_store.count()
 
 
 def match_results_to_stl(stl_list: list[dict], gen3d: list[dict]) -> list[dict]:
@@ -284,9 +271,9 @@ def print_stats(stats: dict, stl_list: list[dict], gen3d: list[dict], top_n: int
         print(f"  Falliti  : {stats['failed']}")
     else:
         print(f"\n▶ TASSO DI SUCCESSO")
-        print(f"  Nessun risultato generate_3d trovato nei result JSON")
+        print(f"  Nessun risultato generate_3d trovato nell'archivio result")
         if stats["total_stl"] > 0:
-            print(f"  (esistono {stats['total_stl']} STL ma senza result JSON corrispondente)")
+            print(f"  (esistono {stats['total_stl']} STL ma senza result corrispondente)")
 
     # ── Tempi di generazione ────────────────────────────────────────────
     if stats["avg_secs"] is not None:
@@ -6,7 +6,7 @@ PANDA 3D — Test & Validazione Prompt OpenSCAD
 Testa che l'LLM generi codice OpenSCAD valido per diversi tipi di oggetti.
 
 Per ogni test case:
-1. Invia il prompt a Ollama (via ask_ollama del worker)
+1. Invia il prompt a Ollama (client condiviso ollama_client, come il worker)
 2. Salva il codice in ~/panda/models/scad/test_{name}.scad
 3. Compila con openscad --export-format asciistl
 4. Verifica STL creato e size > 0
@@ -18,12 +18,13 @@ Output: ~/panda/results/prompt_test_{timestamp}.json
 import json
 import subprocess
 import sys
-import threading
 import time
 from datetime import datetime
 from pathlib import Path
 
-import requests
+# Moduli condivisi con il worker (root del progetto)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ollama_client
 
 # ---------------------------------------------------------------------------
 # Paths (identici al worker)
@@ -134,52 +135,45 @@ def _build_system_prompt(object_type: str) -> str:
         "Ultima riga del file: main_object(); "
         "NON usare include<> o use<>. Il file deve essere self-contained."
     )
-    parts = [p for p in [base, specific, structure_instruction] if p]
+    # Stesso ordine del worker: prefisso condiviso (base + struttura) in testa
+    parts = [p for p in [base, structure_instruction, specific] if p]
     return "\n\n".join(parts)
 
 
 def ask_ollama(prompt: str, config: dict, system_prompt: str | None = None) -> str | None:
-    """Identica al worker: chiama Ollama e restituisce la risposta testuale."""
-    start = time.time()
-    stop_evt = threading.Event()
+    """Come il worker: chiama Ollama (client condiviso) e restituisce la risposta testuale."""
+    def _ticker(elapsed):
+        print(f"  ⏳ Ollama elabora... ({int(elapsed//60)}m{int(elapsed%60):02d}s)", flush=True)
 
-    def _ticker():
-        while not stop_evt.wait(30):
-            elapsed = time.time() - start
-            print(f"  ⏳ Ollama elabora... ({int(elapsed//60)}m{int(elapsed%60):02d}s)", flush=True)
-
-    ticker = threading.Thread(target=_ticker, daemon=True)
-    ticker.start()
+    client = ollama_client.client_for(config)
     try:
-        if system_prompt:
-            r = requests.post(
-                f"{config['ollama_url']}/api/chat",
-                json={
-                    "model": config["model"],
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user",   "content": prompt},
-                    ],
-                    "stream": False,
-                },
-                timeout=3600,
-            )
-            r.raise_for_status()
-            return r.json().get("message", {}).get("content", "")
-        else:
-            r = requests.post(
-                f"{config['ollama_url']}/api/generate",
-                json={"model": config["model"], "prompt": prompt, "stream": False},
-                timeout=3600,
-            )
-            r.raise_for_status()
-            return r.json().get("response", "")
+        with ollama_client.progress(_ticker):
+            if system_prompt:
+                r = client.post(
+                    "/api/chat",
+                    json={
+                        "model": config["model"],
+                        "messages": [
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user",   "content": prompt},
+                        ],
+                        "stream": False,
+                    },
+                    read_timeout=3600,
+                )
+                r.raise_for_status()
+                return r.json().get("message", {}).get("content", "")
+            else:
+                r = client.post(
+                    "/api/generate",
+                    json={"model": config["model"], "prompt": prompt, "stream": False},
+                    read_timeout=3600,
+                )
+                r.raise_for_status()
+                return r.json().get("response", "")
     except Exception as e:
         print(f"  [ERROR] Ollama error: {e}")
         return None
-    finally:
-        stop_evt.set()
-        ticker.join(timeout=1)
 
 
 def clean_llm(code: str) -> str:
@@ -401,8 +395,7 @@ def main():
 
     # Verifica raggiungibilità Ollama prima di partire
     try:
-        r = requests.get(f"{config['ollama_url']}/api/tags", timeout=10)
-        r.raise_for_status()
+        ollama_client.client_for(config).tags(read_timeout=10)
         print(f"✓ Ollama raggiungibile")
     except Exception as e:
         print(f"✗ Ollama non raggiungibile: {e}")
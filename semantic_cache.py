@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+PANDA — Cache semantica delle generazioni
+==========================================
+
+Livello dietro la cache esatta del worker: la stessa richiesta scritta in
+modo diverso ("porta spezie a muro" / "portaspezie da parete") ha chiavi
+diverse ma embedding vicini. Le descrizioni vengono trasformate in vettori
+dal modello di embedding locale di Ollama (/api/embeddings) e salvate in
+una matrice NumPy normalizzata; la ricerca è un prodotto matrice·vettore.
+
+Su disco (cache/semantic/):
+  vectors.npy   matrice float32 N×D (righe a norma 1)
+  index.json    per ogni riga: chiave della cache esatta, contesto
+                (parametri/tipo/qualità), descrizione; + modello di embedding
+
+Le entry non contengono codice: puntano alla chiave della cache esatta,
+quindi un'entry il cui codice è stato scartato da lì viene ignorata.
+
+NumPy è opzionale: senza, il livello semantico resta disattivato.
+Contatori in status/semantic_cache_stats.json (dashboard /api/system).
+
+Uso da CLI:
+  python3 semantic_cache.py                   statistiche
+  python3 semantic_cache.py --clear           svuota l'indice
+"""
+
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+import ollama_client
+
+# =========================
+# PATHS
+# =========================
+
+PANDA_HOME = Path.home() / "panda"
+SEMANTIC_DIR = PANDA_HOME / "cache" / "semantic"
+STATS_FILE = PANDA_HOME / "status" / "semantic_cache_stats.json"
+
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+DEFAULT_MAX_ENTRIES = 5000
+EMBED_TIMEOUT = 30
+
+# =========================
+# EMBEDDING
+# =========================
+
+def embed(text, config):
+    """Vettore di embedding di `text` dal modello locale (lista di float) o None."""
+    model = config.get("embedding_model", DEFAULT_EMBED_MODEL)
+    r = ollama_client.client_for(config).post(
+        "/api/embeddings", json={"model": model, "prompt": text}, read_timeout=EMBED_TIMEOUT,
+    )
+    r.raise_for_status()
+    return r.json().get("embedding") or None
+
+# =========================
+# CACHE
+# =========================
+
+class SemanticCache:
+    def __init__(self, directory=SEMANTIC_DIR, stats_file=STATS_FILE):
+        self.dir = Path(directory)
+        self.stats_file = Path(stats_file)
+        self._lock = threading.Lock()
+        self._vectors = None        # np.ndarray N×D, caricata al primo uso
+        self._entries = None
+        self._model = None
+        self.counters = {"lookups": 0, "hits": 0, "seeds": 0, "misses": 0, "stores": 0, "embed_errors": 0}
+        self.since = datetime.now().isoformat()
+
+    @property
+    def available(self):
+        return _HAS_NUMPY
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries, self._vectors, self._model = [], None, None
+        try:
+            meta = json.loads((self.dir / "index.json").read_text())
+            vectors = np.load(self.dir / "vectors.npy")
+        except (OSError, ValueError):
+            return
+        if len(meta.get("entries", [])) == len(vectors):
+            self._entries, self._vectors, self._model = meta["entries"], vectors, meta.get("model")
+
+    def _save(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp_vec = self.dir / "vectors.tmp.npy"
+        np.save(tmp_vec, self._vectors)
+        tmp_idx = self.dir / "index.json.tmp"
+        tmp_idx.write_text(json.dumps({"model": self._model, "entries": self._entries}, ensure_ascii=False))
+        os.replace(tmp_vec, self.dir / "vectors.npy")
+        os.replace(tmp_idx, self.dir / "index.json")
+
+    def _vector(self, text, config):
+        try:
+            vec = embed(text, config)
+        except Exception:
+            vec = None
+        if not vec:
+            self.counters["embed_errors"] += 1
+            return None
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else None
+
+    def search(self, text, config, context=None, object_type=None):
+        """
+        Entry più simili a `text`, migliori prima: [(score, entry), ...].
+        context: solo entry con lo stesso contesto (parametri/qualità/tipo);
+        object_type: filtro più largo, per i "punti di partenza".
+        Ritorna None se l'embedding non è disponibile.
+        """
+        with self._lock:
+            self._load()
+            if not self._entries:
+                return []
+            model = config.get("embedding_model", DEFAULT_EMBED_MODEL)
+            if self._model != model:
+                return []
+            vectors, entries = self._vectors, list(self._entries)
+        vec = self._vector(text, config)
+        if vec is None:
+            return None
+        if vec.shape[0] != vectors.shape[1]:
+            return []
+        scores = vectors @ vec
+        order = np.argsort(-scores)
+        out = []
+        for i in order[:50]:
+            entry = entries[i]
+            if context is not None and entry["context"] != context:
+                continue
+            if object_type is not None and entry.get("object_type") != object_type:
+                continue
+            out.append((float(scores[i]), entry))
+        return out
+
+    def add(self, text, config, cache_key, context, object_type="", description=""):
+        """Registra una generazione riuscita (il codice resta nella cache esatta)."""
+        vec = self._vector(text, config)
+        if vec is None:
+            return False
+        model = config.get("embedding_model", DEFAULT_EMBED_MODEL)
+        max_entries = int(config.get("semantic_cache_max_entries", DEFAULT_MAX_ENTRIES))
+        with self._lock:
+            self._load()
+            if self._model != model or (self._vectors is not None and self._vectors.shape[1] != vec.shape[0]):
+                # Modello di embedding cambiato: i vettori vecchi non sono confrontabili
+                self._entries, self._vectors, self._model = [], None, model
+            keep = [i for i, e in enumerate(self._entries) if e["cache_key"] != cache_key]
+            entries = [self._entries[i] for i in keep]
+            vectors = self._vectors[keep] if self._vectors is not None and keep else np.empty((0, vec.shape[0]), np.float32)
+            entries.append({
+                "cache_key": cache_key,
+                "context": context,
+                "object_type": object_type,
+                "description": description or text,
+                "created_at": datetime.now().isoformat(),
+            })
+            vectors = np.vstack([vectors, vec[None, :]])
+            if len(entries) > max_entries:
+                entries, vectors = entries[-max_entries:], vectors[-max_entries:]
+            self._entries, self._vectors = entries, vectors
+            self._save()
+            self.counters["stores"] += 1
+            self._write_stats()
+        return True
+
+    def discard(self, cache_key):
+        """Rimuove le entry che puntano a una chiave non più in cache."""
+        with self._lock:
+            self._load()
+            keep = [i for i, e in enumerate(self._entries) if e["cache_key"] != cache_key]
+            if len(keep) == len(self._entries):
+                return
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep]
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries, self._vectors, self._model = [], None, None
+            for name in ("vectors.npy", "index.json"):
+                try:
+                    (self.dir / name).unlink()
+                except OSError:
+                    pass
+
+    def record(self, outcome):
+        """Aggiorna i contatori: outcome in "hits", "seeds", "misses"."""
+        with self._lock:
+            self.counters["lookups"] += 1
+            self.counters[outcome] += 1
+            self._write_stats()
+
+    def stats(self):
+        lookups = self.counters["lookups"]
+        return {
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else None,
+            "entries": len(self._entries or ()),
+            "model": self._model,
+            "since": self.since,
+            "updated_at": datetime.now().isoformat(),
+        }
+
+    def _write_stats(self):
+        try:
+            self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.stats_file.with_name(self.stats_file.name + ".tmp")
+            tmp.write_text(json.dumps(self.stats(), indent=2))
+            os.replace(tmp, self.stats_file)
+        except OSError:
+            pass
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — cache semantica")
+    parser.add_argument("--clear", action="store_true", help="Svuota l'indice semantico")
+    args = parser.parse_args()
+
+    if not _HAS_NUMPY:
+        print("numpy non installato: cache semantica disattivata (pip install numpy)")
+        return
+    cache = SemanticCache()
+    if args.clear:
+        cache.clear()
+        print("Indice semantico svuotato")
+        return
+    with cache._lock:
+        cache._load()
+    print(f"Entry: {len(cache._entries)}  modello: {cache._model or '-'}")
+    if STATS_FILE.exists():
+        st = json.loads(STATS_FILE.read_text())
+        print(f"Lookup: {st['lookups']}  hit: {st['hits']}  seed: {st['seeds']}  hit rate: {st['hit_rate']}")
+
+
+if __name__ == "__main__":
+    main()
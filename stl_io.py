@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+PANDA — Lettura file STL
+=========================
+
+Lettore STL binario su mmap: i record da 50 byte (normale, 3 vertici,
+attributo) sono esposti come array strutturato NumPy che punta
+direttamente alle pagine del file, senza copie. Aprire uno STL da
+centinaia di MB costa tempo e memoria costanti; le slice (`stl[a:b]`,
+`vertices(a, b)`) sono viste lazy e solo le pagine lette vengono caricate
+dal sistema operativo.
+
+Parser ASCII in streaming: il file è letto a blocchi di dimensione fissa,
+le righe `vertex` di ogni blocco diventano un array NumPy (k, 3, 3) e
+scan() tiene solo accumulatori (min/max, volume con segno): la memoria
+di picco non dipende dalla dimensione del file.
+
+Metriche per modello: dopo ogni compilazione il worker scrive accanto
+allo STL un sidecar `nome.meta.json` (dimensioni, volume, area, triangoli,
+manifold, formato, hash di sorgente e mesh). Worker, dashboard e
+analyze_stl.py leggono quello (read_meta) invece di riparsare la mesh;
+un sidecar con size/mtime diversi dallo STL è ignorato.
+
+Usato da worker (bounding box), dashboard (/api/models/<f>/dimensions),
+scripts/analyze_stl.py e model_index.
+
+NumPy è opzionale: senza, iter_binary()/iter_ascii() leggono i triangoli
+in streaming come tuple (memoria costante, più lento).
+
+Uso da CLI:
+  python3 stl_io.py file.stl                 formato, triangoli, bounding box, volume
+  python3 stl_io.py file.stl --write-meta    scrive file.meta.json
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+HEADER_SIZE = 84
+RECORD_SIZE = 50
+CHUNK_TRIANGLES = 1 << 20
+ASCII_BUFFER = 1 << 20
+
+_VERTEX_RE = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+# Da incrementare quando cambiano i campi del sidecar .meta.json
+META_VERSION = 1
+
+if _HAS_NUMPY:
+    RECORD_DTYPE = np.dtype([
+        ("normal", "<f4", (3,)),
+        ("v0", "<f4", (3,)),
+        ("v1", "<f4", (3,)),
+        ("v2", "<f4", (3,)),
+        ("attr", "<u2"),
+    ])
+    # Stessi record visti come un unico campo (3, 3): vertici senza copia
+    _VERTICES_DTYPE = np.dtype({"names": ["vertices"], "formats": [("<f4", (3, 3))],
+                                "offsets": [12], "itemsize": RECORD_SIZE})
+
+# =========================
+# FORMATO
+# =========================
+
+def binary_triangle_count(path):
+    """
+    Numero di triangoli se il file è uno STL binario (dimensione = 84 + 50·n),
+    altrimenti None. Anche i binari che iniziano con "solid" sono riconosciuti.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(HEADER_SIZE)
+            size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return None
+    if len(head) < HEADER_SIZE:
+        return None
+    n = struct.unpack_from("<I", head, 80)[0]
+    return n if HEADER_SIZE + n * RECORD_SIZE == size else None
+
+# =========================
+# BINARIO
+# =========================
+
+class BinarySTL:
+    """
+    STL binario mappato in memoria (richiede NumPy).
+
+        with BinarySTL(path) as stl:
+            len(stl)                 numero di triangoli
+            stl.records              array strutturato (normal, v0, v1, v2, attr), vista sul file
+            stl[1000:2000]           slice lazy dei record
+            stl.vertices(0, 10)      vista (k, 3, 3) float32 dei vertici
+            stl.bounding_box()       ((min x, y, z), (max x, y, z)) a blocchi
+
+    Le viste restano valide finché esistono, anche dopo close().
+    """
+
+    def __init__(self, path):
+        if not _HAS_NUMPY:
+            raise RuntimeError("numpy non installato: usare iter_binary()")
+        self.path = Path(path)
+        n = binary_triangle_count(self.path)
+        if n is None:
+            raise ValueError(f"{self.path.name}: non è uno STL binario")
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if n else None
+        if self._mmap is None:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+            self._vertices = np.empty((0, 3, 3), np.float32)
+        else:
+            # frombuffer tiene un riferimento esportato alla mmap: finché
+            # esiste una vista, close() non può invalidare la memoria
+            self.records = np.frombuffer(self._mmap, dtype=RECORD_DTYPE, count=n, offset=HEADER_SIZE)
+            self._vertices = np.frombuffer(self._mmap, dtype=_VERTICES_DTYPE, count=n,
+                                           offset=HEADER_SIZE)["vertices"]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def vertices(self, start=0, stop=None):
+        """Vista (k, 3, 3) float32 dei vertici dei triangoli [start, stop), senza copia."""
+        return self._vertices[start:stop]
+
+    def chunks(self, size=CHUNK_TRIANGLES):
+        """Viste (k, 3, 3) consecutive di al massimo `size` triangoli."""
+        for start in range(0, len(self), size):
+            yield self.vertices(start, start + size)
+
+    def bounding_box(self):
+        """((min x, y, z), (max x, y, z)) calcolato a blocchi, o None se vuoto."""
+        lo = hi = None
+        for chunk in self.chunks():
+            c_lo, c_hi = chunk.min(axis=(0, 1)), chunk.max(axis=(0, 1))
+            lo = c_lo if lo is None else np.minimum(lo, c_lo)
+            hi = c_hi if hi is None else np.maximum(hi, c_hi)
+        if lo is None:
+            return None
+        return tuple(float(v) for v in lo), tuple(float(v) for v in hi)
+
+    def close(self):
+        self.records = self._vertices = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Viste ancora in uso: la mappa si chiude quando vengono rilasciate
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_binary(path, start=0, stop=None):
+    """
+    Triangoli ((x,y,z) ×3) di uno STL binario in streaming dalla mmap,
+    senza NumPy. [start, stop) per scansioni parziali.
+    """
+    n = binary_triangle_count(path)
+    if not n:
+        return
+    start, stop, _ = slice(start, stop).indices(n)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for first in range(start, stop, 4096):
+            last = min(stop, first + 4096)
+            view = mm[HEADER_SIZE + first * RECORD_SIZE:HEADER_SIZE + last * RECORD_SIZE]
+            for rec in struct.iter_unpack("<12fH", view):
+                yield rec[3:6], rec[6:9], rec[9:12]
+
+
+def binary_bounding_box(path):
+    """((min), (max)) di uno STL binario, con NumPy se disponibile; None se vuoto o non binario."""
+    if binary_triangle_count(path) is None:
+        return None
+    if _HAS_NUMPY:
+        with BinarySTL(path) as stl:
+            return stl.bounding_box()
+    lo, hi = [float("inf")] * 3, [float("-inf")] * 3
+    empty = True
+    for tri in iter_binary(path):
+        empty = False
+        for v in tri:
+            for i in range(3):
+                if v[i] < lo[i]:
+                    lo[i] = v[i]
+                if v[i] > hi[i]:
+                    hi[i] = v[i]
+    return None if empty else (tuple(lo), tuple(hi))
+
+# =========================
+# ASCII
+# =========================
+
+def _parse_vertices(coords):
+    """[(b"x", b"y", b"z"), ...] → array (k, 3) float64; le righe non numeriche sono saltate."""
+    try:
+        return np.array([float(v) for xyz in coords for v in xyz], dtype=np.float64).reshape(-1, 3)
+    except ValueError:
+        good = []
+        for xyz in coords:
+            try:
+                good.append([float(v) for v in xyz])
+            except ValueError:
+                continue
+        return np.array(good, dtype=np.float64).reshape(-1, 3)
+
+
+def iter_ascii_chunks(path, buffer_size=ASCII_BUFFER):
+    """
+    Triangoli di uno STL ASCII a blocchi: array (k, 3, 3) float64, uno per
+    buffer letto (richiede NumPy). Le righe spezzate tra due buffer e i
+    vertici di un triangolo a cavallo vengono riportati al blocco seguente.
+    """
+    tail = b""
+    carry = np.empty((0, 3), np.float64)
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(buffer_size)
+            data = tail + block
+            if block:
+                cut = data.rfind(b"\n") + 1
+                data, tail = data[:cut], data[cut:]
+            coords = _VERTEX_RE.findall(data)
+            if coords:
+                verts = _parse_vertices(coords)
+                if len(carry):
+                    verts = np.concatenate([carry, verts])
+                whole = len(verts) // 3 * 3
+                carry = verts[whole:]
+                if whole:
+                    yield verts[:whole].reshape(-1, 3, 3)
+            if not block:
+                return
+
+
+def iter_ascii(path):
+    """Triangoli ((x,y,z) ×3) di uno STL ASCII in streaming riga per riga, senza NumPy."""
+    verts = []
+    with open(path, "rb") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 4 and parts[0] == b"vertex":
+                try:
+                    verts.append((float(parts[1]), float(parts[2]), float(parts[3])))
+                except ValueError:
+                    continue
+                if len(verts) == 3:
+                    yield tuple(verts)
+                    verts = []
+
+# =========================
+# SCANSIONE
+# =========================
+
+def iter_chunks(path):
+    """Triangoli di uno STL (binario o ASCII) a blocchi (k, 3, 3), richiede NumPy."""
+    if binary_triangle_count(path) is not None:
+        with BinarySTL(path) as stl:
+            yield from stl.chunks()
+    else:
+        yield from iter_ascii_chunks(path)
+
+
+def iter_triangles(path):
+    """Triangoli ((x,y,z) ×3) di uno STL binario o ASCII, in streaming."""
+    if binary_triangle_count(path) is not None:
+        return iter_binary(path)
+    return iter_ascii(path)
+
+
+def scan(path):
+    """
+    Una passata in streaming con soli accumulatori: {"triangles", "min",
+    "max", "volume"} (volume con il teorema della divergenza, in valore
+    assoluto: corretto solo per mesh chiuse). min/max None se non ci sono
+    triangoli.
+    """
+    count, volume = 0, 0.0
+    if _HAS_NUMPY:
+        lo = hi = None
+        for chunk in iter_chunks(path):
+            if not len(chunk):
+                continue
+            v = chunk.astype(np.float64, copy=False)
+            count += len(v)
+            volume += float(np.einsum("ij,ij->", v[:, 0], np.cross(v[:, 1], v[:, 2])))
+            c_lo, c_hi = v.min(axis=(0, 1)), v.max(axis=(0, 1))
+            lo = c_lo if lo is None else np.minimum(lo, c_lo)
+            hi = c_hi if hi is None else np.maximum(hi, c_hi)
+        if lo is not None:
+            lo, hi = tuple(float(x) for x in lo), tuple(float(x) for x in hi)
+    else:
+        lo, hi = [math.inf] * 3, [-math.inf] * 3
+        for v0, v1, v2 in iter_triangles(path):
+            count += 1
+            volume += (
+                v0[0] * (v1[1] * v2[2] - v1[2] * v2[1])
+                + v1[0] * (v2[1] * v0[2] - v2[2] * v0[1])
+                + v2[0] * (v0[1] * v1[2] - v0[2] * v1[1])
+            )
+            for v in (v0, v1, v2):
+                for i in range(3):
+                    if v[i] < lo[i]:
+                        lo[i] = v[i]
+                    if v[i] > hi[i]:
+                        hi[i] = v[i]
+        lo, hi = (tuple(lo), tuple(hi)) if count else (None, None)
+    return {"triangles": count, "min": lo, "max": hi, "volume": abs(volume) / 6.0}
+
+
+def bounding_box(path):
+    """((min x, y, z), (max x, y, z)) di uno STL binario o ASCII, o None se vuoto."""
+    if binary_triangle_count(path) is not None:
+        return binary_bounding_box(path)
+    res = scan(path)
+    return (res["min"], res["max"]) if res["triangles"] else None
+
+# =========================
+# MANIFOLD
+# =========================
+
+def _manifold_result(open_edges, non_manifold_edges, total_edges):
+    return {
+        "is_manifold": open_edges == 0 and non_manifold_edges == 0,
+        "open_edges": open_edges,
+        "non_manifold_edges": non_manifold_edges,
+        "total_edges": total_edges,
+    }
+
+
+def _quantize(triangles):
+    """Vertici (N·3, 3) arrotondati a 1e-6 mm come interi: confronto esatto tra vertici."""
+    return np.rint(triangles.reshape(-1, 3).astype(np.float64) * 1e6).astype(np.int64)
+
+
+def _manifold_quantized(quantized):
+    """
+    Conteggio facce per edge sui vertici quantizzati: id univoci da un
+    ordinamento lessicografico (np.lexsort, più veloce di np.unique(axis=0)),
+    ogni edge come chiave intera (id minore, id maggiore), np.unique.
+    """
+    if not len(quantized):
+        return _manifold_result(0, 0, 0)
+    order = np.lexsort((quantized[:, 2], quantized[:, 1], quantized[:, 0]))
+    ordered = quantized[order]
+    first = np.empty(len(ordered), dtype=bool)
+    first[0] = True
+    first[1:] = np.any(ordered[1:] != ordered[:-1], axis=1)
+    del ordered
+    vertex_ids = np.empty(len(order), dtype=np.int64)
+    vertex_ids[order] = np.cumsum(first) - 1
+    ids = vertex_ids.reshape(-1, 3)
+    n_vertices = int(ids.max()) + 1
+    a, b = ids, np.roll(ids, -1, axis=1)
+    edge_keys = (np.minimum(a, b) * n_vertices + np.maximum(a, b)).ravel()
+    _, counts = np.unique(edge_keys, return_counts=True)
+    return _manifold_result(
+        int(np.count_nonzero(counts == 1)), int(np.count_nonzero(counts > 2)), int(len(counts)),
+    )
+
+
+def manifold_counts(triangles):
+    """
+    Verifica manifold di un array (N, 3, 3): ogni edge deve essere condiviso
+    da esattamente 2 triangoli. {"is_manifold", "open_edges" (1 faccia),
+    "non_manifold_edges" (3+ facce), "total_edges"}.
+    """
+    return _manifold_quantized(_quantize(triangles))
+
+# =========================
+# METRICHE E SIDECAR
+# =========================
+
+def mesh_metrics(path):
+    """
+    Metriche complete di uno STL in una passata: formato, triangoli,
+    min/max, volume, area, manifold. Con NumPy i blocchi della lettura in
+    streaming vengono ridotti subito; per il manifold restano in memoria
+    solo i vertici quantizzati.
+    """
+    fmt = "binary" if binary_triangle_count(path) is not None else "ascii"
+    count, volume, area = 0, 0.0, 0.0
+    if _HAS_NUMPY:
+        lo = hi = None
+        quantized = []
+        for chunk in iter_chunks(path):
+            if not len(chunk):
+                continue
+            v = chunk.astype(np.float64, copy=False)
+            count += len(v)
+            volume += float(np.einsum("ij,ij->", v[:, 0], np.cross(v[:, 1], v[:, 2])))
+            area += float(np.linalg.norm(np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0]), axis=1).sum())
+            c_lo, c_hi = v.min(axis=(0, 1)), v.max(axis=(0, 1))
+            lo = c_lo if lo is None else np.minimum(lo, c_lo)
+            hi = c_hi if hi is None else np.maximum(hi, c_hi)
+            quantized.append(_quantize(v))
+        manifold = _manifold_quantized(np.concatenate(quantized)) if quantized else _manifold_result(0, 0, 0)
+        if lo is not None:
+            lo, hi = [float(x) for x in lo], [float(x) for x in hi]
+    else:
+        lo, hi = [math.inf] * 3, [-math.inf] * 3
+        edges = defaultdict(int)
+        for v0, v1, v2 in iter_triangles(path):
+            count += 1
+            volume += (
+                v0[0] * (v1[1] * v2[2] - v1[2] * v2[1])
+                + v1[0] * (v2[1] * v0[2] - v2[2] * v0[1])
+                + v2[0] * (v0[1] * v1[2] - v0[2] * v1[1])
+            )
+            ax, ay, az = v1[0] - v0[0], v1[1] - v0[1], v1[2] - v0[2]
+            bx, by, bz = v2[0] - v0[0], v2[1] - v0[1], v2[2] - v0[2]
+            cx, cy, cz = ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx
+            area += (cx * cx + cy * cy + cz * cz) ** 0.5
+            pts = [(round(v[0], 6), round(v[1], 6), round(v[2], 6)) for v in (v0, v1, v2)]
+            for i in range(3):
+                a, b = pts[i], pts[(i + 1) % 3]
+                edges[(min(a, b), max(a, b))] += 1
+            for v in (v0, v1, v2):
+                for i in range(3):
+                    if v[i] < lo[i]:
+                        lo[i] = v[i]
+                    if v[i] > hi[i]:
+                        hi[i] = v[i]
+        manifold = _manifold_result(
+            sum(1 for c in edges.values() if c == 1), sum(1 for c in edges.values() if c > 2), len(edges),
+        )
+        lo, hi = (lo, hi) if count else (None, None)
+    return {
+        "format": fmt,
+        "triangles": count,
+        "min": lo,
+        "max": hi,
+        "volume_mm3": round(abs(volume) / 6.0, 3),
+        "area_mm2": round(area / 2.0, 3),
+        "manifold": manifold,
+    }
+
+
+def meta_path(stl_path):
+    """Sidecar delle metriche: models/stl/nome.stl → models/stl/nome.meta.json."""
+    stl_path = Path(stl_path)
+    return stl_path.with_name(stl_path.stem + ".meta.json")
+
+
+def write_meta(stl_path, source=None):
+    """
+    Calcola le metriche dello STL e le scrive nel sidecar (atomico).
+    source: provenienza (file SCAD, hash canonico, $fn, override -D, sha mesh).
+    """
+    stl_path = Path(stl_path)
+    st = stl_path.stat()
+    metrics = mesh_metrics(stl_path)
+    meta = {
+        "version": META_VERSION,
+        "stl_file": stl_path.name,
+        "size_bytes": st.st_size,
+        "mtime": st.st_mtime,
+        **metrics,
+        "dimensions": dimensions((metrics["min"], metrics["max"]) if metrics["triangles"] else None),
+        "source": source or {},
+        "created_at": datetime.now().isoformat(),
+    }
+    path = meta_path(stl_path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(meta, indent=1, ensure_ascii=False))
+    os.replace(tmp, path)
+    return meta
+
+
+def read_meta(stl_path):
+    """Sidecar dello STL se esiste ed è aggiornato (stessa versione, size e mtime), altrimenti None."""
+    stl_path = Path(stl_path)
+    try:
+        meta = json.loads(meta_path(stl_path).read_text())
+        st = stl_path.stat()
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != META_VERSION:
+        return None
+    if meta.get("size_bytes") != st.st_size or meta.get("mtime") != st.st_mtime:
+        return None
+    return meta
+
+# =========================
+# DIMENSIONI
+# =========================
+
+def dimensions(bbox):
+    """((min), (max)) → dict {x, y, z, min, max} in mm come nei result del worker."""
+    if bbox is None:
+        return None
+    lo, hi = bbox
+    return {
+        "x": round(hi[0] - lo[0], 3),
+        "y": round(hi[1] - lo[1], 3),
+        "z": round(hi[2] - lo[2], 3),
+        "min": {"x": round(lo[0], 3), "y": round(lo[1], 3), "z": round(lo[2], 3)},
+        "max": {"x": round(hi[0], 3), "y": round(hi[1], 3), "z": round(hi[2], 3)},
+    }
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — lettura STL")
+    parser.add_argument("stl", help="File .stl")
+    parser.add_argument("--write-meta", action="store_true", help="Scrive il sidecar .meta.json")
+    args = parser.parse_args()
+
+    if args.write_meta:
+        meta = write_meta(args.stl)
+        print(f"{meta_path(args.stl)}: {meta['triangles']:,} triangoli, "
+              f"manifold {'sì' if meta['manifold']['is_manifold'] else 'no'}")
+        return
+    res = scan(args.stl)
+    fmt = "ASCII" if binary_triangle_count(args.stl) is None else "binario"
+    print(f"Formato: {fmt}  triangoli: {res['triangles']:,}")
+    dims = dimensions((res["min"], res["max"]) if res["triangles"] else None)
+    if dims:
+        print(f"Bounding box: {dims['x']} × {dims['y']} × {dims['z']} mm")
+        print(f"Volume: {res['volume']:,.1f} mm³")
+
+
+if __name__ == "__main__":
+    main()
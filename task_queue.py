@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+PANDA — Indice persistente della coda task
+===========================================
+
+Indice SQLite dei task in ~/panda/tasks/, condiviso da worker e dashboard.
+I file .json restano la sorgente di verità; l'indice evita di riaprire e
+parsare ogni task ad ogni ciclo solo per leggerne la priorità:
+
+- enqueue()  : dashboard / worker registrano un task appena scritto
+- claim()    : il worker prende in carico un task (ritorna il payload già parsato)
+- release()  : task rimesso in coda (retry o pipeline fermata)
+- complete() : task spostato in done/ → rimosso dall'indice
+- pending()  : coda ordinata per (priority, filename) tramite indice SQL
+- sync()     : riallinea l'indice con la directory (task copiati a mano);
+               parsa solo i file nuovi o modificati (mtime/size)
+- sync_if_changed() : sync completa solo se l'mtime di tasks/ è cambiato
+               dall'ultima (dashboard: file aggiunti/rimossi a worker fermo)
+
+Uso da CLI:
+  python3 task_queue.py            elenca la coda
+  python3 task_queue.py --sync     riallinea l'indice con tasks/
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+# =========================
+# PATHS
+# =========================
+
+PANDA_HOME = Path.home() / "panda"
+TASKS_DIR = PANDA_HOME / "tasks"
+DB_DIR = PANDA_HOME / "db"
+QUEUE_DB = DB_DIR / "queue.sqlite3"
+
+DEFAULT_PRIORITY = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    filename    TEXT PRIMARY KEY,
+    task_id     TEXT,
+    type        TEXT,
+    priority    INTEGER NOT NULL DEFAULT 10,
+    state       TEXT NOT NULL DEFAULT 'pending',
+    mtime_ns    INTEGER,
+    size        INTEGER,
+    payload     TEXT,
+    enqueued_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks(state, priority, filename);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# =========================
+# CONNESSIONE
+# =========================
+
+def connect(db_path=None):
+    """Apre il database (WAL: worker e dashboard leggono/scrivono in parallelo)."""
+    db_path = Path(db_path or QUEUE_DB)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _priority(task):
+    try:
+        return int(task.get("priority", DEFAULT_PRIORITY))
+    except (TypeError, ValueError, AttributeError):
+        return DEFAULT_PRIORITY
+
+
+def _row_values(filename, task, mtime_ns, size):
+    task = task if isinstance(task, dict) else {}
+    return (
+        filename,
+        str(task.get("id", "")),
+        str(task.get("type", "")),
+        _priority(task),
+        mtime_ns,
+        size,
+        json.dumps(task) if task else None,
+        datetime.now().isoformat(),
+    )
+
+
+def _stat(path):
+    try:
+        st = path.stat()
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None, None
+
+# =========================
+# OPERAZIONI
+# =========================
+
+def enqueue(filename, task, tasks_dir=None, conn=None):
+    """Registra (o aggiorna) un task come pending."""
+    tasks_dir = Path(tasks_dir or TASKS_DIR)
+    mtime_ns, size = _stat(tasks_dir / filename)
+    own = conn is None
+    conn = conn or connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO tasks (filename, task_id, type, priority, mtime_ns, size, payload, enqueued_at, state) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending') "
+                "ON CONFLICT(filename) DO UPDATE SET task_id=excluded.task_id, type=excluded.type, "
+                "priority=excluded.priority, mtime_ns=excluded.mtime_ns, size=excluded.size, "
+                "payload=excluded.payload, state='pending'",
+                _row_values(filename, task, mtime_ns, size),
+            )
+    finally:
+        if own:
+            conn.close()
+
+
+def claim(filename):
+    """Segna il task come in esecuzione e ritorna il payload (dict) oppure None."""
+    with closing(connect()) as conn, conn:
+        row = conn.execute("SELECT payload FROM tasks WHERE filename = ?", (filename,)).fetchone()
+        conn.execute("UPDATE tasks SET state = 'running' WHERE filename = ?", (filename,))
+    if row is None or row["payload"] is None:
+        return None
+    try:
+        return json.loads(row["payload"])
+    except ValueError:
+        return None
+
+
+def release(filename, task=None, tasks_dir=None):
+    """Rimette il task in coda (retry: payload aggiornato con _retry)."""
+    if task is not None:
+        enqueue(filename, task, tasks_dir=tasks_dir)
+        return
+    with closing(connect()) as conn, conn:
+        conn.execute("UPDATE tasks SET state = 'pending' WHERE filename = ?", (filename,))
+
+
+def complete(filename):
+    """Task concluso (spostato in done/) o cancellato: rimosso dall'indice."""
+    with closing(connect()) as conn, conn:
+        conn.execute("DELETE FROM tasks WHERE filename = ?", (filename,))
+
+
+remove = complete
+
+
+def reset_running():
+    """All'avvio del worker: i task rimasti 'running' (crash) tornano pending."""
+    with closing(connect()) as conn, conn:
+        conn.execute("UPDATE tasks SET state = 'pending' WHERE state = 'running'")
+
+
+def pending(include_running=False, limit=None):
+    """
+    Coda ordinata per priorità (1 = urgente) e nome file.
+    Ritorna lista di dict {filename, task_id, type, priority, state, task}.
+    """
+    states = ("pending", "running") if include_running else ("pending",)
+    sql = (
+        f"SELECT filename, task_id, type, priority, state, payload FROM tasks "
+        f"WHERE state IN ({','.join('?' * len(states))}) ORDER BY priority, filename"
+    )
+    params = list(states)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    with closing(connect()) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    out = []
+    for r in rows:
+        try:
+            task = json.loads(r["payload"]) if r["payload"] else {}
+        except ValueError:
+            task = {}
+        out.append({
+            "filename": r["filename"],
+            "task_id":  r["task_id"],
+            "type":     r["type"],
+            "priority": r["priority"],
+            "state":    r["state"],
+            "task":     task,
+        })
+    return out
+
+
+def next_task():
+    """Primo task pending (O(log N) sull'indice) oppure None."""
+    rows = pending(limit=1)
+    return rows[0] if rows else None
+
+
+def count(types=None, include_running=True):
+    """Numero di task in coda (pending + running), opzionalmente solo di certi tipi."""
+    states = ("pending", "running") if include_running else ("pending",)
+    sql = f"SELECT COUNT(*) FROM tasks WHERE state IN ({','.join('?' * len(states))})"
+    params = list(states)
+    if types:
+        sql += f" AND type IN ({','.join('?' * len(types))})"
+        params.extend(types)
+    with closing(connect()) as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+
+def route_counts(types=None, include_running=True):
+    """
+    Task in coda raggruppati per i campi che decidono il modello Ollama:
+    lista di dict {type, object_type, quality, model, n}. Un'unica query
+    GROUP BY (json_extract sul payload), senza parsare i task in Python.
+    """
+    states = ("pending", "running") if include_running else ("pending",)
+    fields = ", ".join(
+        f"CASE WHEN json_valid(payload) THEN json_extract(payload, '$.{f}') END AS {f}"
+        for f in ("object_type", "quality", "model")
+    )
+    sql = (
+        f"SELECT type, {fields}, COUNT(*) AS n FROM tasks "
+        f"WHERE state IN ({','.join('?' * len(states))})"
+    )
+    params = list(states)
+    if types:
+        sql += f" AND type IN ({','.join('?' * len(types))})"
+        params.extend(types)
+    sql += " GROUP BY type, object_type, quality, model"
+    with closing(connect()) as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+
+def is_synced():
+    """True se almeno una sync completa è stata eseguita su questo indice."""
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'last_full_sync'").fetchone()
+    return row is not None
+
+
+def _dir_mtime_ns(tasks_dir):
+    try:
+        return os.stat(tasks_dir).st_mtime_ns
+    except OSError:
+        return None
+
+# =========================
+# SYNC CON LA DIRECTORY
+# =========================
+
+def _load_task_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def sync(tasks_dir=None, names=None):
+    """
+    Riallinea l'indice con tasks/.
+    names=None → scansione completa (solo nomi + stat; JSON parsato solo per
+    file nuovi o modificati). names=set(...) → aggiorna solo quei file
+    (eventi del watcher). Ritorna {"added": n, "updated": n, "removed": n}.
+    """
+    tasks_dir = Path(tasks_dir or TASKS_DIR)
+    stats = {"added": 0, "updated": 0, "removed": 0}
+    # Letto prima della scansione: un file creato durante la sync cambia di
+    # nuovo l'mtime e la prossima sync_if_changed() lo vede
+    dir_mtime_ns = _dir_mtime_ns(tasks_dir) if names is None else None
+
+    with closing(connect()) as conn, conn:
+        if names is None:
+            on_disk = {}
+            try:
+                with os.scandir(tasks_dir) as it:
+                    for entry in it:
+                        if entry.name.endswith(".json") and not entry.name.startswith("_") and entry.is_file():
+                            st = entry.stat()
+                            on_disk[entry.name] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+            indexed = {
+                r["filename"]: (r["mtime_ns"], r["size"])
+                for r in conn.execute("SELECT filename, mtime_ns, size FROM tasks")
+            }
+            gone = [n for n in indexed if n not in on_disk]
+            changed = [n for n, sig in on_disk.items() if indexed.get(n) != sig]
+        else:
+            gone, changed = [], []
+            for name in names:
+                if not name.endswith(".json") or name.startswith("_"):
+                    continue
+                if (tasks_dir / name).is_file():
+                    changed.append(name)
+                else:
+                    gone.append(name)
+
+        for name in gone:
+            cur = conn.execute("DELETE FROM tasks WHERE filename = ?", (name,))
+            stats["removed"] += cur.rowcount
+
+        for name in changed:
+            path = tasks_dir / name
+            mtime_ns, size = _stat(path)
+            if mtime_ns is None:
+                continue
+            row = conn.execute("SELECT mtime_ns, size FROM tasks WHERE filename = ?", (name,)).fetchone()
+            if row is not None and (row["mtime_ns"], row["size"]) == (mtime_ns, size):
+                continue
+            task = _load_task_file(path)
+            values = _row_values(name, task, mtime_ns, size)
+            if row is None:
+                conn.execute(
+                    "INSERT INTO tasks (filename, task_id, type, priority, mtime_ns, size, payload, enqueued_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    values,
+                )
+                stats["added"] += 1
+            else:
+                conn.execute(
+                    "UPDATE tasks SET task_id=?, type=?, priority=?, mtime_ns=?, size=?, payload=? "
+                    "WHERE filename = ?",
+                    values[1:7] + (name,),
+                )
+                stats["updated"] += 1
+
+        if names is None:
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [("last_full_sync", datetime.now().isoformat()),
+                 ("tasks_dir_mtime_ns", str(dir_mtime_ns))],
+            )
+
+    return stats
+
+
+def sync_if_changed(tasks_dir=None):
+    """
+    Sync completa solo se l'mtime della directory tasks/ (cambia a ogni file
+    creato, rinominato o rimosso) differisce da quello dell'ultima sync
+    completa. Un solo stat() quando nulla è cambiato. Ritorna le statistiche
+    di sync() oppure None se la sync non serviva.
+    """
+    tasks_dir = Path(tasks_dir or TASKS_DIR)
+    current = _dir_mtime_ns(tasks_dir)
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'tasks_dir_mtime_ns'").fetchone()
+    if current is not None and row is not None and row["value"] == str(current):
+        return None
+    return sync(tasks_dir)
+
+# =========================
+# CLI
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="PANDA — indice coda task")
+    parser.add_argument("--sync", action="store_true", help="Riallinea l'indice con tasks/")
+    parser.add_argument("--json", action="store_true", help="Output JSON")
+    args = parser.parse_args()
+
+    if args.sync:
+        st = sync()
+        print(f"Sync: +{st['added']}  ~{st['updated']}  -{st['removed']}")
+
+    rows = pending(include_running=True)
+    if args.json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        return
+    print(f"{'PRIO':>4}  {'STATO':<8} {'TIPO':<14} FILE")
+    for r in rows:
+        print(f"{r['priority']:>4}  {r['state']:<8} {r['type']:<14} {r['filename']}")
+    print(f"\nTotale: {len(rows)} task")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,25 +5,62 @@ Pana Automating Never Death (on) Afterwork — 3D Model Generator
 
 Features:
 - Generazione modelli 3D via Ollama + OpenSCAD
-- Task types 3D: generate_3d, compile_scad, validate_scad, list_models
+- Task types 3D: generate_3d, compile_scad, validate_scad, generate_variants, list_models
 - Task types legacy: bash, python, file, test, prompt
+- Pipeline generate_3d: LLM del task N+1 in parallelo alla compilazione del task N
+- Compilazioni OpenSCAD in parallelo (compile_workers)
+- Intake immediato dei task via inotify (fallback polling)
+- Coda task indicizzata su SQLite (task_queue.py), condivisa con la dashboard
+- Result salvati nell'archivio SQLite results_store.py (JSON opzionale)
+- Streaming Ollama con early stop (fine codice) ed early abort (nessun codice)
+- System prompt con prefisso condiviso in testa e coda raggruppata per prefisso (KV cache Ollama)
+- Artifact store STL content-addressed: compilazioni identiche → hardlink, mesh deduplicate
+- Forma canonica SCAD (scad_canon.py): sorgenti diversi solo cosmeticamente condividono compilazione e validazione
+- Cache generazione: chiavi normalizzate e per-versione dei prompt, LRU con budget in byte
+- Libreria di generatori parametrici (scad_library.py): ingranaggi, viti/dadi, scatole, staffe ad L senza LLM
+- Indice di similarità dei modelli (model_index.py): modelli simili suggeriti o riusati prima dell'LLM
+- Cache semantica (semantic_cache.py): embedding Ollama delle descrizioni, riuso o codice di partenza
+- Riuso parametrico: stessa descrizione con altri parametri → SCAD già generato + openscad -D, senza LLM
+- Routing modello per tipo/oggetto/qualità (model_routing) con fallback su timeout o RAM bassa
+- Residenza modello in Ollama: preload, keep_alive sulla coda, unload a coda ferma
 - Retry automatico
 - Pipeline stop su gate fallito
 - Stato live per dashboard
 - Long-running safe
 """
 
+import ctypes
+import ctypes.util
 import hashlib
+import itertools
 import json
+import os
+import queue
 import re
+import select
+import shutil
+import struct
 import sys
+import tempfile
 import threading
 import time
 import subprocess
-from datetime import datetime, timedelta
+import unicodedata
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
-import requests
+import artifact_store
+import model_index
+import ollama_client
+import results_store
+import scad_canon
+import scad_library
+import scad_repair
+import stl_io
+import semantic_cache
+import task_queue
 
 try:
     import psutil
@@ -47,6 +84,12 @@ MODELS_SCAD_DIR = PANDA_HOME / "models" / "scad"
 MODELS_STL_DIR = PANDA_HOME / "models" / "stl"
 CACHE_DIR = PANDA_HOME / "cache"
 CACHE_MAX_AGE_DAYS = 7
+CACHE_STATS_FILE = STATUS_DIR / "cache_stats.json"
+CACHE_STATS_INTERVAL = 5  # secondi minimi tra due scritture delle statistiche da get()
+TEMPLATES_DIR = CACHE_DIR / "templates"
+TEMPLATE_STATS_FILE = STATUS_DIR / "template_stats.json"
+RESPONSES_DIR = CACHE_DIR / "responses"
+RESPONSE_STATS_FILE = STATUS_DIR / "response_cache_stats.json"
 
 # =========================
 # CONFIG
@@ -72,19 +115,71 @@ DEFAULT_CONFIG = {
     "execute_code": True,
     "modify_files": True,
     "stop_on_test_fail": False,
+    "compile_workers": 2,
+    "watch_tasks": True,
+    "watch_poll_interval": 1.0,
+    "queue_rescan_interval": 300,
+    "queue_window": 32,
+    "results_write_json": False,
+    "pipeline_enabled": True,
+    "pipeline_queue_size": 2,
+    "stream_early_stop": True,
+    "stream_abort_chars": 1200,
+    "ollama_connect_timeout": 5,
+    "ollama_read_timeout": 600,
+    "ollama_retries": 2,
+    "model_preload": True,
+    "model_keep_alive": 300,
+    "model_keep_alive_per_task": 120,
+    "model_keep_alive_max": 3600,
+    "model_unload_idle": 900,
+    "model_unload_ram_mb": 2048,
+    # Prima regola che combacia vince; "primary" = model, "fallback" = model_fallback
+    "model_routing": [
+        {"type": ["bash", "file", "prompt"], "model": "fallback"},
+        {"type": "generate_3d", "object_type": "mechanical", "model": "primary"},
+        {"type": "generate_3d", "quality": "high", "model": "primary"},
+        {"type": "generate_3d", "quality": "fast", "model": "fallback"},
+    ],
+    "model_fallback_ram_mb": 2048,
+    "cache_memory_mb": 16,
+    "cache_disk_mb": 256,
+    "cache_max_age_days": 7,
+    "response_cache": True,
+    "response_cache_memory_mb": 4,
+    "response_cache_disk_mb": 32,
+    "response_cache_ttl_hours": 168,
+    "artifact_store": True,
+    "stl_meta": True,
+    "auto_repair": True,
+    "auto_repair_attempts": 3,
+    "scad_library": True,
+    "semantic_cache": True,
+    "semantic_cache_threshold": 0.92,
+    "semantic_seed_threshold": 0.8,
+    "embedding_model": "nomic-embed-text",
+    "parametric_reuse": True,
+    "similarity_reuse": "suggest",
+    "similarity_threshold": 0.9,
+    "max_variants": 50,
 }
 
 # =========================
 # UTILS
 # =========================
 
+_LOG_LOCK = threading.Lock()
+
+
 def log(msg, level="INFO"):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] [{level}] {msg}"
-    print(line, flush=True)
-    LOGS_DIR.mkdir(exist_ok=True)
-    with open(LOGS_DIR / f"{datetime.now().strftime('%Y-%m-%d')}.log", "a") as f:
-        f.write(line + "\n")
+    # Lock: con la pipeline più thread loggano in parallelo
+    with _LOG_LOCK:
+        print(line, flush=True)
+        LOGS_DIR.mkdir(exist_ok=True)
+        with open(LOGS_DIR / f"{datetime.now().strftime('%Y-%m-%d')}.log", "a") as f:
+            f.write(line + "\n")
 
 
 def _count_stl_models():
@@ -136,50 +231,208 @@ def save_default_config():
 # OLLAMA
 # =========================
 
-def ask_ollama(prompt, config, system_prompt=None):
-    start_time = time.time()
-    stop_event = threading.Event()
+# Tracce di codice cercate nei primi caratteri dello stream (early abort)
+_SCAD_HINT_RE = re.compile(
+    r"```|\$fn|\bmodule\s+\w+\s*\(|"
+    r"\b(cube|cylinder|sphere|difference|union|intersection|translate|rotate|mirror|"
+    r"linear_extrude|rotate_extrude|hull|minkowski|polygon|circle|square)\s*\(|"
+    r"^\s*\w+\s*=\s*[-\d.]+\s*;",
+    re.MULTILINE,
+)
+_CODE_HINT_RE = re.compile(
+    r"```|^#!|[;{}|$=]|"
+    r"^\s*(import|from|def|class|for|if|while|echo|sudo|cd|ls|cat|find|grep|"
+    r"mkdir|rm|cp|mv|python3?|pip3?|apt|systemctl)\b",
+    re.MULTILINE,
+)
+
+
+class _StreamExtractor:
+    """
+    Consuma la risposta Ollama a pezzi e decide quando smettere di leggere.
+    expect="scad" / "code":
+    - stop  : chiusura del blocco ``` oppure riga finale `main_object();` (solo scad)
+    - abort : nei primi `abort_chars` caratteri nessuna traccia di codice
+    expect="text": legge tutto (file, prompt liberi).
+    """
 
-    def progress_logger():
-        while not stop_event.wait(30):
-            elapsed = time.time() - start_time
-            mins = int(elapsed // 60)
-            secs = int(elapsed % 60)
-            log(f"⏳ Ollama sta elaborando... ({mins}min {secs}s)")
+    def __init__(self, expect="text", abort_chars=0):
+        self.expect = expect
+        self.abort_chars = abort_chars if expect in ("scad", "code") else 0
+        self.hint_re = _SCAD_HINT_RE if expect == "scad" else _CODE_HINT_RE
+        self.text = ""
+        self.reason = None
+        self._scan = 0              # inizio della prima riga non ancora analizzata
+        self._fence_open = False
+        self._seen_code = False
+
+    def feed(self, chunk):
+        """Aggiunge un pezzo di risposta; ritorna "stop", "abort" oppure None."""
+        self.text += chunk
+        if self.expect == "text":
+            return None
+
+        # Solo righe complete: il pezzo può tagliare a metà ``` o main_object();
+        while True:
+            nl = self.text.find("\n", self._scan)
+            if nl < 0:
+                break
+            line = self.text[self._scan:nl].strip()
+            self._scan = nl + 1
+            if line.startswith("```"):
+                if self._fence_open:
+                    self.text = self.text[:self._scan]
+                    self.reason = "fine blocco ```"
+                    return "stop"
+                self._fence_open = True
+                self._seen_code = True
+            elif self.expect == "scad" and line == "main_object();":
+                self.text = self.text[:self._scan]
+                if self._fence_open:
+                    self.text += "```\n"
+                self.reason = "main_object();"
+                return "stop"
+
+        if self.abort_chars and not self._seen_code:
+            if self.hint_re.search(self.text):
+                self._seen_code = True
+            elif len(self.text) >= self.abort_chars:
+                self.reason = "nessun codice"
+                return "abort"
+        return None
+
+
+def ask_ollama(prompt, config, system_prompt=None, expect="text", model=None,
+               history=None, stats=None):
+    """
+    Chiamata Ollama in streaming (NDJSON).
+    expect="scad"/"code" abilita early stop (codice completo → chiude la
+    connessione, Ollama interrompe la generazione) ed early abort (niente
+    codice nei primi stream_abort_chars caratteri → None).
+    model: scelto da route_model (default config["model"]); in caso di
+    timeout si ripiega una volta su model_fallback.
+    history: messaggi chat precedenti (tra system e prompt), così una
+    richiesta di follow-up riusa in Ollama la KV cache della conversazione.
+    stats: dict riempito con le metriche della chiamata (vedi _llm_stats).
+    """
+    model = model or config["model"]
+    if model != config["model"]:
+        log(f"🧭 Modello: {model}")
+
+    def progress_logger(elapsed):
+        mins = int(elapsed // 60)
+        secs = int(elapsed % 60)
+        log(f"⏳ Ollama sta elaborando... ({mins}min {secs}s)")
+
+    if not config.get("stream_early_stop", True):
+        expect = "text"
+    extractor = _StreamExtractor(expect, int(config.get("stream_abort_chars", 1200) or 0))
+
+    if system_prompt:
+        path = "/api/chat"
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                *(history or []),
+                {"role": "user", "content": prompt},
+            ],
+            "stream": True,
+            "keep_alive": _RESIDENCY.keep_alive(config),
+        }
+    else:
+        path = "/api/generate"
+        payload = {"model": model, "prompt": prompt, "stream": True,
+                   "keep_alive": _RESIDENCY.keep_alive(config)}
 
-    progress_thread = threading.Thread(target=progress_logger, daemon=True)
-    progress_thread.start()
+    prompt_chars = len(json.dumps(payload.get("messages") or prompt, ensure_ascii=False))
+    t_start = time.time()
+    t_first = None
+    final = None
 
     try:
-        if system_prompt:
-            r = requests.post(
-                f"{config['ollama_url']}/api/chat",
-                json={
-                    "model": config["model"],
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt},
-                    ],
-                    "stream": False,
-                },
-                timeout=3600,
-            )
-            r.raise_for_status()
-            return r.json().get("message", {}).get("content", "")
-        else:
-            r = requests.post(
-                f"{config['ollama_url']}/api/generate",
-                json={"model": config["model"], "prompt": prompt, "stream": False},
-                timeout=3600,
-            )
+        client = ollama_client.client_for(config)
+        with ollama_client.progress(progress_logger), \
+                client.post(path, json=payload, stream=True) as r:
             r.raise_for_status()
-            return r.json().get("response", "")
+            for raw in r.iter_lines():
+                if not raw:
+                    continue
+                data = json.loads(raw)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                if system_prompt:
+                    piece = data.get("message", {}).get("content", "")
+                else:
+                    piece = data.get("response", "")
+                if piece and t_first is None:
+                    t_first = time.time()
+                verdict = extractor.feed(piece) if piece else None
+                if verdict == "stop":
+                    log(f"✂️ Stream chiuso in anticipo ({extractor.reason}) "
+                        f"dopo {len(extractor.text)} caratteri")
+                    break
+                if verdict == "abort":
+                    log(f"🛑 Nessun codice nei primi {len(extractor.text)} caratteri "
+                        f"— risposta scartata", "WARN")
+                    return None
+                if data.get("done"):
+                    final = data
+                    break
+        if stats is not None:
+            stats.clear()
+            stats.update(_llm_stats(model, final, t_start, t_first, prompt_chars, extractor.reason))
+        return extractor.text
     except Exception as e:
+        fallback = config.get("model_fallback")
+        if ollama_client.is_timeout(e) and fallback and fallback != model:
+            log(f"⏱️ Timeout da {model} — ripiego su {fallback}", "WARN")
+            return ask_ollama(prompt, config, system_prompt=system_prompt, expect=expect,
+                              model=fallback, history=history, stats=stats)
         log(f"Ollama error: {e}", "ERROR")
         return None
-    finally:
-        stop_event.set()
-        progress_thread.join(timeout=1)
+
+
+def _llm_stats(model, final, t_start, t_first, prompt_chars, stop_reason=None):
+    """
+    Metriche di una chiamata: tempo al primo token (≈ load + prompt eval,
+    misurato sempre) e, se lo stream è arrivato fino a done, i contatori di
+    Ollama. Ollama li manda solo nel chunk done: dopo un early stop non
+    esistono e ollama_counters=False lo dice esplicitamente (ttft_s resta
+    l'unica misura del prompt eval, e della cache del prefisso).
+    """
+    stats = {
+        "model": model,
+        "prompt_chars": prompt_chars,
+        "ttft_s": round(t_first - t_start, 2) if t_first else None,
+        "total_s": round(time.time() - t_start, 2),
+    }
+    if stop_reason:
+        stats["early_stop"] = stop_reason
+    if final:
+        ns = 1e9
+        stats.update({
+            "load_s": round(final.get("load_duration", 0) / ns, 2),
+            "prompt_eval_count": final.get("prompt_eval_count", 0),
+            "prompt_eval_s": round(final.get("prompt_eval_duration", 0) / ns, 2),
+            "eval_count": final.get("eval_count", 0),
+            "eval_s": round(final.get("eval_duration", 0) / ns, 2),
+        })
+    stats["ollama_counters"] = bool(final)
+    return stats
+
+
+def _fmt_llm_stats(stats):
+    parts = []
+    if stats.get("ttft_s") is not None:
+        parts.append(f"primo token {stats['ttft_s']}s")
+    if "prompt_eval_count" in stats:
+        parts.append(f"prompt eval {stats['prompt_eval_count']} token in {stats['prompt_eval_s']}s")
+    elif stats.get("early_stop"):
+        parts.append("contatori Ollama n/d (stream chiuso prima di done)")
+    if stats.get("eval_count"):
+        parts.append(f"{stats['eval_count']} token generati")
+    return " · ".join(parts)
 
 
 def clean_llm(code):
@@ -258,6 +511,196 @@ def clean_llm(code):
 
     return code.strip()
 
+# =========================
+# ROUTING MODELLI
+# =========================
+
+# Task che chiamano l'LLM (compile_scad / test / validate_scad no)
+LLM_TASK_TYPES = ("generate_3d", "bash", "python", "file", "prompt")
+
+# Soglia RAM (MB) sotto la quale _check_ram_warning avvisa
+RAM_WARN_MB = 2048
+
+
+def _rule_matches(expected, actual):
+    if expected is None:
+        return True
+    if isinstance(expected, (list, tuple)):
+        return actual in expected
+    return actual == expected
+
+
+def _resolve_model(name, config):
+    """"primary" / "fallback" → nomi in config; altrimenti nome Ollama esplicito."""
+    if name in (None, "", "primary"):
+        return config["model"]
+    if name == "fallback":
+        return config.get("model_fallback") or config["model"]
+    return name
+
+
+def route_model(task, config, available_mb=None):
+    """
+    Sceglie il modello Ollama per un task:
+    1. task["model"] esplicito ("primary", "fallback" o nome Ollama)
+    2. RAM disponibile sotto model_fallback_ram_mb → model_fallback
+    3. prima regola di model_routing che combacia su type / object_type / quality
+    4. config["model"]
+    available_mb: RAM già letta dal chiamante (None → letta qui).
+    """
+    if task.get("model"):
+        return _resolve_model(task["model"], config)
+
+    fallback = config.get("model_fallback")
+    if available_mb is None:
+        available_mb = _check_ram_warning(quiet=True)
+    if fallback and available_mb is not None and \
+            available_mb < config.get("model_fallback_ram_mb", RAM_WARN_MB):
+        return fallback
+
+    task_type = task.get("type", "prompt")
+    object_type = task.get("object_type", "simple")
+    quality = task.get("quality") or config.get("default_quality", "medium")
+    for rule in config.get("model_routing") or []:
+        if (_rule_matches(rule.get("type"), task_type)
+                and _rule_matches(rule.get("object_type"), object_type)
+                and _rule_matches(rule.get("quality"), quality)):
+            return _resolve_model(rule.get("model"), config)
+    return config["model"]
+
+# =========================
+# RESIDENZA MODELLO
+# =========================
+
+
+class ModelResidency:
+    """
+    Decide quanto a lungo Ollama tiene il modello in RAM (via /api/ps):
+    - preload (richiesta vuota, in background) appena in coda c'è un task LLM
+    - keep_alive di ogni richiesta proporzionale ai task LLM ancora in coda
+    - unload esplicito (keep_alive=0) dopo model_unload_idle secondi di coda
+      vuota, oppure subito se la RAM è sotto model_unload_ram_mb: a coda
+      ferma la RAM serve a OpenSCAD/CGAL, non al modello
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._preloading = False
+        self.idle_since = None
+
+    def keep_alive(self, config, depth=None):
+        """Secondi di keep_alive da mandare con la prossima richiesta."""
+        if depth is None:
+            depth = _llm_queue_depth()
+        base = int(config.get("model_keep_alive", 300))
+        per_task = int(config.get("model_keep_alive_per_task", 120))
+        return min(int(config.get("model_keep_alive_max", 3600)), base + per_task * depth)
+
+    def loaded(self, config):
+        """Modelli caricati in Ollama {nome: info} ({} se Ollama non risponde)."""
+        try:
+            r = ollama_client.client_for(config).get("/api/ps", read_timeout=10)
+            r.raise_for_status()
+            return {m.get("name", ""): m for m in r.json().get("models", [])}
+        except Exception:
+            return {}
+
+    def is_loaded(self, config, model=None, names=None):
+        model = model or config["model"]
+        names = self.loaded(config) if names is None else names
+        return model in names or f"{model}:latest" in names
+
+    def tick(self, config):
+        """Da chiamare a ogni giro del main loop: preload oppure unload."""
+        available_mb = _check_ram_warning(quiet=True)
+        models = _queued_llm_models(config, available_mb)
+        depth = sum(models.values())
+        if depth > 0:
+            self.idle_since = None
+            if config.get("model_preload", True):
+                # Il modello richiesto dal maggior numero di task in coda
+                self._preload_async(config, models.most_common(1)[0][0], depth)
+            return
+
+        if self.idle_since is None:
+            self.idle_since = time.time()
+            return
+        unload_idle = config.get("model_unload_idle", 900)
+        idle = time.time() - self.idle_since
+        ram_low = available_mb is not None and available_mb < config.get("model_unload_ram_mb", 2048)
+        if (unload_idle and idle >= unload_idle) or ram_low:
+            self.unload(config, reason="RAM bassa" if ram_low else f"coda vuota da {_fmt_duration(idle)}")
+
+    def _preload_async(self, config, model, depth):
+        with self._lock:
+            if self._preloading:
+                return
+            self._preloading = True
+        threading.Thread(target=self._preload, args=(config, model, depth),
+                         name="model-preload", daemon=True).start()
+
+    def _preload(self, config, model, depth):
+        try:
+            if self.is_loaded(config, model):
+                return
+            log(f"🔥 Preload modello {model} ({depth} task LLM in coda)")
+            t0 = time.time()
+            r = ollama_client.client_for(config).post(
+                "/api/generate",
+                json={"model": model, "keep_alive": self.keep_alive(config, depth)},
+            )
+            r.raise_for_status()
+            log(f"🔥 Modello caricato in {_fmt_duration(time.time() - t0)}")
+        except Exception as e:
+            log(f"Preload modello fallito: {e}", "WARN")
+        finally:
+            with self._lock:
+                self._preloading = False
+
+    def unload(self, config, reason=""):
+        """Scarica da Ollama modello principale e fallback, se caricati."""
+        names = self.loaded(config)
+        unloaded = False
+        for model in dict.fromkeys(m for m in (config["model"], config.get("model_fallback")) if m):
+            if not self.is_loaded(config, model, names):
+                continue
+            try:
+                r = ollama_client.client_for(config).post(
+                    "/api/generate", json={"model": model, "keep_alive": 0},
+                )
+                r.raise_for_status()
+                log(f"💤 Modello {model} scaricato da Ollama" + (f" ({reason})" if reason else ""))
+                unloaded = True
+            except Exception as e:
+                log(f"Unload modello {model} fallito: {e}", "WARN")
+        return unloaded
+
+
+def _llm_queue_depth():
+    try:
+        return task_queue.count(LLM_TASK_TYPES)
+    except Exception:
+        return 0
+
+
+def _queued_llm_models(config, available_mb=None):
+    """
+    Counter {modello: task in coda} secondo route_model, chiamato una volta
+    per combinazione distinta di type/object_type/quality/model in coda.
+    """
+    models = Counter()
+    try:
+        groups = task_queue.route_counts(LLM_TASK_TYPES)
+    except Exception:
+        return models
+    for group in groups:
+        task = {k: group[k] for k in ("type", "object_type", "quality", "model") if group[k] is not None}
+        models[route_model(task, config, available_mb)] += group["n"]
+    return models
+
+
+_RESIDENCY = ModelResidency()
+
 # =========================
 # EXECUTION HELPERS
 # =========================
@@ -343,102 +786,155 @@ _CATEGORY_PROMPT_MAP = {
 }
 
 
-def _select_specialized_prompt(description: str, object_category: str = "") -> str:
-    """
-    Seleziona il prompt specializzato più adatto.
-    Priorità: object_category esplicita > keyword nella description.
-    Ritorna il contenuto del file prompt oppure "" se non trovato.
-    """
+def _specialized_prompt_candidates(description, object_category=""):
+    """(origine, nome) dei prompt specializzati candidati, in ordine di priorità."""
     # 1. Campo object_category esplicito nel task JSON
     if object_category:
         key = _CATEGORY_PROMPT_MAP.get(object_category.lower(), "")
         if key:
-            content = _load_prompt_file(f"objects/{key}.txt")
-            if content:
-                log(f"📋 Prompt specializzato (category): objects/{key}.txt")
-                return content
+            yield "category", key
 
     # 2. Ricerca per keyword nella description (case-insensitive)
     desc_lower = description.lower()
     for keywords, prompt_key in _KEYWORD_PROMPT_MAP:
         if any(kw.lower() in desc_lower for kw in keywords):
-            content = _load_prompt_file(f"objects/{prompt_key}.txt")
-            if content:
-                log(f"📋 Prompt specializzato (keyword): objects/{prompt_key}.txt")
-                return content
+            yield "keyword", prompt_key
+
+
+def _specialized_prompt_name(description, object_category=""):
+    """Nome del prompt specializzato che verrebbe scelto ("" se nessuno), senza leggerlo."""
+    for _, key in _specialized_prompt_candidates(description, object_category):
+        if (PROMPTS_DIR / "objects" / f"{key}.txt").exists():
+            return key
+    return ""
+
 
+def _select_specialized_prompt(description: str, object_category: str = "") -> str:
+    """
+    Seleziona il prompt specializzato più adatto.
+    Priorità: object_category esplicita > keyword nella description.
+    Ritorna il contenuto del file prompt oppure "" se non trovato.
+    """
+    for source, key in _specialized_prompt_candidates(description, object_category):
+        content = _load_prompt_file(f"objects/{key}.txt")
+        if content:
+            log(f"📋 Prompt specializzato ({source}): objects/{key}.txt")
+            return content
     return ""
 
 
+_STRUCTURE_PROMPT = (
+    "STRUTTURA RICHIESTA: Definisci variabili parametriche all'inizio "
+    "(es: width=50; height=30;). "
+    "Metti tutta la geometria in un modulo chiamato main_object(). "
+    "Ultima riga del file: main_object(); "
+    "NON usare include<> o use<>. Il file deve essere self-contained."
+)
+
+
 def _build_system_prompt(object_type, description="", object_category=""):
     """
-    Combina i layer di prompt:
-      base_system.txt + {object_type}.txt + objects/{specialized}.txt + struttura
+    Combina i layer di prompt, dal più condiviso al più specifico:
+      base_system.txt + struttura + {object_type}.txt + objects/{specialized}.txt
+    Così tutti i generate_3d iniziano con lo stesso prefisso byte per byte e
+    Ollama riusa la KV cache del prompt invece di rivalutarlo da capo.
     """
     base = _load_prompt_file("base_system.txt")
     specific = _load_prompt_file(f"{object_type}.txt")
     specialized = _select_specialized_prompt(description, object_category)
-    structure = (
-        "STRUTTURA RICHIESTA: Definisci variabili parametriche all'inizio "
-        "(es: width=50; height=30;). "
-        "Metti tutta la geometria in un modulo chiamato main_object(). "
-        "Ultima riga del file: main_object(); "
-        "NON usare include<> o use<>. Il file deve essere self-contained."
-    )
-    parts = [p for p in [base, specific, specialized, structure] if p]
+    parts = [p for p in [base, _STRUCTURE_PROMPT, specific, specialized] if p]
     return "\n\n".join(parts)
 
 
+def _prompt_prefix_key(task):
+    """
+    Chiave del prefisso di system prompt di un task generate_3d
+    (object_type, prompt specializzato): task con la stessa chiave
+    condividono l'intero system prompt.
+    """
+    object_type = task.get("object_type", "simple")
+    if object_type not in ("mechanical", "decorative", "simple"):
+        object_type = "simple"
+    specialized = _specialized_prompt_name(task.get("description", ""), task.get("object_category", ""))
+    return object_type, specialized
+
+
 def _extract_bounding_box_from_stl(stl_path):
     """
-    Estrae bounding box da un file STL ASCII parsando le coordinate vertex.
+    Estrae bounding box da un file STL: dal sidecar .meta.json scritto dopo la
+    compilazione se aggiornato, altrimenti leggendo la mesh (binario via mmap,
+    ASCII in streaming a blocchi: memoria costante con stl_io).
     Ritorna dict {x, y, z, min, max} oppure None in caso di errore.
     """
+    meta = stl_io.read_meta(stl_path)
+    if meta:
+        return meta["dimensions"]
     try:
-        content = Path(stl_path).read_text(errors="replace")
-        xs, ys, zs = [], [], []
-        for line in content.splitlines():
-            line = line.strip()
-            if line.startswith("vertex "):
-                parts = line.split()
-                if len(parts) == 4:
-                    xs.append(float(parts[1]))
-                    ys.append(float(parts[2]))
-                    zs.append(float(parts[3]))
-        if not xs:
-            return None
-        return {
-            "x": round(max(xs) - min(xs), 3),
-            "y": round(max(ys) - min(ys), 3),
-            "z": round(max(zs) - min(zs), 3),
-            "min": {"x": round(min(xs), 3), "y": round(min(ys), 3), "z": round(min(zs), 3)},
-            "max": {"x": round(max(xs), 3), "y": round(max(ys), 3), "z": round(max(zs), 3)},
-        }
+        return stl_io.dimensions(stl_io.bounding_box(stl_path))
     except Exception as e:
         log(f"Bounding box extraction error: {e}", "WARN")
         return None
 
 
-def do_compile_scad(scad_path, output_name, config):
-    """Compila un file .scad in .stl tramite openscad. Ritorna dict con risultato."""
-    scad_path = Path(scad_path)
-    MODELS_STL_DIR.mkdir(parents=True, exist_ok=True)
+_COMPILE_EXECUTOR = None
+_COMPILE_EXECUTOR_SIZE = 0
+_COMPILE_EXECUTOR_LOCK = threading.Lock()
 
-    stem = Path(output_name).stem if output_name else scad_path.stem
-    stl_path = MODELS_STL_DIR / f"{stem}.stl"
 
+def _compile_workers(config):
+    try:
+        return max(1, int(config.get("compile_workers", DEFAULT_CONFIG["compile_workers"])))
+    except (TypeError, ValueError):
+        return DEFAULT_CONFIG["compile_workers"]
+
+
+def _get_compile_executor(config):
+    """
+    Executor condiviso per le compilazioni OpenSCAD.
+    Ogni job lancia un processo openscad separato (CGAL è single-thread), quindi
+    compile_workers thread bastano a usare compile_workers core.
+    Ricreato se compile_workers cambia in config.
+    """
+    global _COMPILE_EXECUTOR, _COMPILE_EXECUTOR_SIZE
+    workers = _compile_workers(config)
+    with _COMPILE_EXECUTOR_LOCK:
+        if _COMPILE_EXECUTOR is None or _COMPILE_EXECUTOR_SIZE != workers:
+            if _COMPILE_EXECUTOR is not None:
+                _COMPILE_EXECUTOR.shutdown(wait=False)
+            _COMPILE_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="openscad")
+            _COMPILE_EXECUTOR_SIZE = workers
+            log(f"🔧 Compile executor: {workers} worker OpenSCAD")
+        return _COMPILE_EXECUTOR
+
+
+def _run_openscad_job(scad_path, stl_path, config, defines=None):
+    """
+    Job dell'executor: compila in una scratch dir dedicata e sposta lo STL in
+    models/stl/ con os.replace (atomico), così la dashboard non vede mai STL parziali.
+    defines: {variabile: letterale OpenSCAD} passati come `-D variabile=valore`.
+    """
     openscad_bin = config.get("openscad_binary", "openscad")
     stl_format = config.get("stl_format", "asciistl")
     timeout = config.get("openscad_timeout", 300)
 
-    cmd = [openscad_bin, "--export-format", stl_format, "-o", str(stl_path), str(scad_path)]
+    scratch_root = MODELS_STL_DIR / ".scratch"
+    scratch_root.mkdir(parents=True, exist_ok=True)
+    scratch_dir = Path(tempfile.mkdtemp(prefix=f"{stl_path.stem}_", dir=scratch_root))
+    scratch_stl = scratch_dir / stl_path.name
+
+    cmd = [openscad_bin, "--export-format", stl_format, "-o", str(scratch_stl)]
+    for name, value in (defines or {}).items():
+        cmd += ["-D", f"{name}={value}"]
+    cmd.append(str(scad_path))
     log(f"🔧 Compilando: {' '.join(cmd)}")
 
     try:
         p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
         compile_log = (p.stdout + p.stderr).strip()
-        success = p.returncode == 0 and stl_path.exists()
-        file_size_kb = round(stl_path.stat().st_size / 1024, 2) if stl_path.exists() else 0
+        success = p.returncode == 0 and scratch_stl.exists()
+        if success:
+            os.replace(scratch_stl, stl_path)
+        file_size_kb = round(stl_path.stat().st_size / 1024, 2) if success else 0
 
         if not success:
             log(f"OpenSCAD error (rc={p.returncode}): {compile_log}", "ERROR")
@@ -465,42 +961,750 @@ def do_compile_scad(scad_path, output_name, config):
             "compile_log": "openscad binary not found",
             "file_size_kb": 0,
         }
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+_OPENSCAD_VERSIONS = {}
+
+
+def _openscad_version(config):
+    """`openscad --version` (memorizzata per binario + mtime): entra nella chiave degli artifact."""
+    binary = config.get("openscad_binary", "openscad")
+    path = shutil.which(binary) or binary
+    try:
+        sig = (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        return "unknown"
+    if sig not in _OPENSCAD_VERSIONS:
+        try:
+            p = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=10)
+            _OPENSCAD_VERSIONS[sig] = (p.stdout + p.stderr).strip() or "unknown"
+        except Exception:
+            return "unknown"
+    return _OPENSCAD_VERSIONS[sig]
 
 
-def _check_prompt_cache(prompt_key: str) -> str | None:
+def _write_stl_meta(stl_path, scad_path, config, fn_value=None, defines=None, mesh_sha=None, request=None):
     """
-    Cerca in CACHE_DIR un file .scad con hash MD5 del prompt.
-    Ritorna il contenuto SCAD se trovato e non scaduto (< CACHE_MAX_AGE_DAYS giorni),
-    altrimenti None.
+    Sidecar models/stl/nome.meta.json con le metriche della mesh (bbox,
+    volume, area, triangoli, manifold) e la provenienza, calcolate una volta
+    sola qui: dashboard, analyze_stl e il result del job le leggono senza
+    riparsare lo STL. `request` (object_type, categoria, qualità, $fn,
+    bounding box della richiesta generate_3d) serve al riuso automatico.
+    Se il sidecar esistente descrive già la stessa mesh per la stessa
+    richiesta (hit dell'artifact store) non si ricalcola nulla.
     """
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    cache_file = CACHE_DIR / f"{prompt_key}.scad"
-    if not cache_file.exists():
+    if not config.get("stl_meta", True):
         return None
-    age = datetime.now() - datetime.fromtimestamp(cache_file.stat().st_mtime)
-    if age > timedelta(days=CACHE_MAX_AGE_DAYS):
-        log(f"Cache scaduta ({age.days}g) per {prompt_key[:8]}… — ignoro", "INFO")
+    existing = stl_io.read_meta(stl_path)
+    if (existing and mesh_sha and existing.get("source", {}).get("mesh_sha256") == mesh_sha
+            and existing["source"].get("request") == request):
+        return existing
+    try:
+        source = {
+            "scad_file": Path(scad_path).name,
+            "scad_sha256": scad_canon.canonical_hash(Path(scad_path).read_bytes()),
+            "fn": fn_value,
+            "defines": defines or {},
+            "mesh_sha256": mesh_sha,
+        }
+        if request:
+            source["request"] = request
+        return stl_io.write_meta(stl_path, source=source)
+    except Exception as e:
+        log(f"Sidecar metriche non scritto per {Path(stl_path).name}: {e}", "WARN")
         return None
-    return cache_file.read_text()
 
 
-def _save_prompt_cache(prompt_key: str, scad_code: str):
-    """Salva il codice SCAD nella cache per riuso futuro."""
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    (CACHE_DIR / f"{prompt_key}.scad").write_text(scad_code)
+def do_compile_scad(scad_path, output_name, config, fn_value=None, defines=None, request=None):
+    """
+    Compila un file .scad in .stl tramite openscad. Ritorna dict con risultato.
+    Se lo stesso sorgente è già stato compilato (artifact store, chiave su
+    sorgente canonico + $fn + formato + versione OpenSCAD + override -D + contenuto
+    delle dipendenze include/use/import) lo STL è un hardlink al
+    blob esistente; altrimenti la compilazione gira sul compile executor
+    (max compile_workers in parallelo) e la mesh entra nello store.
+    Dopo ogni compilazione riuscita le metriche finiscono nel sidecar .meta.json.
+    """
+    scad_path = Path(scad_path)
+    MODELS_STL_DIR.mkdir(parents=True, exist_ok=True)
+
+    stem = Path(output_name).stem if output_name else scad_path.stem
+    stl_path = MODELS_STL_DIR / f"{stem}.stl"
 
+    use_store = config.get("artifact_store", True)
+    key = None
+    if use_store:
+        try:
+            deps = artifact_store.dependency_digest(scad_path)
+            if deps is None:
+                log(f"Artifact store saltato per {scad_path.name}: dipendenza include/use/import non risolvibile")
+            else:
+                key = artifact_store.compile_key(
+                    scad_path.read_bytes(), fn_value, config.get("stl_format", "asciistl"),
+                    _openscad_version(config), defines, deps,
+                )
+            hit = artifact_store.lookup(key) if key else None
+            if hit and artifact_store.materialize(hit, stl_path):
+                log(f"♻️ STL già compilato ({hit['sha'][:8]}…) → {stl_path.name} — skip OpenSCAD")
+                _write_stl_meta(stl_path, scad_path, config, fn_value, defines, hit["sha"], request)
+                return {
+                    "stl_file": str(stl_path),
+                    "success": True,
+                    "compile_log": hit["compile_log"],
+                    "file_size_kb": round(hit["size"] / 1024, 2),
+                    "from_artifact": True,
+                }
+        except OSError as e:
+            log(f"Artifact store non disponibile: {e}", "WARN")
+            key = None
+
+    future = _get_compile_executor(config).submit(_run_openscad_job, scad_path, stl_path, config, defines)
+    result = future.result()
+
+    mesh_sha = None
+    if key and result["success"]:
+        try:
+            mesh_sha = artifact_store.store(key, stl_path, result.get("compile_log", ""))
+        except Exception as e:
+            log(f"Artifact store: salvataggio fallito: {e}", "WARN")
+    if result["success"]:
+        _write_stl_meta(stl_path, scad_path, config, fn_value, defines, mesh_sha, request)
+    return result
 
-def _check_ram_warning():
-    """Logga un warning se la RAM disponibile è inferiore a 2 GB."""
-    if not _HAS_PSUTIL:
+
+# =========================
+# CACHE GENERAZIONE
+# =========================
+
+# Da incrementare quando cambia il formato del prompt utente / della chiave
+CACHE_KEY_VERSION = 2
+
+
+class GenerationCache:
+    """
+    Cache dei codici generati: cartella cache/ ({chiave}.scad) con davanti
+    un LRU in memoria. Due budget in byte:
+    - cache_memory_mb: LRU in RAM, eviction del meno usato
+    - cache_disk_mb  : cartella cache/; l'mtime del file viene aggiornato a
+      ogni hit, quindi l'eviction su disco è per ultimo accesso
+    Le entry non lette da cache_max_age_days giorni vengono scartate.
+    Contatori hit/miss/eviction in status/cache_stats.json (dashboard):
+    scritti a ogni put/discard, da get() al più ogni CACHE_STATS_INTERVAL
+    secondi e da flush_stats() a fine ciclo; mai tenendo il lock.
+    """
+
+    def __init__(self, directory, stats_file, suffix=".scad"):
+        self.dir = Path(directory)
+        self.stats_file = Path(stats_file)
+        self.suffix = suffix
+        self.memory_bytes = 16 * 1024 * 1024
+        self.disk_bytes = 256 * 1024 * 1024
+        self.max_age = CACHE_MAX_AGE_DAYS * 86400
+        self._lock = threading.RLock()
+        self._mem = OrderedDict()       # chiave → testo (ultimo usato in fondo)
+        self._mem_used = 0
+        self._disk = None               # chiave → (ultimo accesso, byte), caricato al primo uso
+        self._disk_used = 0
+        self.counters = {
+            "hits_memory": 0, "hits_disk": 0, "misses": 0, "expired": 0,
+            "stores": 0, "evictions_memory": 0, "evictions_disk": 0,
+        }
+        self.since = datetime.now().isoformat()
+        self._stats_lock = threading.Lock()  # serializza le scritture del file, non i lookup
+        self._stats_written = 0.0
+        self._stats_dirty = False
+
+    def configure(self, config, prefix="cache", memory_mb=16, disk_mb=256):
+        """Budget da config: {prefix}_memory_mb, {prefix}_disk_mb, {prefix}_max_age_days."""
+        self.memory_bytes = int(config.get(f"{prefix}_memory_mb", memory_mb) * 1024 * 1024)
+        self.disk_bytes = int(config.get(f"{prefix}_disk_mb", disk_mb) * 1024 * 1024)
+        self.max_age = float(config.get(f"{prefix}_max_age_days", CACHE_MAX_AGE_DAYS)) * 86400
+
+    def _path(self, key):
+        return self.dir / f"{key}{self.suffix}"
+
+    def _load_index(self):
+        if self._disk is not None:
+            return
+        entries = []
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with os.scandir(self.dir) as it:
+            for entry in it:
+                if entry.name.endswith(self.suffix) and entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name[:-len(self.suffix)], st.st_size))
+        entries.sort()
+        self._disk = OrderedDict((key, (mtime, size)) for mtime, key, size in entries)
+        self._disk_used = sum(size for _, _, size in entries)
+
+    def _drop_disk(self, key, unlink=True):
+        _, size = self._disk.pop(key, (0, 0))
+        self._disk_used -= size
+        if unlink:
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def _forget(self, key):
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_used -= len(old.encode())
+
+    def _remember(self, key, text):
+        # Budget in byte UTF-8 come su disco, non in caratteri
+        self._forget(key)
+        self._mem[key] = text
+        self._mem_used += len(text.encode())
+        while self._mem_used > self.memory_bytes and len(self._mem) > 1:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_used -= len(evicted.encode())
+            self.counters["evictions_memory"] += 1
+
+    def _touch(self, key):
+        now = time.time()
+        size = self._disk[key][1]
+        self._disk[key] = (now, size)
+        self._disk.move_to_end(key)
+        try:
+            os.utime(self._path(key), (now, now))
+        except OSError:
+            pass
+
+    def get(self, key):
+        with self._lock:
+            self._load_index()
+            if key in self._disk and time.time() - self._disk[key][0] > self.max_age:
+                self._forget(key)
+                self._drop_disk(key)
+                self.counters["expired"] += 1
+            text = self._mem.get(key)
+            if text is not None:
+                self._mem.move_to_end(key)
+                if key in self._disk:
+                    self._touch(key)
+                self.counters["hits_memory"] += 1
+            elif key in self._disk:
+                try:
+                    text = self._path(key).read_text()
+                except OSError:
+                    # Rimosso da fuori (cleanup_cache.py)
+                    self._drop_disk(key, unlink=False)
+                else:
+                    self._touch(key)
+                    self._remember(key, text)
+                    self.counters["hits_disk"] += 1
+            if text is None:
+                self.counters["misses"] += 1
+            self._stats_dirty = True
+            due = time.time() - self._stats_written >= CACHE_STATS_INTERVAL
+        if due:
+            self._write_stats()
+        return text
+
+    def peek(self, key):
+        """Testo in cache senza aggiornare contatori né ordine LRU."""
+        with self._lock:
+            text = self._mem.get(key)
+            if text is not None:
+                return text
+            self._load_index()
+            if key not in self._disk:
+                return None
+            try:
+                return self._path(key).read_text()
+            except OSError:
+                return None
+
+    def discard(self, key):
+        with self._lock:
+            self._load_index()
+            self._forget(key)
+            self._drop_disk(key)
+        self._write_stats()
+
+    def put(self, key, text):
+        with self._lock:
+            self._load_index()
+            path = self._path(key)
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(text)
+            os.replace(tmp, path)
+            if key in self._disk:
+                self._drop_disk(key, unlink=False)
+            self._disk[key] = (time.time(), path.stat().st_size)
+            self._disk_used += self._disk[key][1]
+            self._remember(key, text)
+            self.counters["stores"] += 1
+            while self._disk_used > self.disk_bytes and len(self._disk) > 1:
+                oldest = next(iter(self._disk))
+                self._forget(oldest)
+                self._drop_disk(oldest)
+                self.counters["evictions_disk"] += 1
+        self._write_stats()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits_memory"] + self.counters["hits_disk"] + self.counters["misses"]
+            hits = self.counters["hits_memory"] + self.counters["hits_disk"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "memory_entries": len(self._mem),
+                "memory_kb": round(self._mem_used / 1024, 1),
+                "disk_entries": len(self._disk or ()),
+                "disk_kb": round(self._disk_used / 1024, 1),
+                "memory_budget_kb": self.memory_bytes // 1024,
+                "disk_budget_kb": self.disk_bytes // 1024,
+                "since": self.since,
+                "updated_at": datetime.now().isoformat(),
+            }
+
+    def flush_stats(self):
+        """Scrive le statistiche se get() ne ha rimandato la scrittura."""
+        if self._stats_dirty:
+            self._write_stats()
+
+    def _write_stats(self):
+        with self._stats_lock:
+            with self._lock:
+                data = self.stats()
+                self._stats_written = time.time()
+                self._stats_dirty = False
+            try:
+                self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.stats_file.with_name(f"{self.stats_file.name}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(data, indent=2))
+                os.replace(tmp, self.stats_file)
+            except OSError:
+                pass
+
+
+_GEN_CACHE = GenerationCache(CACHE_DIR, CACHE_STATS_FILE)
+# Template per il riuso parametrico: {chiave famiglia}.json con SCAD,
+# parametri della generazione originale e binding parametro → variabile
+_TEMPLATE_CACHE = GenerationCache(TEMPLATES_DIR, TEMPLATE_STATS_FILE, suffix=".json")
+# Risposte LLM dei task bash/python/file/prompt: {chiave}.json
+_RESPONSE_CACHE = GenerationCache(RESPONSES_DIR, RESPONSE_STATS_FILE, suffix=".json")
+
+
+def _canonical_text(text):
+    """Descrizione normalizzata: Unicode NFC, minuscole, spazi compattati, senza punto finale."""
+    text = unicodedata.normalize("NFC", str(text or "")).casefold()
+    return re.sub(r"\s+", " ", text).strip().rstrip(".").strip()
+
+
+_MEASURE_RE = re.compile(r"(?<![\w.,])(m?)(\d+(?:[.,]\d+)?)\s*(mm|cm|°|%)?")
+
+
+def _description_measures(text):
+    """Misure della descrizione in ordine ("vite M6 30 mm" → "m6 30mm"): numeri, unità e filetti M."""
+    text = re.sub(r"(\d)\s*[x×]\s*(?=\d)", r"\1 ", _canonical_text(text))
+    return " ".join(
+        f"{prefix}{number.replace(',', '.')}{unit}" for prefix, number, unit in _MEASURE_RE.findall(text)
+    )
+
+
+def _canonical_value(value):
+    if isinstance(value, dict):
+        return {str(k).strip(): _canonical_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(v) for v in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return int(value) if float(value).is_integer() else round(float(value), 6)
+    return re.sub(r"\s+", " ", str(value)).strip()
+
+
+def _prompt_layer_versions(object_type, description="", object_category=""):
+    """
+    Hash (12 hex) di ogni layer del system prompt effettivamente usato:
+    modificare objects/gears.txt invalida solo le entry che lo includono.
+    """
+    layers = {
+        "base_system.txt": _load_prompt_file("base_system.txt"),
+        "structure": _STRUCTURE_PROMPT,
+        f"{object_type}.txt": _load_prompt_file(f"{object_type}.txt"),
+    }
+    specialized = _specialized_prompt_name(description, object_category)
+    if specialized:
+        layers[f"objects/{specialized}.txt"] = _load_prompt_file(f"objects/{specialized}.txt")
+    return {name: hashlib.sha1(text.encode()).hexdigest()[:12] for name, text in layers.items()}
+
+
+def _generation_cache_key(description, parameters, object_type, object_category, fn_value, dims):
+    """Chiave cache da forma canonica di descrizione/parametri + versioni dei layer di prompt."""
+    material = {
+        "v": CACHE_KEY_VERSION,
+        "description": _canonical_text(description),
+        "parameters": _canonical_value(parameters or {}),
+        "object_type": object_type,
+        "fn": fn_value,
+        "dims": _canonical_value(dims),
+        "layers": _prompt_layer_versions(object_type, description, object_category),
+    }
+    blob = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+
+def _template_key(description, parameters, object_type, object_category, fn_value, dims):
+    """Chiave della famiglia parametrica: come la chiave cache ma con i soli nomi dei parametri."""
+    names = sorted(str(k).strip() for k in (parameters or {}))
+    return _generation_cache_key(description, {"_template": names}, object_type, object_category, fn_value, dims)
+
+
+def _check_prompt_cache(cache_key, config):
+    """Codice SCAD in cache per la chiave (LRU in memoria → cache/), altrimenti None."""
+    _GEN_CACHE.configure(config)
+    return _GEN_CACHE.get(cache_key)
+
+
+_SEMANTIC = semantic_cache.SemanticCache()
+
+
+def _semantic_enabled(config):
+    return config.get("semantic_cache", True) and _SEMANTIC.available
+
+
+def _check_semantic_cache(job, config):
+    """
+    Descrizione con significato quasi uguale a una generazione riuscita:
+    - score >= semantic_cache_threshold e stesso contesto (parametri,
+      misure citate nella descrizione, categoria, tipo, qualità,
+      dimensioni) → ritorna quel codice (hit)
+    - score >= semantic_seed_threshold e stesso object_type → il codice
+      diventa il punto di partenza per l'LLM (job["seed"])
+    """
+    if not _semantic_enabled(config) or job["retry"]:
+        return None
+    matches = _SEMANTIC.search(_canonical_text(job["description"]), config, object_type=job["object_type"])
+    if not matches:
+        _SEMANTIC.record("misses")
+        return None
+    hit_at = float(config.get("semantic_cache_threshold", 0.92))
+    seed_at = float(config.get("semantic_seed_threshold", 0.8))
+    for score, entry in matches:
+        if score < seed_at:
+            break
+        code = _GEN_CACHE.peek(entry["cache_key"])
+        if code is None:
+            _SEMANTIC.discard(entry["cache_key"])
+            continue
+        if score >= hit_at and entry["context"] == job["semantic_context"]:
+            log(f"🧠 Cache semantica: \"{entry['description'][:50]}\" ({score:.3f})")
+            job["semantic_match"] = {"score": round(score, 3), "description": entry["description"]}
+            # La nuova formulazione diventa un hit esatto la prossima volta
+            _GEN_CACHE.put(job["cache_key"], code)
+            _SEMANTIC.record("hits")
+            return code
+        if job["seed"] is None:
+            log(f"🧠 Punto di partenza: \"{entry['description'][:50]}\" ({score:.3f})")
+            job["seed"] = code
+            job["semantic_match"] = {"score": round(score, 3), "description": entry["description"], "seed": True}
+    _SEMANTIC.record("seeds" if job["seed"] else "misses")
+    return None
+
+
+def _save_semantic_cache(job, config):
+    if not _semantic_enabled(config):
+        return
+    _SEMANTIC.add(_canonical_text(job["description"]), config, job["cache_key"],
+                  job["semantic_context"], job["object_type"], job["description"])
+
+
+def _save_prompt_cache(cache_key, scad_code, config):
+    """
+    Salva il codice SCAD nella cache per riuso futuro. Se la chiave ha già
+    un codice equivalente (scad_canon: es. due task identici in pipeline)
+    si tiene quello esistente.
+    """
+    _GEN_CACHE.configure(config)
+    existing = _GEN_CACHE.peek(cache_key)
+    if existing is not None and scad_canon.equivalent(existing, scad_code):
+        return
+    _GEN_CACHE.put(cache_key, scad_code)
+
+# =========================
+# CACHE RISPOSTE LLM
+# =========================
+
+def _response_key(task_type, model, prompt):
+    """Chiave da tipo task, modello e prompt normalizzato (spazi per riga, righe vuote)."""
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in unicodedata.normalize("NFC", prompt).splitlines())
+    material = {
+        "v": CACHE_KEY_VERSION,
+        "type": task_type,
+        "model": model,
+        "prompt": "\n".join(line for line in lines if line),
+    }
+    blob = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+
+def _ask_cached(task, llm_prompt, config, result, expect="text"):
+    """
+    ask_ollama con cache delle risposte per i task bash/python/file/prompt.
+    Ritorna (testo, chiave): chiave None se la cache è disattivata
+    (config "response_cache": false o task "cache": false).
+    Scadenza dalla creazione: response_cache_ttl_hours, per task "cache_ttl_hours".
+    """
+    task_type = task.get("type", "prompt")
+    model = route_model(task, config)
+    key = None
+    if config.get("response_cache", True) and task.get("cache", True) is not False:
+        key = _response_key(task_type, model, llm_prompt)
+        _RESPONSE_CACHE.configure(config, prefix="response_cache", memory_mb=4, disk_mb=32)
+        ttl_hours = float(task.get("cache_ttl_hours", config.get("response_cache_ttl_hours", 168)))
+        raw = _RESPONSE_CACHE.get(key)
+        entry = None
+        if raw is not None:
+            try:
+                entry = json.loads(raw)
+                age = time.time() - datetime.fromisoformat(entry["created_at"]).timestamp()
+            except (ValueError, KeyError, TypeError):
+                entry, age = None, None
+            if entry is None or age > ttl_hours * 3600:
+                _RESPONSE_CACHE.discard(key)
+                entry = None
+        if entry is not None:
+            log(f"💾 Risposta in cache per {task_type} ({key[:8]}…) — skip Ollama")
+            result["response_cache"] = "hit"
+            result["llm_stats"] = []
+            return entry["response"], key
+        result["response_cache"] = "miss"
+    stats = {}
+    text = ask_ollama(llm_prompt, config, expect=expect, model=model, stats=stats)
+    result["llm_stats"] = [stats] if stats else []
+    return text, key
+
+
+def _settle_response(key, text, success, result):
+    """
+    Salva la risposta se il task è riuscito; se una risposta presa dalla
+    cache ha fatto fallire il task la scarta, così il retry chiede all'LLM.
+    """
+    if key is None:
+        return
+    if result.get("response_cache") == "hit":
+        if not success:
+            log(f"🗑️ Risposta in cache ({key[:8]}…) non più valida — scartata", "WARN")
+            _RESPONSE_CACHE.discard(key)
+        return
+    if success and text:
+        entry = {
+            "type": result.get("type"),
+            "created_at": datetime.now().isoformat(),
+            "response": text,
+        }
+        _RESPONSE_CACHE.put(key, json.dumps(entry, ensure_ascii=False))
+
+
+# =========================
+# RIUSO PARAMETRICO
+# =========================
+
+def _bind_parameters(scad_code, parameters):
+    """
+    Associa i parametri del task alle variabili top-level del codice generato:
+    stesso nome (anche senza maiuscole) oppure stesso valore, unico, con una
+    parte del nome in comune (jar_d = 55 ↔ jar_diameter = 55). Solo variabili
+    a valore letterale, quindi sovrascrivibili con -D. Ritorna {parametro: variabile}.
+    """
+    try:
+        variables = scad_canon.literal_assignments(scad_code)
+    except scad_canon.ScadSyntaxError:
+        return {}
+    values = {name: scad_canon.literal(value) for name, value in parameters.items()}
+    bindings, used = {}, set()
+    for name, value in values.items():
+        candidates = [v for v in variables if v == name] or [v for v in variables if v.lower() == name.lower()]
+        if not candidates and list(values.values()).count(value) == 1:
+            parts = set(name.lower().split("_"))
+            candidates = [v for v in variables
+                          if variables[v] == value and parts & set(v.lower().split("_"))]
+        candidates = [v for v in candidates if v not in used and variables[v] == value]
+        if len(candidates) == 1:
+            bindings[name] = candidates[0]
+            used.add(candidates[0])
+    return bindings
+
+
+def _llm_generated(job):
+    """True se il codice viene dall'LLM (non da cache, template, libreria o modello riusato)."""
+    return not (job["from_cache"] or job["from_template"] or job["generator"] or job["reused_model"])
+
+
+def _request_provenance(job):
+    """Richiesta generate_3d che ha prodotto uno STL, salvata nel sidecar."""
+    return {
+        "object_type": job["object_type"],
+        "category": job["category"],
+        "quality": job["quality"],
+        "fn": job["fn_value"],
+        "dims": _canonical_value(job["dims"]),
+    }
+
+
+def _reuse_similar_model(job, config):
+    """
+    Cerca nell'indice modelli già generati per richieste simili.
+    similarity_reuse: "off" | "suggest" (solo log + campo `similar` nel
+    result) | "auto" (sopra soglia riusa lo SCAD del modello migliore, che
+    l'artifact store ricompila in un hardlink). Ritorna True se riusato.
+    In "auto" il riuso richiede parametri, misure, categoria e object_type
+    identici e, dal sidecar .meta.json, la stessa richiesta (qualità, $fn,
+    bounding box) e gli override -D della compilazione originale;
+    altrimenti lo SCAD del modello è solo il punto di partenza per l'LLM.
+    """
+    mode = config.get("similarity_reuse", "suggest")
+    if mode not in ("suggest", "auto") or job["retry"]:
+        return False
+    try:
+        matches = model_index.lookup(
+            job["description"], job["category"], job["object_type"], job["parameters"],
+            threshold=float(config.get("similarity_threshold", 0.9)), limit=3,
+        )
+    except Exception as e:
+        log(f"Model index non disponibile: {e}", "WARN")
+        return False
+    job["similar"] = [{"stl_file": m["stl_file"], "score": m["score"], "task_id": m["task_id"]} for m in matches]
+    if not matches:
+        return False
+    log(f"🔎 Modelli simili a {job['task_id']}: "
+        + ", ".join(f"{m['stl_file']} ({m['score']:.2f})" for m in matches))
+    if mode != "auto":
+        return False
+    request = _request_provenance(job)
+    for best in matches:
+        if not best["scad_file"]:
+            continue
+        try:
+            scad_code = Path(best["scad_file"]).read_text()
+        except OSError:
+            continue
+        source = (stl_io.read_meta(MODELS_STL_DIR / best["stl_file"]) or {}).get("source") or {}
+        if (source.get("request") == request
+                and model_index.same_request(job["description"], job["parameters"], best,
+                                             job["category"], job["object_type"])):
+            break
+        if not job["seed"]:
+            job["seed"] = scad_code
+    else:
+        log("🔎 Nessun modello simile per la stessa richiesta (qualità, misure, tipo) "
+            "o provenienza ignota — solo punto di partenza per l'LLM")
+        return False
+    job["scad_code"] = scad_code
+    job["defines"] = dict(source.get("defines") or {})
+    job["reused_model"] = best["stl_file"]
+    log(f"🔎 Riuso {best['stl_file']} per {job['task_id']} — skip Ollama")
+    return True
+
+
+def _index_model(job, stl_file, config):
+    """Aggiunge lo STL appena prodotto all'indice di similarità."""
+    if config.get("similarity_reuse", "suggest") == "off":
+        return
+    try:
+        model_index.add(
+            stl_file, description=job["description"], category=job["category"],
+            object_type=job["object_type"], parameters=job["parameters"],
+            scad_file=job["scad_path"], task_id=job["task_id"],
+        )
+    except Exception as e:
+        log(f"Model index: {Path(stl_file).name} non indicizzato: {e}", "WARN")
+
+
+def _library_scad(job, config):
+    """
+    (nome generatore, codice) da scad_library per la prima categoria candidata
+    (object_category esplicita, poi keyword) con tutti i parametri richiesti.
+    Una categoria dedotta dalle keyword vale solo se la descrizione non chiede
+    dettagli che il generatore non modella (cerniere, slot, loghi...).
+    Saltato sui retry: se il codice della libreria fallisce si passa all'LLM.
+    """
+    if not config.get("scad_library", True) or job["retry"]:
+        return None
+    seen = set()
+    for source, category in _specialized_prompt_candidates(job["description"], job["object_category"]):
+        if category in seen:
+            continue
+        seen.add(category)
+        if source == "keyword":
+            extra = scad_library.extra_words(category, job["description"])
+            if extra:
+                log(f"📚 Generatori {category} non usati: la descrizione chiede anche {', '.join(extra[:5])}")
+                continue
+        generated = scad_library.generate(category, job["description"], job["parameters"], job["fn_value"])
+        if generated:
+            return generated
+    return None
+
+
+def _find_parametric_template(job, config):
+    """
+    Generazione riuscita della stessa famiglia (descrizione/tipo/qualità e
+    stessi nomi di parametri) i cui parametri diversi sono tutti legati a
+    variabili top-level. Ritorna (codice SCAD, {variabile: letterale}) o None.
+    """
+    if not config.get("parametric_reuse", True) or not job["parameters"] or job["retry"]:
+        return None
+    _TEMPLATE_CACHE.configure(config)
+    raw = _TEMPLATE_CACHE.get(job["template_key"])
+    if not raw:
+        return None
+    try:
+        template = json.loads(raw)
+    except ValueError:
+        _TEMPLATE_CACHE.discard(job["template_key"])
+        return None
+    defines = {}
+    for name, value in _canonical_value(job["parameters"]).items():
+        if value == template["parameters"].get(name):
+            continue
+        variable = template["bindings"].get(name)
+        if variable is None:
+            log(f"🧩 Template {job['template_key'][:8]}… senza variabile per '{name}' — serve l'LLM")
+            return None
+        defines[variable] = scad_canon.literal(value)
+    return template["scad"], defines
+
+
+def _save_parametric_template(job, scad_code, config):
+    """Registra il codice di una generazione riuscita come template della sua famiglia."""
+    if not config.get("parametric_reuse", True) or not job["parameters"]:
+        return
+    parameters = _canonical_value(job["parameters"])
+    bindings = _bind_parameters(scad_code, parameters)
+    if not bindings:
         return
+    _TEMPLATE_CACHE.configure(config)
+    _TEMPLATE_CACHE.put(job["template_key"], json.dumps({
+        "scad": scad_code,
+        "parameters": parameters,
+        "bindings": bindings,
+        "source_task": job["task_id"],
+    }, ensure_ascii=False))
+    log(f"🧩 Template parametrico salvato ({len(bindings)}/{len(parameters)} parametri legati)")
+
+
+def _check_ram_warning(quiet=False):
+    """
+    Logga un warning se la RAM disponibile è inferiore a 2 GB.
+    Ritorna i MB disponibili (None senza psutil).
+    """
+    if not _HAS_PSUTIL:
+        return None
     try:
         mem = psutil.virtual_memory()
         available_mb = mem.available // (1024 * 1024)
-        if available_mb < 2048:
+        if available_mb < RAM_WARN_MB and not quiet:
             log(f"⚠️ RAM bassa ({available_mb} MB disponibile) — Ollama potrebbe essere lento", "WARN")
+        return available_mb
     except Exception:
-        pass
+        return None
 
 
 def _fmt_duration(seconds: float) -> str:
@@ -511,7 +1715,12 @@ def _fmt_duration(seconds: float) -> str:
     return f"{seconds:.1f}s"
 
 
-def handle_generate_3d(task, task_id, config):
+def _prepare_generate_3d(task, task_id, config):
+    """
+    Prepara il job generate_3d: normalizza i campi del task e costruisce
+    system prompt, prompt utente e chiave cache. Ritorna il dict del job
+    che viene passato tra gli stage (LLM → salvataggio SCAD → compilazione → post).
+    """
     description = task.get("description", "")
     parameters = task.get("parameters", {})
     object_type = task.get("object_type", "simple")
@@ -540,38 +1749,144 @@ def handle_generate_3d(task, task_id, config):
     )
     user_prompt = "\n".join(user_parts)
 
-    # Calcola la chiave cache come MD5 del prompt completo (system + user)
-    full_prompt = (system_prompt or "") + "\n\n" + user_prompt
-    prompt_md5 = hashlib.md5(full_prompt.encode()).hexdigest()
+    # Chiave cache: forma canonica di descrizione/parametri + versioni dei layer di prompt
+    cache_key = _generation_cache_key(description, parameters, object_type, object_category, fn_value, dims)
+    # Contesto per la cache semantica: tutto tranne il testo libero della descrizione.
+    # Le misure restano: "cubo 20mm" e "cubo 30mm" hanno embedding quasi uguali
+    semantic_context = _generation_cache_key(
+        _description_measures(description), parameters, object_type, object_category, fn_value, dims,
+    )
+
+    return {
+        "task_id": task_id,
+        "description": description,
+        "parameters": parameters,
+        "object_category": object_category,
+        "category": object_category or _specialized_prompt_name(description, object_category),
+        "retry": task.get("_retry", 0),
+        "template_key": _template_key(description, parameters, object_type, object_category, fn_value, dims),
+        "defines": {},
+        "object_type": object_type,
+        "quality": quality,
+        "fn_value": fn_value,
+        "dims": dims,
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "cache_key": cache_key,
+        "semantic_context": semantic_context,
+        "semantic_match": None,
+        "seed": None,
+        "model": task.get("model"),
+        "raw_response": None,
+        "llm_stats": [],
+        "scad_code": None,
+        "from_cache": False,
+        "from_template": False,
+        "generator": None,
+        "similar": [],
+        "reused_model": None,
+        "llm_secs": 0.0,
+        "compile_secs": 0.0,
+        "auto_corrected": False,
+        "auto_repaired": None,
+        "result": None,
+    }
+
+
+def _generate_3d_llm_stage(job, config):
+    """
+    Stage LLM: cache check oppure chiamata Ollama.
+    Imposta job["scad_code"]; in caso di errore imposta job["result"] (task fallito).
+    """
+    task_id = job["task_id"]
+    cache_key = job["cache_key"]
 
     # ── Cache check ────────────────────────────────────────────────────────
-    from_cache = False
-    cached_scad = _check_prompt_cache(prompt_md5)
+    cached_scad = _check_prompt_cache(cache_key, config)
     if cached_scad:
-        log(f"💾 Cache hit per {task_id} ({prompt_md5[:8]}…) — skip Ollama")
-        scad_code = cached_scad
-        llm_secs = 0.0
-        from_cache = True
-    else:
-        # ── RAM warning prima di chiamare Ollama ───────────────────────────
-        _check_ram_warning()
+        log(f"💾 Cache hit per {task_id} ({cache_key[:8]}…) — skip Ollama")
+        job["scad_code"] = cached_scad
+        job["from_cache"] = True
+        return job
+
+    # ── Libreria parametrica: codice deterministico per categorie note ─────
+    generated = _library_scad(job, config)
+    if generated:
+        job["generator"], job["scad_code"] = generated
+        log(f"📚 {task_id}: generatore {job['generator']} (scad_library) — skip Ollama")
+        return job
+
+    # ── Riuso parametrico: stesso oggetto, altri valori → openscad -D ───────
+    template = _find_parametric_template(job, config)
+    if template:
+        job["scad_code"], job["defines"] = template
+        job["from_template"] = True
+        overrides = ", ".join(f"{k}={v}" for k, v in job["defines"].items()) or "nessun override"
+        log(f"🧩 Riuso parametrico per {task_id} ({overrides}) — skip Ollama")
+        return job
+
+    # ── Cache semantica: stessa richiesta formulata in altro modo ───────────
+    # Dopo libreria e template: l'embedding costa una chiamata a Ollama
+    cached_scad = _check_semantic_cache(job, config)
+    if cached_scad:
+        log(f"💾 Cache semantica per {task_id} — skip Ollama")
+        job["scad_code"] = cached_scad
+        job["from_cache"] = True
+        return job
+
+    # ── Modelli già generati per richieste simili (model_index) ─────────────
+    if _reuse_similar_model(job, config):
+        return job
+
+    # ── RAM warning prima di chiamare Ollama ───────────────────────────────
+    _check_ram_warning()
+
+    if job["seed"]:
+        # Dopo il prefisso condiviso: la KV cache del system prompt resta valida
+        job["user_prompt"] += (
+            "\n\nCodice di partenza (oggetto simile già generato): adattalo alla richiesta.\n"
+            + job["seed"]
+        )
+
+    log(f"🤖 Chiamata Ollama per generate_3d (type={job['object_type']}, "
+        f"quality={job['quality']}, fn={job['fn_value']})")
+    t_llm_start = time.time()
+    job["model"] = route_model({
+        "type": "generate_3d", "object_type": job["object_type"],
+        "quality": job["quality"], "model": job["model"],
+    }, config)
+    stats = {}
+    raw_response = ask_ollama(job["user_prompt"], config, system_prompt=job["system_prompt"],
+                              expect="scad", model=job["model"], stats=stats)
+    llm_secs = round(time.time() - t_llm_start, 1)
+    job["llm_secs"] = llm_secs
+    job["raw_response"] = raw_response
+    log(f"⏱️ Tempo LLM: {_fmt_duration(llm_secs)}")
+    if stats:
+        job["llm_stats"].append(stats)
+        log(f"📊 LLM: {_fmt_llm_stats(stats)}")
+
+    if not raw_response:
+        job["result"] = {
+            "success": False,
+            "description": job["description"],
+            "object_type": job["object_type"],
+            "quality": job["quality"],
+            "error_message": "Nessuna risposta da Ollama",
+            "scad_file": None,
+            "stl_file": None,
+            "timing": {"llm_s": llm_secs, "compile_s": 0, "total_s": llm_secs},
+            "llm_stats": job["llm_stats"],
+        }
+        return job
 
-        log(f"🤖 Chiamata Ollama per generate_3d (type={object_type}, quality={quality}, fn={fn_value})")
-        t_llm_start = time.time()
-        raw_response = ask_ollama(user_prompt, config, system_prompt=system_prompt)
-        llm_secs = round(time.time() - t_llm_start, 1)
-        log(f"⏱️ Tempo LLM: {_fmt_duration(llm_secs)}")
+    job["scad_code"] = clean_llm(raw_response)
+    return job
 
-        if not raw_response:
-            return {
-                "success": False,
-                "error_message": "Nessuna risposta da Ollama",
-                "scad_file": None,
-                "stl_file": None,
-                "timing": {"llm_s": llm_secs, "compile_s": 0, "total_s": llm_secs},
-            }
 
-        scad_code = clean_llm(raw_response)
+def _generate_3d_save_stage(job):
+    """Stage salvataggio: validazione leggera e scrittura del file .scad."""
+    scad_code = job["scad_code"]
 
     # Validazione pre-compilazione: controlla presenza di primitivi OpenSCAD o moduli
     geom_primitives = ("cube(", "cylinder(", "sphere(", "polyhedron(", "module ")
@@ -581,48 +1896,140 @@ def handle_generate_3d(task, task_id, config):
     # Salva il file .scad
     MODELS_SCAD_DIR.mkdir(parents=True, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    scad_filename = f"{task_id}_{timestamp}.scad"
+    scad_filename = f"{job['task_id']}_{timestamp}.scad"
     scad_path = MODELS_SCAD_DIR / scad_filename
+    if job["defines"]:
+        # Il sorgente resta quello del template: i valori del task sono override -D
+        header = " ".join(f"-D {k}={v}" for k, v in job["defines"].items())
+        scad_code = f"// Riuso parametrico: openscad {header}\n{scad_code}"
     scad_path.write_text(scad_code)
     log(f"💾 SCAD salvato: {scad_path}")
 
+    job["scad_filename"] = scad_filename
+    job["scad_path"] = scad_path
+    return job
+
+
+def _auto_repair(job, compile_result, config):
+    """
+    Correzioni deterministiche (scad_repair) prima dell'LLM: ogni candidato
+    viene scritto e ricompilato, fino a auto_repair_attempts tentativi.
+    Ritorna (compile_result, secondi, nome correzione o None); se nessuna
+    correzione funziona il file .scad torna al codice originale.
+    """
+    scad_path = job["scad_path"]
+    scad_code = job["scad_code"]
+    error_msg = compile_result.get("compile_log", "")
+    sig, found = scad_repair.candidates(scad_code, error_msg, limit=int(config.get("auto_repair_attempts", 3)))
+    secs = 0.0
+    for name, fixed_code in found:
+        log(f"🩹 Correzione automatica {name} — ricompilo")
+        scad_path.write_text(fixed_code)
+        t0 = time.time()
+        result = do_compile_scad(scad_path, job["scad_filename"], config, fn_value=job["fn_value"],
+                                 request=_request_provenance(job))
+        secs += round(time.time() - t0, 1)
+        scad_repair.record(sig, name, result["success"])
+        if result["success"]:
+            log(f"🩹 Errore risolto senza LLM ({name})")
+            job["scad_code"] = fixed_code
+            return result, secs, name
+    if found:
+        scad_path.write_text(scad_code)
+    return compile_result, secs, None
+
+
+def _generate_3d_compile_stage(job, config):
+    """Stage compilazione: OpenSCAD, correzioni deterministiche, eventuale auto-correzione via Ollama."""
+    scad_path = job["scad_path"]
+    scad_filename = job["scad_filename"]
+    scad_code = job["scad_code"]
+
     # Compilazione principale
     t_compile_start = time.time()
-    compile_result = do_compile_scad(scad_path, scad_filename, config)
+    compile_result = do_compile_scad(scad_path, scad_filename, config, fn_value=job["fn_value"],
+                                     defines=job["defines"], request=_request_provenance(job))
     compile_secs = round(time.time() - t_compile_start, 1)
     log(f"⏱️ Tempo compilazione OpenSCAD: {_fmt_duration(compile_secs)}")
 
-    # Auto-correzione: se la compilazione fallisce, invia codice + errore a Ollama
+    # Errori ricorrenti: correzioni a regole/patch apprese, ricompilazione in secondi
     auto_corrected = False
-    if not compile_result["success"] and not from_cache:
+    auto_repaired = None
+    error_sig = None
+    if not compile_result["success"] and _llm_generated(job) and config.get("auto_repair", True):
+        error_sig = scad_repair.observe(compile_result.get("compile_log", ""))
+        if error_sig:
+            compile_result, repair_secs, auto_repaired = _auto_repair(job, compile_result, config)
+            compile_secs += repair_secs
+
+    # Auto-correzione: se la compilazione fallisce ancora, invia codice + errore a Ollama
+    if not compile_result["success"] and _llm_generated(job):
         error_msg = compile_result.get("compile_log", "errore sconosciuto")
         log(f"🔧 Compilazione fallita — tentativo auto-correzione")
+        # Follow-up della stessa conversazione: system + richiesta + risposta
+        # sono già nella KV cache di Ollama, va valutato solo l'errore
+        history = [
+            {"role": "user", "content": job["user_prompt"]},
+            {"role": "assistant", "content": job.get("raw_response") or scad_code},
+        ]
         correction_prompt = (
-            f"Il seguente codice OpenSCAD genera questo errore:\n"
+            f"Il codice OpenSCAD che hai scritto genera questo errore:\n"
             f"{error_msg}\n\n"
-            f"Codice originale:\n{scad_code}\n\n"
             f"Correggi il codice. Rispondi SOLO con il codice OpenSCAD corretto e completo."
         )
         _check_ram_warning()
         t_corr_start = time.time()
-        corrected_raw = ask_ollama(correction_prompt, config, system_prompt=system_prompt)
-        llm_secs += round(time.time() - t_corr_start, 1)
+        stats = {}
+        corrected_raw = ask_ollama(correction_prompt, config, system_prompt=job["system_prompt"],
+                                   expect="scad", model=job["model"], history=history, stats=stats)
+        job["llm_secs"] += round(time.time() - t_corr_start, 1)
+        if stats:
+            job["llm_stats"].append(stats)
+            log(f"📊 LLM (correzione): {_fmt_llm_stats(stats)}")
         if corrected_raw:
             corrected_code = clean_llm(corrected_raw)
-            if corrected_code and corrected_code != scad_code:
+            # Una "correzione" che cambia solo spazi/commenti fallirebbe identica
+            if corrected_code and not scad_canon.equivalent(corrected_code, scad_code):
                 scad_path.write_text(corrected_code)
                 t_c2 = time.time()
-                compile_result = do_compile_scad(scad_path, scad_filename, config)
+                compile_result = do_compile_scad(scad_path, scad_filename, config, fn_value=job["fn_value"],
+                                                 request=_request_provenance(job))
                 compile_secs += round(time.time() - t_c2, 1)
                 auto_corrected = True
                 if compile_result["success"]:
                     log("🔧 Auto-correzione applicata con successo")
+                    # Correzione di poche righe: diventa una patch per questa firma
+                    if scad_repair.learn(error_sig, scad_code, corrected_code):
+                        log("🩹 Correzione memorizzata per errori con la stessa firma")
                 else:
                     log("🔧 Auto-correzione applicata — compilazione ancora fallita", "WARN")
+        if not compile_result["success"]:
+            scad_repair.unresolved(error_sig)
+
+    job["compile_result"] = compile_result
+    job["compile_secs"] = compile_secs
+    job["auto_corrected"] = auto_corrected
+    job["auto_repaired"] = auto_repaired
+    return job
+
+
+def _generate_3d_post_stage(job, config):
+    """Stage post-processing: salvataggio cache, bounding box, dict risultato."""
+    compile_result = job["compile_result"]
+    scad_path = job["scad_path"]
+    llm_secs = round(job["llm_secs"], 1)
+    compile_secs = job["compile_secs"]
 
     # Salva in cache se la compilazione è riuscita (e non era già in cache)
-    if compile_result["success"] and not from_cache:
-        _save_prompt_cache(prompt_md5, scad_path.read_text())
+    if compile_result["success"] and _llm_generated(job):
+        scad_code = scad_path.read_text()
+        _save_prompt_cache(job["cache_key"], scad_code, config)
+        _save_parametric_template(job, scad_code, config)
+        _save_semantic_cache(job, config)
+    elif job["from_template"] and not compile_result["success"]:
+        # Override non compatibili con il template: il retry passa dall'LLM
+        log(f"🧩 Template {job['template_key'][:8]}… scartato: compilazione con -D fallita", "WARN")
+        _TEMPLATE_CACHE.discard(job["template_key"])
 
     # Estrazione bounding box
     dimensions = None
@@ -630,28 +2037,55 @@ def handle_generate_3d(task, task_id, config):
         dimensions = _extract_bounding_box_from_stl(compile_result["stl_file"])
         if dimensions:
             log(f"📐 Bounding box: {dimensions['x']}×{dimensions['y']}×{dimensions['z']} mm")
+        if not job["reused_model"]:
+            _index_model(job, compile_result["stl_file"], config)
 
     total_secs = round(llm_secs + compile_secs, 1)
     log(f"⏱️ Totale: {_fmt_duration(total_secs)} (LLM {_fmt_duration(llm_secs)} + SCAD {_fmt_duration(compile_secs)})")
 
     return {
         "success": compile_result["success"],
+        "description": job["description"],
+        "parameters": job["parameters"],
+        "object_category": job["object_category"],
+        "category": job["category"],
+        "object_type": job["object_type"],
+        "quality": job["quality"],
         "scad_file": str(scad_path),
         "stl_file": compile_result.get("stl_file"),
         "error_message": None if compile_result["success"] else compile_result.get("compile_log", ""),
         "compile_log": compile_result.get("compile_log", ""),
         "file_size_kb": compile_result.get("file_size_kb", 0),
-        "auto_corrected": auto_corrected,
-        "from_cache": from_cache,
+        "auto_corrected": job["auto_corrected"],
+        "auto_repaired": job["auto_repaired"],
+        "from_cache": job["from_cache"],
+        "from_template": job["from_template"],
+        "generator": job["generator"],
+        "reused_model": job["reused_model"],
+        "similar": job["similar"],
+        "semantic_match": job["semantic_match"],
+        "defines": job["defines"],
         "dimensions": dimensions,
         "timing": {
             "llm_s":     llm_secs,
             "compile_s": compile_secs,
             "total_s":   total_secs,
         },
+        "llm_stats": job["llm_stats"],
     }
 
 
+def handle_generate_3d(task, task_id, config):
+    """Esecuzione seriale di tutti gli stage generate_3d (usata fuori dalla pipeline)."""
+    job = _prepare_generate_3d(task, task_id, config)
+    _generate_3d_llm_stage(job, config)
+    if job["result"] is not None:
+        return job["result"]
+    _generate_3d_save_stage(job)
+    _generate_3d_compile_stage(job, config)
+    return _generate_3d_post_stage(job, config)
+
+
 def handle_compile_scad(task, config):
     scad_file = task.get("scad_file", "")
     output_name = task.get("output_name")
@@ -684,6 +2118,27 @@ def handle_validate_scad(task, config):
     openscad_bin = config.get("openscad_binary", "openscad")
     timeout = config.get("openscad_timeout", 300)
 
+    # Esito già noto per un file identico (byte grezzi: i range del customizer
+    # sono commenti) con le stesse dipendenze include/use/import.
+    key = None
+    if config.get("artifact_store", True):
+        try:
+            deps = artifact_store.dependency_digest(scad_path)
+            if deps is not None:
+                key = artifact_store.validation_key(scad_path.read_bytes(), _openscad_version(config), deps)
+            hit = artifact_store.lookup_validation(key) if key else None
+            if hit:
+                res, cached_file = hit
+                log(f"♻️ Validazione già nota per {scad_path.name} (identico a {Path(cached_file).name})")
+                return {
+                    "valid": res["valid"],
+                    "warnings": [l.replace(cached_file, str(scad_path)) for l in res["warnings"]],
+                    "errors": [l.replace(cached_file, str(scad_path)) for l in res["errors"]],
+                    "cached_from": cached_file,
+                }
+        except OSError:
+            key = None
+
     try:
         p = subprocess.run(
             [openscad_bin, "--check-parameter-ranges", str(scad_path)],
@@ -695,13 +2150,137 @@ def handle_validate_scad(task, config):
         lines = output.splitlines() if output else []
         warnings = [l for l in lines if "WARNING" in l.upper()]
         errors = [l for l in lines if "ERROR" in l.upper()]
-        return {"valid": p.returncode == 0, "warnings": warnings, "errors": errors}
+        res = {"valid": p.returncode == 0, "warnings": warnings, "errors": errors}
+        if key:
+            try:
+                artifact_store.store_validation(key, scad_path, res)
+            except Exception as e:
+                log(f"Artifact store: validazione non salvata: {e}", "WARN")
+        return res
     except subprocess.TimeoutExpired:
         return {"valid": False, "warnings": [], "errors": [f"Timeout after {timeout}s"]}
     except FileNotFoundError:
         return {"valid": False, "warnings": [], "errors": ["openscad binary not found"]}
 
 
+def _variant_sets(task):
+    """
+    Set di parametri di un generate_variants: lista esplicita `variants`
+    seguita dal prodotto cartesiano di `grid` ({nome: [valori]}).
+    """
+    sets = [dict(v) for v in task.get("variants", []) if isinstance(v, dict)]
+    grid = task.get("grid") or {}
+    if grid:
+        names = list(grid)
+        axes = [v if isinstance(v, list) else [v] for v in grid.values()]
+        sets.extend(dict(zip(names, combo)) for combo in itertools.product(*axes))
+    return sets
+
+
+def _variant_stem(prefix, index, params):
+    """Nome file della variante: prefisso_v03_w12_h25 (solo caratteri sicuri)."""
+    tag = "_".join(f"{k}{v}" for k, v in params.items())
+    tag = re.sub(r"[^A-Za-z0-9.-]+", "_", tag).strip("_")[:60]
+    return f"{prefix}_v{index:02d}" + (f"_{tag}" if tag else "")
+
+
+def _variants_source(task):
+    """Ritorna (scad_path, override base, errore) da scad_file o dal result di source_task."""
+    base_defines = {}
+    scad_file = task.get("scad_file", "")
+    source_task = task.get("source_task")
+    if not scad_file and source_task:
+        done = [r for r in results_store.for_task(source_task) if r.get("success") and r.get("scad_file")]
+        if not done:
+            return None, {}, f"Nessun generate_3d riuscito per source_task '{source_task}'"
+        scad_file = done[0]["scad_file"]
+        base_defines = done[0].get("defines") or {}
+    if not scad_file:
+        return None, {}, "scad_file o source_task mancante"
+    scad_path = Path(scad_file).expanduser()
+    if not scad_path.exists():
+        return None, {}, f"File non trovato: {scad_path}"
+    return scad_path, base_defines, None
+
+
+def handle_generate_variants(task, task_id, config):
+    """
+    Compila lo stesso SCAD con più set di parametri (override -D), fino a
+    compile_workers varianti in parallelo, senza chiamare l'LLM.
+    Ogni variante ha il suo STL e le sue metriche; il task riesce se
+    riescono tutte.
+    """
+    scad_path, base_defines, error = _variants_source(task)
+    if error:
+        return {"success": False, "variants": [], "error_message": error}
+
+    sets = _variant_sets(task)
+    max_variants = int(config.get("max_variants", 50))
+    if not sets:
+        return {"success": False, "variants": [], "error_message": "Nessuna variante (variants o grid)"}
+    if len(sets) > max_variants:
+        return {
+            "success": False, "variants": [],
+            "error_message": f"{len(sets)} varianti, massimo {max_variants} (max_variants)",
+        }
+
+    try:
+        known = scad_canon.literal_assignments(scad_path.read_text())
+    except scad_canon.ScadSyntaxError:
+        known = {}
+    prefix = Path(task.get("output_name") or scad_path.stem).stem
+
+    def build(index, params):
+        defines = dict(base_defines)
+        defines.update({name: scad_canon.literal(value) for name, value in params.items()})
+        t0 = time.time()
+        res = do_compile_scad(scad_path, _variant_stem(prefix, index, params), config, defines=defines)
+        variant = {
+            "index": index,
+            "parameters": params,
+            "success": res["success"],
+            "stl_file": res.get("stl_file"),
+            "file_size_kb": res.get("file_size_kb", 0),
+            "from_artifact": res.get("from_artifact", False),
+            "compile_s": round(time.time() - t0, 1),
+            "dimensions": _extract_bounding_box_from_stl(res["stl_file"]) if res["success"] else None,
+        }
+        unknown = [name for name in params if name not in known]
+        if unknown:
+            variant["unknown_parameters"] = unknown
+        if not res["success"]:
+            variant["error_message"] = res.get("compile_log", "")
+        return variant
+
+    unknown = sorted({name for params in sets for name in params if name not in known})
+    if unknown:
+        log(f"⚠️ Parametri senza variabile top-level in {scad_path.name}: {', '.join(unknown)}", "WARN")
+
+    log(f"🧬 {len(sets)} varianti di {scad_path.name} (fino a {_compile_workers(config)} in parallelo)")
+    t_start = time.time()
+    with ThreadPoolExecutor(max_workers=min(len(sets), _compile_workers(config)),
+                            thread_name_prefix="variants") as pool:
+        variants = list(pool.map(build, range(1, len(sets) + 1), sets))
+    total_secs = round(time.time() - t_start, 1)
+
+    ok = sum(1 for v in variants if v["success"])
+    log(f"🧬 Varianti: {ok}/{len(variants)} compilate in {_fmt_duration(total_secs)}")
+    return {
+        "success": ok == len(variants),
+        "scad_file": str(scad_path),
+        "variants": variants,
+        "summary": {
+            "total": len(variants),
+            "succeeded": ok,
+            "failed": len(variants) - ok,
+            "from_artifact": sum(1 for v in variants if v["from_artifact"]),
+            "total_size_kb": round(sum(v["file_size_kb"] for v in variants), 2),
+        },
+        "error_message": None if ok == len(variants) else f"{len(variants) - ok} varianti fallite",
+        "timing": {"llm_s": 0, "compile_s": total_secs, "total_s": total_secs},
+    }
+
+
 def handle_list_models():
     if not MODELS_STL_DIR.exists():
         return {"models": []}
@@ -733,107 +2312,153 @@ def should_stop(task, task_type, success, config):
     return False
 
 
-def process_task(task_file, config):
-    with open(task_file) as f:
-        task = json.load(f)
+def _read_task(task_file):
+    """Legge il JSON di un task; ritorna None se il file è sparito o non valido."""
+    try:
+        with open(task_file) as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def process_task(task_file, config, task=None):
+    if task is None:
+        with open(task_file) as f:
+            task = json.load(f)
 
     task_id = task.get("id", task_file.stem)
     task_type = task.get("type", "prompt")
-    retry = task.get("_retry", 0)
 
     log(f"▶ Task {task_id} [{task_type}]")
     update_status(task_id, task_type, "running")
 
-    result = {"task_id": task_id, "type": task_type}
+    result = {"task_id": task_id, "type": task_type, "started_at": datetime.now().isoformat()}
     success = False
 
-    # ---- 3D TASK TYPES ----
-
-    if task_type == "generate_3d":
-        res = handle_generate_3d(task, task_id, config)
-        result.update(res)
-        success = res.get("success", False)
-
-    elif task_type == "compile_scad":
-        res = handle_compile_scad(task, config)
-        result.update(res)
-        success = res.get("success", False)
-
-    elif task_type == "validate_scad":
-        res = handle_validate_scad(task, config)
-        result.update(res)
-        success = res.get("valid", False)
-
-    elif task_type == "list_models":
-        res = handle_list_models()
-        result.update(res)
-        success = True
-
-    # ---- LEGACY TASK TYPES ----
-
-    elif task_type == "bash":
-        prompt = task.get("prompt", "")
-        llm_prompt = (
-            "RISPONDI SOLO CON IL COMANDO, NIENTE ALTRO.\n"
-            "NO introduzioni, NO spiegazioni, NO commenti, NO markdown.\n"
-            "Genera il comando bash per:\n"
-            f"{prompt}"
-        )
-        llm = ask_ollama(llm_prompt, config)
-        cmd = clean_llm(llm).splitlines()[0]
-        res = exec_bash(cmd)
-        result["steps"] = [{"cmd": cmd, "result": res}]
-        success = res["success"]
-
-    elif task_type == "python":
-        prompt = task.get("prompt", "")
-        llm_prompt = (
-            "RISPONDI SOLO CON IL CODICE, NIENTE ALTRO.\n"
-            "NO introduzioni, NO spiegazioni, NO markdown ```.\n"
-            "Scrivi il codice python per:\n"
-            f"{prompt}"
-        )
-        llm = ask_ollama(llm_prompt, config)
-        code = clean_llm(llm)
-        res = exec_python(code)
-        result["steps"] = [{"code": code, "result": res}]
-        success = res["success"]
-
-    elif task_type == "file":
-        user_prompt = task.get("prompt", "")
-        llm_prompt = (
-            "RISPONDI SOLO CON IL CONTENUTO DEL FILE, NIENTE ALTRO.\n"
-            "NO introduzioni come 'Ecco', 'Certamente', 'Here is'.\n"
-            "NO spiegazioni finali, NO markdown ```.\n"
-            f"{user_prompt}"
-        )
-        content = ask_ollama(llm_prompt, config)
-        res = write_file(task["filepath"], clean_llm(content))
-        result["steps"] = [res]
-        success = res["success"]
-
-    elif task_type == "test":
-        res = exec_bash(task.get("test_command", ""))
-        expected = task.get("expected", "")
-        actual = res.get("stdout", "").strip()
-        success = expected in actual if expected else res["success"]
-        result["steps"] = [{"expected": expected, "actual": actual}]
-
-    elif task_type == "prompt":
-        prompt = task.get("prompt", "")
-        response = ask_ollama(prompt, config)
-        result["response"] = response
-        success = response is not None
+    try:
+        # ---- 3D TASK TYPES ----
+
+        if task_type == "generate_3d":
+            res = handle_generate_3d(task, task_id, config)
+            result.update(res)
+            success = res.get("success", False)
+
+        elif task_type == "compile_scad":
+            res = handle_compile_scad(task, config)
+            result.update(res)
+            success = res.get("success", False)
+
+        elif task_type == "validate_scad":
+            res = handle_validate_scad(task, config)
+            result.update(res)
+            success = res.get("valid", False)
+
+        elif task_type == "generate_variants":
+            res = handle_generate_variants(task, task_id, config)
+            result.update(res)
+            success = res.get("success", False)
+
+        elif task_type == "list_models":
+            res = handle_list_models()
+            result.update(res)
+            success = True
+
+        # ---- LEGACY TASK TYPES ----
+
+        elif task_type == "bash":
+            prompt = task.get("prompt", "")
+            llm_prompt = (
+                "RISPONDI SOLO CON IL COMANDO, NIENTE ALTRO.\n"
+                "NO introduzioni, NO spiegazioni, NO commenti, NO markdown.\n"
+                "Genera il comando bash per:\n"
+                f"{prompt}"
+            )
+            llm, cache_key = _ask_cached(task, llm_prompt, config, result, expect="code")
+            lines = clean_llm(llm).splitlines()
+            cmd = lines[0] if lines else ""
+            res = exec_bash(cmd) if cmd else {"success": False, "error": "Nessun comando da Ollama"}
+            result["steps"] = [{"cmd": cmd, "result": res}]
+            success = res["success"]
+            _settle_response(cache_key, llm, success, result)
+
+        elif task_type == "python":
+            prompt = task.get("prompt", "")
+            llm_prompt = (
+                "RISPONDI SOLO CON IL CODICE, NIENTE ALTRO.\n"
+                "NO introduzioni, NO spiegazioni, NO markdown ```.\n"
+                "Scrivi il codice python per:\n"
+                f"{prompt}"
+            )
+            llm, cache_key = _ask_cached(task, llm_prompt, config, result, expect="code")
+            code = clean_llm(llm)
+            res = exec_python(code) if code else {"success": False, "error": "Nessun codice da Ollama"}
+            result["steps"] = [{"code": code, "result": res}]
+            success = res["success"]
+            _settle_response(cache_key, llm, success, result)
+
+        elif task_type == "file":
+            user_prompt = task.get("prompt", "")
+            llm_prompt = (
+                "RISPONDI SOLO CON IL CONTENUTO DEL FILE, NIENTE ALTRO.\n"
+                "NO introduzioni come 'Ecco', 'Certamente', 'Here is'.\n"
+                "NO spiegazioni finali, NO markdown ```.\n"
+                f"{user_prompt}"
+            )
+            content, cache_key = _ask_cached(task, llm_prompt, config, result)
+            res = write_file(task["filepath"], clean_llm(content))
+            result["steps"] = [res]
+            success = res["success"]
+            _settle_response(cache_key, content, success, result)
+
+        elif task_type == "test":
+            res = exec_bash(task.get("test_command", ""))
+            expected = task.get("expected", "")
+            actual = res.get("stdout", "").strip()
+            success = expected in actual if expected else res["success"]
+            result["steps"] = [{"expected": expected, "actual": actual}]
+
+        elif task_type == "prompt":
+            prompt = task.get("prompt", "")
+            response, cache_key = _ask_cached(task, prompt, config, result)
+            result["response"] = response
+            success = response is not None
+            _settle_response(cache_key, response, success, result)
+
+        else:
+            result["error"] = f"Unknown task type: {task_type}"
+    except Exception as e:
+        # Handler fallito (payload incompleto, I/O): result di errore e retry
+        # come per un fallimento normale, invece di lasciare il task 'running'
+        log(f"Errore task {task_id}: {e}", "ERROR")
+        result["error"] = f"{type(e).__name__}: {e}"
+        success = False
+
+    res = _finish_task(task_file, task, result, success, config)
+    update_status(None, None, "idle")
+    return res
 
-    else:
-        result["error"] = f"Unknown task type: {task_type}"
+
+def _finish_task(task_file, task, result, success, config):
+    """Salva il result JSON, gestisce retry/spostamento in done/ e ritorna {"stop": bool}."""
+    task_id = result["task_id"]
+    task_type = result["type"]
+    retry = task.get("_retry", 0)
 
     # ---- RESULT ----
 
     result["success"] = success
-    RESULTS_DIR.mkdir(exist_ok=True)
-    with open(RESULTS_DIR / f"{task_id}_{int(time.time())}.json", "w") as f:
-        json.dump(result, f, indent=2)
+    result["finished_at"] = datetime.now().isoformat()
+    result_name = f"{task_id}_{int(time.time())}.json"
+    try:
+        results_store.save(result, name=result_name)
+    except Exception as e:
+        # Archivio non disponibile (disco pieno, lock): non perdere il result
+        log(f"Results DB error: {e} — salvo il result come JSON", "ERROR")
+        config = {**config, "results_write_json": True}
+    if config.get("results_write_json"):
+        RESULTS_DIR.mkdir(exist_ok=True)
+        with open(RESULTS_DIR / result_name, "w") as f:
+            json.dump(result, f, indent=2)
 
     stop = should_stop(task, task_type, success, config)
 
@@ -841,6 +2466,7 @@ def process_task(task_file, config):
         task["_retry"] = retry + 1
         with open(task_file, "w") as f:
             json.dump(task, f, indent=2)
+        task_queue.release(task_file.name, task, tasks_dir=task_file.parent)
         log(f"🔁 Retry {task['_retry']}/{config['max_retries']} for {task_id}", "WARN")
         return {"stop": stop}
 
@@ -848,27 +2474,426 @@ def process_task(task_file, config):
     done = TASKS_DIR / "done"
     done.mkdir(exist_ok=True)
     task_file.rename(done / task_file.name)
+    task_queue.complete(task_file.name)
 
     log(f"{'✅' if success else '❌'} Task {task_id}")
-    update_status(None, None, "idle")
 
     return {"stop": stop}
 
 # =========================
-# MAIN LOOP
+# PIPELINE 3D
+# =========================
+
+_PIPELINE_DONE = object()
+
+
+class Pipeline3D:
+    """
+    Pipeline a stage per i task generate_3d e compile_scad:
+
+      LLM (Ollama) → salvataggio SCAD → compilazione OpenSCAD → post-processing
+
+    Lo stage LLM gira in un thread dedicato, lo stage di compilazione in
+    compile_workers thread (le compilazioni passano dal compile executor), e gli
+    stage sono collegati da code limitate (pipeline_queue_size): mentre il task N
+    compila, il task N+1 è già in generazione su Ollama. I compile_scad entrano
+    direttamente nello stage di compilazione. Lo stage post scrive i result e
+    sposta i task in done/ esattamente come process_task.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        qsize = max(1, int(config.get("pipeline_queue_size", 2)))
+        self._n_compile = _compile_workers(config)
+        self._llm_q = queue.Queue(maxsize=qsize)
+        self._compile_q = queue.Queue(maxsize=max(qsize, self._n_compile))
+        self._post_q = queue.Queue(maxsize=qsize)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self.stopped = False
+        self._threads = [threading.Thread(target=self._llm_loop, name="pipeline-llm", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._compile_loop, name=f"pipeline-compile-{i}", daemon=True)
+            for i in range(self._n_compile)
+        ]
+        self._threads.append(threading.Thread(target=self._post_loop, name="pipeline-post", daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def submit(self, task_file, task):
+        """Accoda un task generate_3d/compile_scad (blocca se lo stage di ingresso è saturo)."""
+        with self._cond:
+            self._in_flight += 1
+        item = {
+            "task_file": task_file,
+            "task": task,
+            "task_id": task.get("id", task_file.stem),
+            "type": task.get("type"),
+            "started_at": None,
+            "job": None,
+            "result": None,
+        }
+        if item["type"] == "compile_scad":
+            self._compile_q.put(item)
+        else:
+            self._llm_q.put(item)
+
+    def drain(self):
+        """Attende che tutti i task accodati siano completati. Ritorna True se un gate ha fermato la coda."""
+        with self._cond:
+            while self._in_flight > 0:
+                self._cond.wait()
+        return self.stopped
+
+    def close(self):
+        self._llm_q.put(_PIPELINE_DONE)
+        for t in self._threads:
+            t.join()
+
+    # ---- stage ----
+
+    def _skip(self, item):
+        """Task non eseguito perché la pipeline è stata fermata: resta in tasks/."""
+        log(f"⏭️ Task {item['task_id']} non eseguito (pipeline fermata)", "WARN")
+        task_queue.release(item["task_file"].name)
+        self._done()
+
+    def _done(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _fail(self, item, stage, exc):
+        log(f"Pipeline: errore stage {stage} per {item['task_id']}: {exc}", "ERROR")
+        item["result"] = {
+            "success": False,
+            "error_message": f"Errore stage {stage}: {exc}",
+            "scad_file": None,
+            "stl_file": None,
+        }
+        self._post_q.put(item)
+
+    def _llm_loop(self):
+        while True:
+            item = self._llm_q.get()
+            if item is _PIPELINE_DONE:
+                for _ in range(self._n_compile):
+                    self._compile_q.put(_PIPELINE_DONE)
+                return
+            if self.stopped:
+                self._skip(item)
+                continue
+            task_id = item["task_id"]
+            item["started_at"] = datetime.now().isoformat()
+            log(f"▶ Task {task_id} [generate_3d] (pipeline)")
+            update_status(task_id, "generate_3d", "running", progress="llm")
+            try:
+                job = _prepare_generate_3d(item["task"], task_id, self.config)
+                item["job"] = job
+                _generate_3d_llm_stage(job, self.config)
+                if job["result"] is not None:
+                    item["result"] = job["result"]
+                    self._post_q.put(item)
+                    continue
+                _generate_3d_save_stage(job)
+            except Exception as e:
+                self._fail(item, "llm", e)
+                continue
+            self._compile_q.put(item)
+
+    def _compile_loop(self):
+        while True:
+            item = self._compile_q.get()
+            if item is _PIPELINE_DONE:
+                self._post_q.put(_PIPELINE_DONE)
+                return
+            if self.stopped:
+                self._skip(item)
+                continue
+            update_status(item["task_id"], item["type"], "running", progress="compile")
+            try:
+                if item["type"] == "compile_scad":
+                    item["started_at"] = datetime.now().isoformat()
+                    log(f"▶ Task {item['task_id']} [compile_scad] (pipeline)")
+                    item["result"] = handle_compile_scad(item["task"], self.config)
+                else:
+                    _generate_3d_compile_stage(item["job"], self.config)
+            except Exception as e:
+                self._fail(item, "compile", e)
+                continue
+            self._post_q.put(item)
+
+    def _post_loop(self):
+        remaining = self._n_compile
+        while True:
+            item = self._post_q.get()
+            if item is _PIPELINE_DONE:
+                remaining -= 1
+                if remaining == 0:
+                    return
+                continue
+            try:
+                res = item["result"]
+                if res is None:
+                    res = _generate_3d_post_stage(item["job"], self.config)
+                result = {"task_id": item["task_id"], "type": item["type"], "started_at": item["started_at"]}
+                result.update(res)
+                outcome = _finish_task(
+                    item["task_file"], item["task"], result, res.get("success", False), self.config
+                )
+                if outcome.get("stop"):
+                    self.stopped = True
+            except Exception as e:
+                log(f"Pipeline: errore stage post per {item['task_id']}: {e}", "ERROR")
+                if item["task_file"].exists():
+                    task_queue.release(item["task_file"].name)
+            finally:
+                self._done()
+
 # =========================
+# TASK WATCHER
+# =========================
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_ARRIVAL = _IN_CLOSE_WRITE | _IN_MOVED_TO
+_INOTIFY_EVENT = struct.Struct("iIII")
+
 
-def get_pending():
-    tasks = []
-    for f in TASKS_DIR.glob("*.json"):
+class TaskWatcher:
+    """
+    Sveglia il worker appena un .json arriva in tasks/.
+
+    Usa inotify (via libc, nessuna dipendenza esterna) su IN_CLOSE_WRITE e
+    IN_MOVED_TO; se inotify non è disponibile ripiega su un polling leggero
+    della directory (solo nomi e mtime, nessun parsing JSON).
+    wait(timeout) ritorna True se è arrivato un task, False allo scadere del timeout.
+    I nomi dei file toccati (anche rimossi/spostati) si accumulano e vengono
+    restituiti da pop_changes() per la sync incrementale dell'indice coda.
+    """
+
+    def __init__(self, directory, poll_interval=1.0, debounce=0.05):
+        self.directory = Path(directory)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._fd = None
+        self._snapshot = None
+        self._changes = set()
+        self.mode = "polling"
+        self.directory.mkdir(parents=True, exist_ok=True)
         try:
-            with open(f) as jf:
-                prio = json.load(jf).get("priority", 10)
-        except Exception:
-            prio = 10
-        tasks.append((prio, f))
-    tasks.sort(key=lambda x: x[0])
-    return [t[1] for t in tasks]
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            wd = libc.inotify_add_watch(
+                fd, str(self.directory).encode(), _IN_ARRIVAL | _IN_MOVED_FROM | _IN_DELETE
+            )
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch")
+            self._fd = fd
+            self.mode = "inotify"
+        except (OSError, AttributeError) as e:
+            log(f"inotify non disponibile ({e}) — uso polling ogni {poll_interval}s", "WARN")
+            self._snapshot = self._scan()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def pop_changes(self):
+        """Nomi dei task .json cambiati dall'ultima chiamata."""
+        if self._fd is not None:
+            self._read_events()
+        changes, self._changes = self._changes, set()
+        return changes
+
+    def wait(self, timeout):
+        if self._fd is not None:
+            return self._wait_inotify(timeout)
+        return self._wait_polling(timeout)
+
+    @staticmethod
+    def _is_task_name(name):
+        return name.endswith(".json") and not name.startswith("_")
+
+    def _read_events(self):
+        """Legge gli eventi inotify disponibili; True se almeno uno riguarda un task .json."""
+        found = False
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return found
+            if not buf:
+                return found
+            offset = 0
+            while offset + _INOTIFY_EVENT.size <= len(buf):
+                _wd, mask, _cookie, name_len = _INOTIFY_EVENT.unpack_from(buf, offset)
+                offset += _INOTIFY_EVENT.size
+                name = buf[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+                if self._is_task_name(name):
+                    self._changes.add(name)
+                    if mask & _IN_ARRIVAL:
+                        found = True
+
+    def _wait_inotify(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if ready and self._read_events():
+                # Breve debounce: raccoglie gli altri file di un import massivo
+                time.sleep(self.debounce)
+                self._read_events()
+                return True
+
+    def _scan(self):
+        snap = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and self._is_task_name(entry.name):
+                        snap[entry.name] = entry.stat().st_mtime_ns
+        except OSError:
+            pass
+        return snap
+
+    def _wait_polling(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            snap = self._scan()
+            changed = any(self._snapshot.get(name) != mtime for name, mtime in snap.items())
+            self._changes.update(n for n, m in snap.items() if self._snapshot.get(n) != m)
+            self._changes.update(n for n in self._snapshot if n not in snap)
+            self._snapshot = snap
+            if changed:
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+# =========================
+# MAIN LOOP
+# =========================
+
+_LAST_FULL_SYNC = 0.0
+
+
+def get_pending(changed=None, rescan_interval=300, window=None):
+    """
+    Ritorna i task pending ordinati per priorità, letti dall'indice persistente
+    (task_queue). changed = nomi segnalati dal watcher → sync incrementale;
+    altrimenti (o ogni rescan_interval secondi) riallineamento completo.
+    window = al più quanti task leggere (LIMIT sull'indice): payload e
+    raggruppamento per prefisso di prompt costano O(window), non O(coda).
+    """
+    global _LAST_FULL_SYNC
+    now = time.time()
+    if changed is None or now - _LAST_FULL_SYNC >= rescan_interval:
+        task_queue.sync(TASKS_DIR)
+        _LAST_FULL_SYNC = now
+    elif changed:
+        task_queue.sync(TASKS_DIR, names=changed)
+    rows = _group_by_prompt_prefix(task_queue.pending(limit=window))
+    return [TASKS_DIR / row["filename"] for row in rows]
+
+
+_QUALITY_ORDER = {"fast": 0, "medium": 1, "high": 2}
+
+
+def _group_by_prompt_prefix(rows):
+    """
+    Dentro ogni blocco consecutivo di generate_3d con la stessa priorità
+    raggruppa i task con lo stesso system prompt (_prompt_prefix_key), nell'ordine
+    della prima occorrenza: task consecutivi riusano la KV cache del prefisso
+    in Ollama. Dentro un gruppo, ordine per qualità (stesso modello di fila).
+    Gli altri tipi di task (gate, legacy) non vengono spostati.
+    """
+    out, run = [], []
+
+    def flush():
+        groups = {}
+        for row in run:
+            groups.setdefault(_prompt_prefix_key(row["task"]), []).append(row)
+        for group in groups.values():
+            group.sort(key=lambda r: _QUALITY_ORDER.get(r["task"].get("quality"), 1))
+            out.extend(group)
+        run.clear()
+
+    for row in rows:
+        if row["type"] == "generate_3d":
+            if run and run[0]["priority"] != row["priority"]:
+                flush()
+            run.append(row)
+        else:
+            flush()
+            out.append(row)
+    flush()
+    return out
+
+
+def run_pending(pending, config):
+    """
+    Esegue i task pending in ordine di priorità.
+    I generate_3d e compile_scad consecutivi passano dalla Pipeline3D (LLM e
+    OpenSCAD sovrapposti, compilazioni in parallelo); prima di ogni altro tipo
+    di task la pipeline viene svuotata,
+    così gate e task legacy vedono lo stesso ordine dell'esecuzione seriale.
+    Ritorna True se un gate ha fermato la coda.
+    """
+    use_pipeline = config.get("pipeline_enabled", True)
+    pipeline = None
+    try:
+        for task_file in pending:
+            if not task_file.exists():
+                # Rimosso a mano dopo l'ultima sync
+                task_queue.complete(task_file.name)
+                continue
+            task = task_queue.claim(task_file.name) or _read_task(task_file)
+            if use_pipeline and task and task.get("type") in ("generate_3d", "compile_scad"):
+                if pipeline is None:
+                    pipeline = Pipeline3D(config)
+                try:
+                    pipeline.submit(task_file, task)
+                except Exception as e:
+                    log(f"Pipeline: task {task_file.name} non accodato: {e}", "ERROR")
+                    task_queue.release(task_file.name)
+                    continue
+                if pipeline.stopped:
+                    break
+                continue
+
+            if pipeline is not None and pipeline.drain():
+                return True
+            try:
+                res = process_task(task_file, config, task=task)
+            except Exception as e:
+                # Payload illeggibile o result non salvato: il task torna pending
+                # invece di restare 'running' (nascosto) fino al prossimo riavvio
+                log(f"Errore task {task_file.name}: {e} — rimesso in coda", "ERROR")
+                task_queue.release(task_file.name)
+                update_status(None, None, "idle")
+                continue
+            if res.get("stop"):
+                return True
+
+        return pipeline.drain() if pipeline is not None else False
+    finally:
+        if pipeline is not None:
+            pipeline.drain()
+            pipeline.close()
+            update_status(None, None, "idle")
+        for cache in (_GEN_CACHE, _TEMPLATE_CACHE, _RESPONSE_CACHE):
+            cache.flush_stats()
 
 
 def main():
@@ -884,36 +2909,50 @@ def main():
     log("🐼 PANDA 3D Worker avviato" + (" (modalità --once)" if args.once else ""))
     save_default_config()
     update_status()
+    task_queue.reset_running()
 
     if args.once:
         # Modalità test: elabora la coda corrente una sola volta e poi esce
         try:
             config = load_config()
             pending = get_pending()
+            _RESIDENCY.tick(config)
             if not pending:
                 log("Nessun task pending trovato — uscita")
-            for task_file in pending:
-                res = process_task(task_file, config)
-                if res.get("stop"):
-                    log("🛑 Pipeline fermata da gate", "WARN")
-                    break
+            if run_pending(pending, config):
+                log("🛑 Pipeline fermata da gate", "WARN")
         except Exception as e:
             log(f"Errore in modalità --once: {e}", "ERROR")
         log("✅ Modalità --once completata — worker in uscita")
         return
 
+    config = load_config()
+    watcher = None
+    if config.get("watch_tasks", True):
+        watcher = TaskWatcher(TASKS_DIR, poll_interval=config.get("watch_poll_interval", 1.0))
+        log(f"👀 Watcher task: {watcher.mode} su {TASKS_DIR}")
+
     while True:
         try:
             config = load_config()
-            pending = get_pending()
-
-            for task_file in pending:
-                res = process_task(task_file, config)
-                if res.get("stop"):
-                    log("🛑 Pipeline fermata da gate", "WARN")
-                    break
-
-            time.sleep(config["check_interval"])
+            changed = watcher.pop_changes() if watcher is not None else None
+            window = max(1, int(config.get("queue_window", 32)))
+            pending = get_pending(changed, config.get("queue_rescan_interval", 300), window)
+            _RESIDENCY.tick(config)
+
+            stopped = run_pending(pending, config)
+            if stopped:
+                log("🛑 Pipeline fermata da gate", "WARN")
+            _RESIDENCY.tick(config)
+            if len(pending) >= window and not stopped:
+                # Finestra piena: la coda continua, niente attesa
+                continue
+
+            # Attende un nuovo task (evento) oppure check_interval come rescan di sicurezza
+            if watcher is not None:
+                watcher.wait(config["check_interval"])
+            else:
+                time.sleep(config["check_interval"])
 
         except KeyboardInterrupt:
             log("PANDA fermato")
@@ -922,6 +2961,5 @@ def main():
             log(f"Worker crash: {e}", "ERROR")
             time.sleep(10)
 
-
 if __name__ == "__main__":
     main()